@@ -1,4 +1,5 @@
 import os
+import hashlib
 import stripe
 from datetime import timedelta
 from flask import Flask, jsonify, request, send_from_directory
@@ -23,6 +24,20 @@ from migrate_schema_sync import run_schema_sync
 from migrate_partner_status import run_partner_status_migration
 from migrate_user_roles import run_user_roles_migration
 from migrate_create_missing_users import run_create_missing_users_migration
+from migrate_geo_indexes import run_geo_indexes_migration
+from migrate_search_indexes import run_search_indexes_migration
+from migrate_virtual_bookings import run_virtual_bookings_migration
+from migrate_booking_slot_count import run_booking_slot_count_migration
+from migrate_booking_indexes import run_booking_indexes_migration
+from migrate_booking_notifications import run_booking_notifications_migration
+from migrate_booking_feed_index import run_booking_feed_index_migration
+from migrate_flash_stock import run_flash_stock_migration
+from migrate_flash_feed import run_flash_feed_migration
+from migrate_expiry_indexes import run_expiry_indexes_migration
+from migrate_waitlist_index import run_waitlist_index_migration
+from migrate_push_log_indexes import run_push_log_indexes_migration
+from migrate_calendar_token import run_calendar_token_migration
+from migrate_push_fanout_jobs import run_push_fanout_jobs_migration
 # IMPORTANT : Import du blueprint Admin
 from routes_admin_v20_fixed import admin_bp_fixed as admin_bp
 from routes_stripe import stripe_bp
@@ -49,6 +64,19 @@ from routes_ai_coach import ai_coach_bp
 from routes_pricing import pricing_bp
 from routes_subscription import subscription_bp
 from routes_fix_winwin import fix_winwin_bp
+from partner_geo_index import partner_geo_index, format_partner_address, format_branch_address
+from utils.geo_query import GeoQuery
+from partner_clusters import partner_cluster_index
+from partner_search import partner_search_index
+from model_events import on_change
+from geocoding_jobs import geocoding_worker
+from booking_notifications import notification_dispatcher
+from flash_feed import prune_flash_feed
+from flash_stock import flash_stock_flusher
+from expiry_scheduler import expiry_scheduler
+from flash_waitlist import waitlist_promoter
+from proximity_push import proximity_push
+from slot_generator import scheduled_slot_generation
 
 import os
 app = Flask(__name__, static_folder=os.path.join(os.path.dirname(os.path.dirname(__file__)), 'frontend', 'dist'))
@@ -96,6 +124,25 @@ with app.app_context():
     run_user_roles_migration()  # Migration V25: Système de rôles multiples
     run_create_missing_users_migration()  # Migration V26: Créer comptes pour partenaires sans user_id
     db.create_all()
+    run_geo_indexes_migration()  # Migration V27: Index composite pour les recherches de proximité
+    partner_search_index.trigram_available = run_search_indexes_migration()  # Migration V28: Index trigrammes
+    run_virtual_bookings_migration()  # Migration V29: Réservations sans Creneau (mode virtuel)
+    run_booking_slot_count_migration()  # Migration V30: Séries de créneaux réservées
+    run_booking_indexes_migration()  # Migration V31: Pagination des réservations par curseur
+    run_booking_notifications_migration()  # Migration V32: File des notifications de réservation
+    run_booking_feed_index_migration()  # Migration V33: ETag du flux iCalendar
+    run_flash_stock_migration()  # Migration V34: Report différé du stock des offres flash
+    run_flash_feed_migration()  # Migration V35: Fil des offres flash par membre
+    run_expiry_indexes_migration()  # Migration V36: Échéances des offres flash et des activations
+    run_waitlist_index_migration()  # Migration V37: File d'attente des offres flash
+    run_push_log_indexes_migration()  # Migration V38: Plafond quotidien des notifications push
+    run_calendar_token_migration()  # Migration V39: Jeton du flux iCalendar
+    run_push_fanout_jobs_migration()  # Migration V40: File des notifications push
+    try:
+        partner_geo_index.build()  # Index géographique en mémoire pour /api/partners/nearby
+        partner_search_index.build()  # Index texte en mémoire pour l'autocomplétion
+    except Exception as e:
+        print(f"⚠️ Index en mémoire non construits au démarrage: {e}")
 
 # ==========================================
 # 1. ENREGISTREMENT DU BLUEPRINT
@@ -142,9 +189,18 @@ def debug_routes():
 def maintenance():
     with app.app_context():
         Offer.query.filter(Offer.offer_type=='flash', Offer.stock<=0).update({Offer.active: False})
+        prune_flash_feed()  # Offres expirées ou épuisées retirées des fils des membres
         db.session.commit()
 if not app.debug:
-    s = BackgroundScheduler(); s.add_job(maintenance, 'interval', minutes=30); s.start()
+    s = BackgroundScheduler(); s.add_job(maintenance, 'interval', minutes=30)
+    s.add_job(scheduled_slot_generation, 'cron', hour=3, args=[app])  # Créneaux : jours manquants de l'horizon
+    s.start()
+    geocoding_worker.start(app)  # Géocodage des adresses des nouveaux partenaires
+    notification_dispatcher.start(app)  # Confirmations, annulations et rappels de réservation
+    flash_stock_flusher.start(app)  # Report du stock des offres flash réservées
+    expiry_scheduler.start(app)  # Expiration à l'heure exacte des offres flash et des activations
+    waitlist_promoter.start(app)  # Promotion automatique des listes d'attente des offres flash
+    proximity_push.start(app)  # Notifications push de proximité des nouvelles offres flash
 
 def get_user():
     try:
@@ -231,14 +287,74 @@ def webhook():
     return jsonify(success=True)
 
 # --- 🔍 RECHERCHE V2 (OPTIMISÉE & CACHÉE) ---
+# Les clés de cache incluent un compteur de génération (global + par catégorie) :
+# une écriture sur un partenaire ou une offre incrémente les compteurs concernés,
+# les anciennes entrées ne sont plus lues et expirent d'elles-mêmes.
+SEARCH_V2_GENERATION_KEY = 'search_v2_gen/%s'
+
+def _search_v2_cache_key(*args, **kwargs):
+    cat = request.args.get('category', 'all')
+    generations = cache.get_many(SEARCH_V2_GENERATION_KEY % '*', SEARCH_V2_GENERATION_KEY % cat)
+    args_hash = hashlib.md5(str(sorted(request.args.items(multi=True))).encode('utf-8')).hexdigest()
+    return f"search_v2/{cat}/{generations[0] or 0}.{generations[1] or 0}/{args_hash}"
+
+def invalidate_search_v2(categories=None):
+    """Évince les recherches des catégories données (None = toutes)"""
+    keys = [SEARCH_V2_GENERATION_KEY % '*'] if categories is None else \
+        [SEARCH_V2_GENERATION_KEY % category for category in set(categories) | {'all'}]
+    try:
+        for key in keys:
+            # Sans expiration : un compteur remis à zéro ressusciterait d'anciennes entrées
+            cache.set(key, (cache.get(key) or 0) + 1, timeout=0)
+    except Exception as e:
+        print(f"⚠️ Invalidation cache search_v2 impossible: {e}")
+
+@on_change('partners')
+def _invalidate_search_v2_partners(table, changes):
+    categories = set()
+    for change in changes:
+        if 'category' not in change:
+            invalidate_search_v2()
+            return
+        categories.add(change['category'])
+        if 'previous_category' in change:
+            categories.add(change['previous_category'])
+    invalidate_search_v2(categories)
+
+@on_change('offers')
+def _invalidate_search_v2_offers(table, changes):
+    # La catégorie du partenaire est connue de l'index texte (mêmes partenaires que search_v2)
+    categories = set()
+    for change in changes:
+        if change.get('partner_id') is None or partner_search_index.built_at is None:
+            invalidate_search_v2()
+            return
+        partner = partner_search_index.partners.get(change['partner_id'])
+        # Partenaire absent de l'index = sans position GPS, jamais renvoyé par search_v2
+        if partner is not None:
+            categories.add(partner['category'])
+    if categories:
+        invalidate_search_v2(categories)
+
 @app.route('/api/partners/search_v2')
-@cache.cached(timeout=300, query_string=True) # Cache 5 min unique par recherche
+@cache.cached(timeout=300, make_cache_key=_search_v2_cache_key) # Cache 5 min unique par recherche
 def search_v2():
     q = request.args.get('q', '').strip().lower()
     cat = request.args.get('category', 'all')
     
+    # Compteur d'offres actives agrégé en une seule sous-requête (au lieu d'un SELECT par partenaire)
+    offer_counts = db.session.query(
+        Offer.partner_id.label('partner_id'),
+        func.count(Offer.id).filter(Offer.active.is_(True)).label('offer_count')
+    ).group_by(Offer.partner_id).subquery()
+    
     # 1. Optimisation : On ne prend que les partenaires qui ont une position GPS
-    query = Partner.query.filter(Partner.latitude.isnot(None))
+    #    et uniquement les colonnes sérialisées
+    query = db.session.query(
+        Partner.id, Partner.name, Partner.category, Partner.city,
+        Partner.latitude, Partner.longitude, Partner.image_url, Partner.status,
+        func.coalesce(offer_counts.c.offer_count, 0).label('offer_count')
+    ).outerjoin(offer_counts, offer_counts.c.partner_id == Partner.id).filter(Partner.latitude.isnot(None))
     
     # 2. Filtre Catégorie
     if cat != 'all':
@@ -246,10 +362,16 @@ def search_v2():
     
     # 3. Recherche Texte (Nom ou Ville)
     if q:
-        query = query.filter(or_(
-            Partner.name.ilike(f"%{q}%"),
-            Partner.city.ilike(f"%{q}%")
-        ))
+        if partner_search_index.trigram_available:
+            # Servi par les index GIN pg_trgm
+            query = query.filter(or_(
+                Partner.name.ilike(f"%{q}%"),
+                Partner.city.ilike(f"%{q}%")
+            ))
+        else:
+            # Index n-gramme en mémoire
+            ids = partner_search_index.search_ids(q, category=cat if cat != 'all' else None, limit=500)
+            query = query.filter(Partner.id.in_(ids))
     
     # Limite à 500 résultats pour ne pas faire laguer la carte Leaflet
     partners = query.limit(500).all()
@@ -265,9 +387,64 @@ def search_v2():
         "img": p.image_url,
         "is_active": p.status == 'active',  # ✅ AJOUTÉ pour PartnerManagement
         # Compteur d'offres pour filtrage visuel (ex: marqueur gris si 0)
-        "offer_count": len([o for o in p.offers if o.active])
+        "offer_count": p.offer_count
     } for p in partners])
 
+# --- 🔤 AUTOCOMPLÉTION (INDEX EN MÉMOIRE) ---
+@app.route('/api/partners/autocomplete')
+def autocomplete_partners():
+    """
+    Suggestions pour la barre de recherche de la carte
+    Correspondances par préfixe de mot sur le nom, la ville puis la catégorie
+    
+    Query params:
+    - q: Début du texte saisi
+    - limit: Nombre de suggestions (optionnel, défaut: 10, max: 20)
+    """
+    q = request.args.get('q', '').strip()
+    limit = min(request.args.get('limit', default=10, type=int), 20)
+    if not q:
+        return jsonify([])
+    
+    return jsonify([{
+        "id": p['id'],
+        "name": p['name'],
+        "city": p['city'] or "",
+        "category": p['category']
+    } for p in partner_search_index.autocomplete(q, limit)])
+
+# --- 🗺️ CLUSTERS CARTE (AGRÉGATS PAR TUILE) ---
+@app.route('/api/partners/clusters')
+def get_partner_clusters():
+    """
+    Clusters de partenaires pré-agrégés pour la carte Leaflet
+    La taille de la réponse dépend de l'écran, pas du nombre de partenaires
+    
+    Query params:
+    - bbox: min_lng,min_lat,max_lng,max_lat (format de map.getBounds().toBBoxString())
+    - zoom: Niveau de zoom Leaflet
+    """
+    zoom = request.args.get('zoom', type=int)
+    try:
+        min_lng, min_lat, max_lng, max_lat = [float(v) for v in request.args.get('bbox', '').split(',')]
+    except ValueError:
+        return jsonify({'success': False, 'error': 'Paramètre bbox invalide (min_lng,min_lat,max_lng,max_lat)'}), 400
+    if zoom is None:
+        return jsonify({'success': False, 'error': 'Paramètre zoom requis'}), 400
+    
+    try:
+        zoom, clusters = partner_cluster_index.clusters(min_lng, min_lat, max_lng, max_lat, zoom)
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    
+    return jsonify({
+        'success': True,
+        'zoom': zoom,
+        'clusters': clusters,
+        'count': len(clusters),
+        'partners_count': sum(c['count'] for c in clusters)
+    })
+
 # --- 🛠️ SETUP V20 MASSIF ---
 @app.route('/api/setup_v20')
 def setup_v20():
@@ -772,11 +949,96 @@ def submit_privilege_feedback():
         return jsonify({'success': False, 'error': f'Erreur serveur: {str(e)}'}), 500
 
 
+def _serialize_nearby_partner(partner, distance_km, offers_count, branch=None):
+    """
+    Format de réponse commun (index en mémoire ou requête SQL)
+    Position et adresse de l'établissement le plus proche (branch), sinon de l'adresse principale
+    """
+    location = branch or partner
+    return {
+        'id': partner['id'],
+        'name': partner['name'],
+        'category': partner['category'],
+        'city': branch['city'] if branch else partner['city'],
+        'latitude': float(location['latitude']) if location['latitude'] else None,
+        'longitude': float(location['longitude']) if location['longitude'] else None,
+        'image_url': partner['image_url'],
+        'address': format_branch_address(branch) if branch else format_partner_address(partner),
+        'branch_id': branch['id'] if branch else None,
+        'phone': partner['phone'],
+        'website': partner['website'],
+        'status': partner['status'],
+        'distance_km': round(float(distance_km), 2),
+        'distance_m': int(float(distance_km) * 1000),
+        'offers_count': offers_count
+    }
+
+
+def _query_nearby_partners_sql(user_lat, user_lng, radius_km, limit):
+    """Chemin SQL (utilisé si l'index en mémoire est indisponible)"""
+    # Positions principales + établissements : rectangle indexé d'abord,
+    # distance Haversine ensuite sur les survivants, puis le point le plus proche par partenaire
+    geo = GeoQuery(user_lat, user_lng, radius_km)
+    points = geo.nearby_query(
+        select="pt.partner_id, pt.branch_id, pt.branch_street, pt.branch_number, pt.branch_postal_code, pt.branch_city, pt.point_lat, pt.point_lng",
+        from_clause="""(
+            SELECT p.id AS partner_id, NULL::integer AS branch_id, NULL AS branch_street, NULL AS branch_number,
+                   NULL AS branch_postal_code, NULL AS branch_city, p.latitude AS point_lat, p.longitude AS point_lng
+            FROM partners p
+            WHERE p.status = 'active'
+            UNION ALL
+            SELECT pa.partner_id, pa.id, pa.street, pa.number, pa.postal_code, pa.city, pa.latitude, pa.longitude
+            FROM partner_addresses pa
+            JOIN partners p ON p.id = pa.partner_id
+            WHERE p.status = 'active'
+        ) AS pt""",
+        lat_col='pt.point_lat',
+        lng_col='pt.point_lng'
+    )
+    query = text(f"""
+        SELECT p.id, p.name, p.category, p.city, p.latitude, p.longitude, p.image_url,
+            p.address_street, p.address_number, p.address_postal_code, p.address_city,
+            p.phone, p.website, p.status,
+            nearest.branch_id, nearest.branch_street, nearest.branch_number,
+            nearest.branch_postal_code, nearest.branch_city,
+            nearest.point_lat, nearest.point_lng, nearest.distance_km,
+            COALESCE(offer_counts.offers_count, 0) AS offers_count
+        FROM (
+            SELECT DISTINCT ON (partner_id) *
+            FROM ({points}) AS candidates
+            ORDER BY partner_id, distance_km
+        ) AS nearest
+        JOIN partners p ON p.id = nearest.partner_id
+        LEFT JOIN (
+            SELECT partner_id, COUNT(*) AS offers_count
+            FROM offers
+            WHERE active = TRUE
+            GROUP BY partner_id
+        ) AS offer_counts ON offer_counts.partner_id = p.id
+        ORDER BY nearest.distance_km ASC
+        LIMIT :limit
+    """)
+    
+    result = db.session.execute(query, {**geo.params, 'limit': limit}).fetchall()
+    
+    matches = []
+    for row in result:
+        branch = None
+        if row.branch_id is not None:
+            branch = {
+                'id': row.branch_id, 'street': row.branch_street, 'number': row.branch_number,
+                'postal_code': row.branch_postal_code, 'city': row.branch_city,
+                'latitude': row.point_lat, 'longitude': row.point_lng
+            }
+        matches.append((row.distance_km, row._mapping, row.offers_count, branch))
+    return matches
+
+
 @app.route('/api/partners/nearby', methods=['GET'])
 def get_nearby_partners():
     """
     Récupère les partenaires triés par distance depuis la position du membre
-    Utilise la formule Haversine pour calculer la distance
+    Utilise l'index géographique en mémoire (seules les cellules voisines sont parcourues)
     
     Query params:
     - lat: Latitude du membre (obligatoire)
@@ -797,85 +1059,17 @@ def get_nearby_partners():
                 'error': 'Paramètres lat et lng requis'
             }), 400
         
-        # Formule Haversine pour calculer la distance
-        # Distance en km entre deux points GPS
-        query = text("""
-            SELECT * FROM (
-                SELECT 
-                    p.id,
-                    p.name,
-                    p.category,
-                    p.city,
-                    p.latitude,
-                    p.longitude,
-                    p.image_url,
-                    p.address_street,
-                    p.address_number,
-                    p.address_postal_code,
-                    p.address_city,
-                    p.phone,
-                    p.website,
-                    p.status,
-                    (
-                        6371 * acos(
-                            cos(radians(:user_lat)) 
-                            * cos(radians(p.latitude)) 
-                            * cos(radians(p.longitude) - radians(:user_lng)) 
-                            + sin(radians(:user_lat)) 
-                            * sin(radians(p.latitude))
-                        )
-                    ) AS distance_km,
-                    (
-                        SELECT COUNT(*) 
-                        FROM offers o 
-                        WHERE o.partner_id = p.id AND o.active = TRUE
-                    ) AS offers_count
-                FROM partners p
-                WHERE p.latitude IS NOT NULL 
-                    AND p.longitude IS NOT NULL
-                    AND p.status = 'active'
-            ) AS partners_with_distance
-            WHERE distance_km <= :radius_km
-            ORDER BY distance_km ASC
-            LIMIT :limit
-        """)
-        
-        result = db.session.execute(query, {
-            'user_lat': user_lat,
-            'user_lng': user_lng,
-            'radius_km': radius_km,
-            'limit': limit
-        }).fetchall()
+        try:
+            matches = partner_geo_index.nearby(user_lat, user_lng, radius_km, limit)
+        except Exception as e:
+            print(f"⚠️ Index géographique indisponible, fallback SQL: {e}")
+            db.session.rollback()
+            matches = _query_nearby_partners_sql(user_lat, user_lng, radius_km, limit)
         
-        partners = []
-        for row in result:
-            # Construire l'adresse complète
-            address_parts = []
-            if row.address_number:
-                address_parts.append(row.address_number)
-            if row.address_street:
-                address_parts.append(row.address_street)
-            if row.address_postal_code:
-                address_parts.append(row.address_postal_code)
-            if row.address_city:
-                address_parts.append(row.address_city)
-            
-            partners.append({
-                'id': row.id,
-                'name': row.name,
-                'category': row.category,
-                'city': row.city,
-                'latitude': float(row.latitude) if row.latitude else None,
-                'longitude': float(row.longitude) if row.longitude else None,
-                'image_url': row.image_url,
-                'address': ' '.join(address_parts) if address_parts else None,
-                'phone': row.phone,
-                'website': row.website,
-                'status': row.status,
-                'distance_km': round(float(row.distance_km), 2),
-                'distance_m': int(float(row.distance_km) * 1000),
-                'offers_count': row.offers_count
-            })
+        partners = [
+            _serialize_nearby_partner(partner, distance_km, offers_count, branch)
+            for distance_km, partner, offers_count, branch in matches
+        ]
         
         return jsonify({
             'success': True,
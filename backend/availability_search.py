@@ -0,0 +1,192 @@
+"""
+Recherche "disponible près de moi" sur plusieurs commerçants
+1. Candidats : index géographique en mémoire (rayon, catégorie) + réservation activée
+2. Disponibilités : bitmap par (commerçant, jour local) des départs libres, sur la
+   grille des horaires compilés (slot_generator.CompiledSchedule, alignée sur l'ouverture),
+   mis en cache avec les compteurs de génération des disponibilités et
+   calculé pour tous les jours manquants en deux requêtes (créneaux, réservations virtuelles)
+3. Fusion : les premiers départs libres de chaque commerçant, triés par heure
+"""
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+import pytz
+
+from booking_availability import BookingLoad, app_cache, availability_generation, virtual_day_mask
+from models import db, Booking, Creneau, PartnerBookingConfig
+from partner_geo_index import partner_geo_index
+from slot_generator import BOOKING_MODE_VIRTUAL, TIMEZONE, compiled_schedule, horizon
+
+MAX_CANDIDATES = 40  # Commerçants évalués au plus (les plus proches)
+MAX_WINDOW_DAYS = 14
+SLOTS_PER_PARTNER = 3
+BITMAP_TTL_SECONDS = 600
+
+
+def local_day_bounds(day):
+    """[minuit, minuit suivant) d'un jour local, en UTC naïf"""
+    start = TIMEZONE.localize(datetime.combine(day, datetime.min.time()))
+    end = TIMEZONE.localize(datetime.combine(day + timedelta(days=1), datetime.min.time()))
+    return start.astimezone(pytz.utc).replace(tzinfo=None), end.astimezone(pytz.utc).replace(tzinfo=None)
+
+
+def _bitmap_key(cache, generations, partner_id, day, people):
+    """Clé versionnée ; generations : mémo {(partenaire, année, mois): version} partagé par la recherche"""
+    # Le jour local peut chevaucher deux mois UTC (invalidation par mois de booking_date)
+    start, end = local_day_bounds(day)
+    last = end - timedelta(seconds=1)
+    parts = []
+    for year, month in sorted({(start.year, start.month), (last.year, last.month)}):
+        if (partner_id, year, month) not in generations:
+            generations[(partner_id, year, month)] = availability_generation(cache, partner_id, year, month)
+        parts.append(generations[(partner_id, year, month)])
+    return f"availability_day/{partner_id}/{day.isoformat()}/{people}/{'-'.join(parts)}"
+
+
+def _compute_slot_bitmaps(configs, days, people):
+    """Bitmaps des commerçants à créneaux matérialisés (une requête pour tous)"""
+    bitmaps = {(config.partner_id, day): 0 for config in configs for day in days}
+    if not configs:
+        return bitmaps
+    by_partner = {config.partner_id: config for config in configs}
+    window_start, window_end = local_day_bounds(days[0])[0], local_day_bounds(days[-1])[1]
+    rows = db.session.query(Creneau.partner_id, Creneau.start_datetime).filter(
+        Creneau.partner_id.in_(list(by_partner)),
+        Creneau.start_datetime >= window_start,
+        Creneau.start_datetime < window_end,
+        Creneau.is_available.is_(True),
+        Creneau.booked_count + people <= Creneau.capacity
+    ).all()
+    for row in rows:
+        day = pytz.utc.localize(row.start_datetime).astimezone(TIMEZONE).date()
+        if (row.partner_id, day) in bitmaps:
+            schedule = compiled_schedule(by_partner[row.partner_id])
+            origin, _opened = schedule.day(day)
+            index = schedule.index_of(day, origin, row.start_datetime)
+            if index >= 0:  # Créneau hors de la grille actuelle (en attente de resynchronisation)
+                bitmaps[(row.partner_id, day)] |= 1 << index
+    return bitmaps
+
+
+def _compute_virtual_bitmaps(configs, days, people):
+    """Bitmaps des commerçants en mode virtuel (une requête de réservations pour tous)"""
+    bitmaps = {}
+    if not configs:
+        return bitmaps
+    window_start, window_end = local_day_bounds(days[0])[0], local_day_bounds(days[-1])[1]
+    intervals = defaultdict(list)
+    for row in db.session.query(
+        Booking.partner_id, Booking.booking_date, Booking.duration_minutes, Booking.number_of_people
+    ).filter(
+        Booking.partner_id.in_([config.partner_id for config in configs]),
+        Booking.status != 'cancelled',
+        Booking.booking_date < window_end,
+        Booking.booking_date >= window_start - timedelta(days=1)
+    ):
+        intervals[row.partner_id].append(
+            (row.booking_date, row.booking_date + timedelta(minutes=row.duration_minutes), row.number_of_people or 1)
+        )
+
+    for config in configs:
+        load = BookingLoad(intervals[config.partner_id])
+        schedule = compiled_schedule(config)
+        capacity = config.max_concurrent_bookings or 1
+        first_day, last_day = horizon(config, datetime.now(TIMEZONE).date())
+        for day in days:
+            if not first_day <= day <= last_day:
+                bitmaps[(config.partner_id, day)] = 0
+                continue
+            # Bitmap indépendante de l'heure : le délai de prévenance est appliqué à la lecture
+            bitmaps[(config.partner_id, day)] = virtual_day_mask(schedule, load, day, people, capacity)[1]
+    return bitmaps
+
+
+def day_bitmaps(configs, days, people=1):
+    """{(partner_id, jour): bitmap} ; seuls les couples absents du cache sont calculés"""
+    cache = app_cache()
+    generations = {}
+    keys = {
+        (config.partner_id, day): _bitmap_key(cache, generations, config.partner_id, day, people)
+        for config in configs for day in days
+    }
+    cached = dict(zip(keys, cache.get_many(*keys.values()))) if keys else {}
+    bitmaps = {pair: value for pair, value in cached.items() if value is not None}
+
+    missing = {partner_id for (partner_id, _day), value in cached.items() if value is None}
+    if missing:
+        pending = [config for config in configs if config.partner_id in missing]
+        computed = _compute_slot_bitmaps(
+            [config for config in pending if config.booking_mode != BOOKING_MODE_VIRTUAL], days, people
+        )
+        computed.update(_compute_virtual_bitmaps(
+            [config for config in pending if config.booking_mode == BOOKING_MODE_VIRTUAL], days, people
+        ))
+        cache.set_many(
+            {keys[pair]: value for pair, value in computed.items() if pair not in bitmaps},
+            timeout=BITMAP_TTL_SECONDS
+        )
+        for pair, value in computed.items():
+            bitmaps.setdefault(pair, value)
+    return bitmaps
+
+
+def _first_starts(bitmap, day, config, earliest, count):
+    """Les `count` premiers départs libres d'une bitmap, pas avant `earliest`"""
+    schedule = compiled_schedule(config)
+    origin, _opened = schedule.day(day)
+    starts = []
+    index = 0
+    while bitmap and len(starts) < count:
+        if bitmap & 1:
+            start = schedule.start_of(day, origin, index)
+            if start >= earliest:
+                starts.append(start)
+        bitmap >>= 1
+        index += 1
+    return starts
+
+
+def search_available(lat, lng, radius_km, first_day, last_day, category=None, people=1, limit=20, now=None):
+    """
+    Premiers départs libres des commerçants proches, triés par heure.
+    Retourne (créneaux, nombre de commerçants évalués) ; chaque créneau est
+    (départ, fin, distance_km, partner_dict, branch_dict).
+    """
+    now = now or datetime.utcnow()
+    candidates = partner_geo_index.nearby(lat, lng, radius_km, None)
+    if category:
+        category = category.strip().lower()
+        candidates = [c for c in candidates if (c[1]['category'] or '').lower() == category]
+    candidate_ids = [partner['id'] for _distance, partner, _offers, _branch in candidates]
+    if not candidate_ids:
+        return [], 0
+
+    enabled = {
+        config.partner_id: config
+        for config in PartnerBookingConfig.query.filter(
+            PartnerBookingConfig.partner_id.in_(candidate_ids),
+            PartnerBookingConfig.is_enabled.is_(True)
+        )
+    }
+    candidates = [c for c in candidates if c[1]['id'] in enabled][:MAX_CANDIDATES]
+    configs = [enabled[partner['id']] for _distance, partner, _offers, _branch in candidates]
+
+    days = [first_day + timedelta(days=i) for i in range((last_day - first_day).days + 1)]
+    bitmaps = day_bitmaps(configs, days, people)
+
+    results = []
+    for distance, partner, _offers, branch in candidates:
+        config = enabled[partner['id']]
+        earliest = now + timedelta(hours=config.min_notice_hours or 0)
+        starts = []
+        for day in days:
+            starts += _first_starts(
+                bitmaps.get((config.partner_id, day), 0), day, config, earliest, SLOTS_PER_PARTNER - len(starts)
+            )
+            if len(starts) >= SLOTS_PER_PARTNER:
+                break
+        step = timedelta(minutes=config.slot_duration_minutes)
+        results += [(start, start + step, distance, partner, branch) for start in starts]
+
+    results.sort(key=lambda item: (item[0], item[2]))
+    return results[:limit], len(candidates)
@@ -0,0 +1,501 @@
+"""
+Calcul des disponibilités de réservation (calendrier membre)
+Un seul passage sur les créneaux du mois, lus en tuples : on suit la série
+courante de créneaux libres consécutifs au lieu de revérifier `required_slots`
+créneaux à chaque position.
+Mode "virtual" : pas de Creneau, les départs possibles sont calculés à partir des
+horaires compilés (bitmap des créneaux ouverts) moins les créneaux saturés par les
+réservations existantes (BookingLoad).
+Résultats mis en cache par (commerçant, service, mois), invalidés par les réservations.
+"""
+import bisect
+import time
+from collections import defaultdict, deque
+from datetime import datetime, timedelta
+
+import pytz
+from flask import current_app
+from sqlalchemy import case, or_, update
+
+from models import db, Booking, Creneau
+from slot_generator import BOOKING_MODE_VIRTUAL, TIMEZONE, compiled_schedule, horizon, runs_of
+
+# Colonnes lues (attributs des tuples manipulés ci-dessous)
+SLOT_COLUMNS = (
+    Creneau.id, Creneau.partner_id, Creneau.service_id, Creneau.start_datetime,
+    Creneau.end_datetime, Creneau.capacity, Creneau.booked_count, Creneau.is_available
+)
+
+
+def required_slot_count(service_duration, slot_duration):
+    """Nombre de créneaux consécutifs couverts par une prestation"""
+    return max(1, (service_duration + slot_duration - 1) // slot_duration)
+
+
+def month_bounds(year, month):
+    """[début, fin) d'un mois (UTC, comme Creneau.start_datetime)"""
+    start = datetime(year, month, 1)
+    end = datetime(year + 1, 1, 1) if month == 12 else datetime(year, month + 1, 1)
+    return start, end
+
+
+def local_month_bounds(year, month):
+    """[début, fin) d'un mois en heure de Zurich, convertis en UTC naïf"""
+    start, end = month_bounds(year, month)
+    return tuple(TIMEZONE.localize(value).astimezone(pytz.utc).replace(tzinfo=None) for value in (start, end))
+
+
+def load_slot_rows(partner_id, start, end, service_ids=None):
+    """
+    Créneaux [start, end) d'un commerçant, triés, en tuples.
+    service_ids : créneaux génériques (service_id NULL) + ceux de ces services.
+    """
+    query = db.session.query(*SLOT_COLUMNS).filter(
+        Creneau.partner_id == partner_id,
+        Creneau.start_datetime >= start,
+        Creneau.start_datetime < end
+    )
+    if service_ids:
+        query = query.filter(or_(Creneau.service_id.is_(None), Creneau.service_id.in_(list(service_ids))))
+    return query.order_by(Creneau.start_datetime, Creneau.id).all()
+
+
+def find_available_starts(rows, required_slots, slot_duration, number_of_people=1, service_id=None):
+    """
+    Créneaux de départ d'une série de `required_slots` créneaux libres et consécutifs.
+    rows : tuples triés par start_datetime (voir SLOT_COLUMNS), parcourus une seule fois.
+    """
+    step = timedelta(minutes=slot_duration)
+    starts = []
+    # Fin de la série courante de créneaux libres consécutifs (les `required_slots` derniers)
+    window = deque(maxlen=required_slots)
+    previous_start = None
+    for row in rows:
+        if service_id is not None and row.service_id not in (None, service_id):
+            continue
+        free = row.is_available and row.booked_count + number_of_people <= row.capacity
+        contiguous = previous_start is not None and row.start_datetime == previous_start + step
+        previous_start = row.start_datetime
+        if not free or not contiguous:
+            window.clear()
+        if not free:
+            continue
+        window.append(row)
+        if len(window) == required_slots:
+            starts.append(window[0])
+    return starts
+
+
+def serialize_slot(row):
+    """Même format que Creneau.to_dict(), à partir d'un tuple"""
+    return {
+        'id': row.id, 'partner_id': row.partner_id, 'service_id': row.service_id,
+        'start_datetime': row.start_datetime.isoformat() if row.start_datetime else None,
+        'end_datetime': row.end_datetime.isoformat() if row.end_datetime else None,
+        'capacity': row.capacity, 'booked_count': row.booked_count,
+        'is_available': row.is_available
+    }
+
+
+# --- Réservation des créneaux ---
+
+def booking_slot_ids(partner_id, start, slot_count, service_id=None):
+    """
+    IDs des `slot_count` créneaux consécutifs à partir de `start` (un par horaire :
+    le premier créneau générique ou du service), None si la série est incomplète.
+    Même sélection à la réservation et à l'annulation.
+    """
+    rows = db.session.query(Creneau.id, Creneau.start_datetime, Creneau.end_datetime).filter(
+        Creneau.partner_id == partner_id,
+        Creneau.start_datetime >= start,
+        or_(Creneau.service_id.is_(None), Creneau.service_id == service_id)
+    ).order_by(Creneau.start_datetime, Creneau.id).limit(slot_count * 4).all()
+
+    slot_ids = []
+    expected = start
+    for row in rows:
+        if len(slot_ids) == slot_count:
+            break
+        if row.start_datetime != expected:
+            continue  # Doublon au même horaire (déjà retenu) ou trou, vérifié ci-dessous
+        slot_ids.append(row.id)
+        expected = row.end_datetime
+    return slot_ids if len(slot_ids) == slot_count else None
+
+
+def claim_slots(slot_ids, number_of_people):
+    """
+    Réserve atomiquement `number_of_people` places sur tous les créneaux (un seul UPDATE
+    conditionnel, sans verrou tenu pendant le code Python).
+    Retourne False si un des créneaux n'a plus la place : l'appelant doit annuler la transaction.
+    """
+    claimed = db.session.execute(
+        update(Creneau)
+        .where(
+            Creneau.id.in_(slot_ids),
+            Creneau.is_available.is_(True),
+            Creneau.booked_count + number_of_people <= Creneau.capacity
+        )
+        .values(
+            booked_count=Creneau.booked_count + number_of_people,
+            is_available=Creneau.booked_count + number_of_people < Creneau.capacity
+        )
+        .returning(Creneau.id)
+        .execution_options(synchronize_session=False)
+    ).fetchall()
+    return len(claimed) == len(slot_ids)
+
+
+def release_slots(slot_ids, number_of_people):
+    """Libère les places d'une réservation annulée"""
+    if not slot_ids:
+        return
+    db.session.execute(
+        update(Creneau)
+        .where(Creneau.id.in_(slot_ids))
+        .values(
+            booked_count=case(
+                (Creneau.booked_count > number_of_people, Creneau.booked_count - number_of_people),
+                else_=0
+            ),
+            is_available=True
+        )
+        .execution_options(synchronize_session=False)
+    )
+
+
+def release_booking_slots(booking):
+    """Libère les créneaux d'une réservation (série complète, ou premier créneau pour les anciennes)"""
+    if not booking.creneau_id:
+        return  # Mode virtuel
+    if booking.slot_count is None:
+        # Réservation antérieure aux séries : seul le premier créneau avait été compté (1 place)
+        release_slots([booking.creneau_id], 1)
+        return
+    slot_ids = booking_slot_ids(booking.partner_id, booking.booking_date, booking.slot_count, booking.service_id)
+    release_slots(slot_ids or [booking.creneau_id], booking.number_of_people or 1)
+
+
+# --- Mode virtuel ---
+
+class BookingLoad:
+    """
+    Nombre de personnes réservées au cours du temps (fonction en escalier),
+    construit à partir des intervalles [début, fin) des réservations
+    """
+
+    def __init__(self, intervals):
+        deltas = defaultdict(int)
+        for start, end, people in intervals:
+            deltas[start] += people
+            deltas[end] -= people
+        self.times = sorted(deltas)
+        self.loads = []
+        load = 0
+        for moment in self.times:
+            load += deltas[moment]
+            self.loads.append(load)
+
+    def peak(self, start, end):
+        """Charge maximale sur [start, end)"""
+        i = bisect.bisect_right(self.times, start) - 1
+        peak = self.loads[i] if i >= 0 else 0
+        i += 1
+        while i < len(self.times) and self.times[i] < end:
+            peak = max(peak, self.loads[i])
+            i += 1
+        return peak
+
+    def blocked_mask(self, schedule, day, origin, threshold):
+        """Bitmap des créneaux d'un jour local où la charge dépasse `threshold` à un instant au moins"""
+        day_start = schedule.start_of(day, origin, 0)
+        day_end = schedule.start_of(day + timedelta(days=1), origin, 0)
+        mask = 0
+        k = max(bisect.bisect_right(self.times, day_start) - 1, 0)
+        while k < len(self.times) - 1 and self.times[k] < day_end:
+            if self.loads[k] > threshold:
+                first = max(schedule.index_of(day, origin, self.times[k]), 0)
+                last = schedule.index_of(day, origin, self.times[k + 1] - timedelta(microseconds=1))
+                if last >= first:
+                    mask |= ((1 << (last - first + 1)) - 1) << first
+            k += 1
+        return mask
+
+
+def load_booking_load(partner_id, start, end):
+    """Charge des réservations actives qui chevauchent [start, end)"""
+    rows = db.session.query(Booking.booking_date, Booking.duration_minutes, Booking.number_of_people).filter(
+        Booking.partner_id == partner_id,
+        Booking.status != 'cancelled',
+        Booking.booking_date < end,
+        # Une réservation dure au plus une journée
+        Booking.booking_date >= start - timedelta(days=1)
+    ).all()
+    return BookingLoad(
+        (row.booking_date, row.booking_date + timedelta(minutes=row.duration_minutes), row.number_of_people or 1)
+        for row in rows
+    )
+
+
+def virtual_day_mask(schedule, load, day, number_of_people, capacity):
+    """(origin, bitmap des créneaux ouverts et non saturés) d'un jour local"""
+    origin, opened = schedule.day(day)
+    if not opened or number_of_people > capacity:
+        return origin, 0
+    return origin, opened & ~load.blocked_mask(schedule, day, origin, capacity - number_of_people)
+
+
+def virtual_starts(config, load, start, end, duration_minutes, number_of_people=1, now=None, min_notice=True):
+    """
+    Départs possibles sur [start, end) en mode virtuel : séries de créneaux ouverts et
+    non saturés couvrant la prestation (runs_of sur la bitmap du jour).
+    min_notice=False : délai de prévenance non appliqué (à filtrer par l'appelant).
+    Retourne [(début, fin, charge)].
+    """
+    now = now or datetime.utcnow()
+    earliest = max(start, now + timedelta(hours=config.min_notice_hours or 0)) if min_notice else start
+    first_day, last_day = horizon(config, pytz.utc.localize(now).astimezone(TIMEZONE).date())
+    capacity = config.max_concurrent_bookings or 1
+    schedule = compiled_schedule(config)
+    length = required_slot_count(duration_minutes, schedule.slot_minutes)
+    duration = timedelta(minutes=duration_minutes)
+
+    starts = []
+    day = max(first_day, (start - timedelta(days=1)).date())
+    while day <= last_day and day <= end.date():
+        _origin, free = virtual_day_mask(schedule, load, day, number_of_people, capacity)
+        for slot_start, _slot_end in schedule.slots(day, runs_of(free, length)):
+            if earliest <= slot_start < end:
+                starts.append((slot_start, slot_start + duration, load.peak(slot_start, slot_start + duration)))
+        day += timedelta(days=1)
+    return starts
+
+
+def serialize_virtual_slot(partner_id, service_id, config, start, end, booked):
+    """Même format que serialize_slot() ; id None : réserver avec start_datetime"""
+    return {
+        'id': None, 'partner_id': partner_id, 'service_id': service_id,
+        'start_datetime': start.isoformat(), 'end_datetime': end.isoformat(),
+        'capacity': config.max_concurrent_bookings or 1, 'booked_count': booked,
+        'is_available': True
+    }
+
+
+def _virtual_duration(service, config):
+    return service.duration_minutes if service is not None else config.slot_duration_minutes
+
+
+def is_virtual_start_available(partner_id, service, config, start, number_of_people=1):
+    """Vérifie un départ demandé avec le même calcul que le calendrier"""
+    duration = _virtual_duration(service, config)
+    load = load_booking_load(partner_id, start, start + timedelta(minutes=duration))
+    return any(
+        slot_start == start
+        for slot_start, _end, _booked in virtual_starts(
+            config, load, start, start + timedelta(minutes=1), duration, number_of_people
+        )
+    )
+
+
+def compute_availability(partner_id, service, config, year, month):
+    """Créneaux de départ réservables d'un service pour un mois (liste de dicts)"""
+    start, end = month_bounds(year, month)
+    if config.booking_mode == BOOKING_MODE_VIRTUAL:
+        load = load_booking_load(partner_id, start, end)
+        return [
+            serialize_virtual_slot(partner_id, service.id, config, *slot)
+            for slot in virtual_starts(config, load, start, end, service.duration_minutes)
+        ]
+    rows = load_slot_rows(partner_id, start, end, service_ids=[service.id])
+    required_slots = required_slot_count(service.duration_minutes, config.slot_duration_minutes)
+    return [
+        serialize_slot(row)
+        for row in find_available_starts(rows, required_slots, config.slot_duration_minutes, service_id=service.id)
+    ]
+
+
+def compute_availability_batch(partner_id, services, config, months):
+    """
+    Disponibilités de plusieurs services sur plusieurs mois avec une seule requête SQL.
+    months : liste de (année, mois). Retourne {service_id: {"AAAA-MM": [créneaux]}}.
+    """
+    bounds = {(year, month): month_bounds(year, month) for year, month in months}
+    if not services or not bounds:
+        return {}
+    if config.booking_mode == BOOKING_MODE_VIRTUAL:
+        load = load_booking_load(
+            partner_id, min(start for start, _end in bounds.values()), max(end for _start, end in bounds.values())
+        )
+        return {
+            service.id: {
+                f"{year:04d}-{month:02d}": [
+                    serialize_virtual_slot(partner_id, service.id, config, *slot)
+                    for slot in virtual_starts(config, load, *bounds[(year, month)], service.duration_minutes)
+                ]
+                for year, month in months
+            }
+            for service in services
+        }
+    rows = load_slot_rows(
+        partner_id,
+        min(start for start, _end in bounds.values()),
+        max(end for _start, end in bounds.values()),
+        service_ids=[service.id for service in services]
+    )
+
+    # Répartition par mois (l'ordre chronologique est conservé)
+    rows_by_month = {key: [] for key in bounds}
+    for row in rows:
+        for key, (start, end) in bounds.items():
+            if start <= row.start_datetime < end:
+                rows_by_month[key].append(row)
+
+    result = {}
+    for service in services:
+        required_slots = required_slot_count(service.duration_minutes, config.slot_duration_minutes)
+        result[service.id] = {
+            f"{year:04d}-{month:02d}": [
+                serialize_slot(row) for row in find_available_starts(
+                    rows_by_month[(year, month)], required_slots, config.slot_duration_minutes, service_id=service.id
+                )
+            ]
+            for year, month in months
+        }
+    return result
+
+
+# --- Cache des disponibilités ---
+# Clé : (partenaire, service, mois) + deux compteurs de génération :
+#   - par partenaire : configuration ou services modifiés (tous les mois changent)
+#   - par partenaire et par mois : réservation créée ou annulée dans ce mois
+# Une invalidation incrémente le compteur, les anciennes entrées expirent seules.
+CACHE_TTL_SECONDS = 300  # Au-delà, l'entrée est recalculée par une seule requête (les autres servent l'ancienne)
+CACHE_GRACE_SECONDS = 120
+LOCK_SECONDS = 10
+LOCK_WAIT_SECONDS = 2.0
+LOCK_POLL_SECONDS = 0.05
+
+
+def app_cache():
+    """Backend du cache de l'application (Redis si REDIS_URL, sinon mémoire)"""
+    return next(iter(current_app.extensions['cache'].values()))
+
+
+def _month_key(year, month):
+    return f"{year:04d}-{month:02d}"
+
+
+def _generation_keys(partner_id, year, month):
+    return f"availability_gen/{partner_id}", f"availability_gen/{partner_id}/{_month_key(year, month)}"
+
+
+def availability_generation(cache, partner_id, year, month):
+    """Version courante des disponibilités d'un commerçant pour un mois ("partenaire.mois")"""
+    generations = cache.get_many(*_generation_keys(partner_id, year, month))
+    return f"{generations[0] or 0}.{generations[1] or 0}"
+
+
+def _entry_key(cache, partner_id, service_id, year, month):
+    return (
+        f"availability/{partner_id}/{service_id}/{_month_key(year, month)}"
+        f"/{availability_generation(cache, partner_id, year, month)}"
+    )
+
+
+def _bump(cache, key):
+    # Sans expiration : un compteur remis à zéro ressusciterait d'anciennes entrées
+    cache.set(key, (cache.get(key) or 0) + 1, timeout=0)
+
+
+def invalidate_availability(partner_id, when=None):
+    """
+    Invalide les disponibilités d'un commerçant :
+    when = date d'un créneau réservé/libéré (seul son mois), None = tous les mois
+    """
+    try:
+        cache = app_cache()
+        if when is None:
+            _bump(cache, f"availability_gen/{partner_id}")
+        else:
+            _bump(cache, _generation_keys(partner_id, when.year, when.month)[1])
+    except Exception as e:
+        print(f"⚠️ Invalidation cache disponibilités impossible: {e}")
+
+
+def _store(cache, key, data):
+    cache.set(key, {'data': data, 'fresh_until': time.time() + CACHE_TTL_SECONDS},
+              timeout=CACHE_TTL_SECONDS + CACHE_GRACE_SECONDS)
+
+
+def cached_availability(partner_id, service, config, year, month):
+    """
+    compute_availability() avec cache et protection contre les recalculs simultanés :
+    - entrée périmée : une seule requête (verrou cache.add) recalcule, les autres servent l'ancienne
+    - entrée absente : les autres attendent brièvement le résultat du premier
+    """
+    try:
+        cache = app_cache()
+        key = _entry_key(cache, partner_id, service.id, year, month)
+        entry = cache.get(key)
+    except Exception as e:
+        print(f"⚠️ Cache disponibilités indisponible: {e}")
+        return compute_availability(partner_id, service, config, year, month)
+
+    if entry is not None and entry['fresh_until'] > time.time():
+        return entry['data']
+
+    lock_key = f"{key}/lock"
+    if cache.add(lock_key, 1, timeout=LOCK_SECONDS):
+        try:
+            data = compute_availability(partner_id, service, config, year, month)
+            _store(cache, key, data)
+            return data
+        finally:
+            cache.delete(lock_key)
+
+    if entry is not None:
+        return entry['data']  # Recalcul en cours ailleurs
+
+    deadline = time.monotonic() + LOCK_WAIT_SECONDS
+    while time.monotonic() < deadline:
+        time.sleep(LOCK_POLL_SECONDS)
+        entry = cache.get(key)
+        if entry is not None:
+            return entry['data']
+    return compute_availability(partner_id, service, config, year, month)
+
+
+def cached_availability_batch(partner_id, services, config, months):
+    """compute_availability_batch() en ne recalculant que les couples (service, mois) absents du cache"""
+    try:
+        cache = app_cache()
+        keys = {
+            (service.id, year, month): _entry_key(cache, partner_id, service.id, year, month)
+            for service in services for year, month in months
+        }
+        entries = dict(zip(keys, cache.get_many(*keys.values()))) if keys else {}
+    except Exception as e:
+        print(f"⚠️ Cache disponibilités indisponible: {e}")
+        return compute_availability_batch(partner_id, services, config, months)
+
+    now = time.time()
+    missing = {pair for pair, entry in entries.items() if entry is None or entry['fresh_until'] <= now}
+    result = {service.id: {} for service in services}
+    for (service_id, year, month), entry in entries.items():
+        if (service_id, year, month) not in missing:
+            result[service_id][_month_key(year, month)] = entry['data']
+
+    if missing:
+        missing_services = [service for service in services if any(pair[0] == service.id for pair in missing)]
+        missing_months = sorted({(year, month) for _service_id, year, month in missing})
+        computed = compute_availability_batch(partner_id, missing_services, config, missing_months)
+        for service_id, year, month in missing:
+            data = computed[service_id][_month_key(year, month)]
+            result[service_id][_month_key(year, month)] = data
+            _store(cache, keys[(service_id, year, month)], data)
+
+    # Ordre des mois identique à la demande
+    return {
+        service_id: {_month_key(year, month): by_month[_month_key(year, month)] for year, month in months}
+        for service_id, by_month in result.items()
+    }
@@ -0,0 +1,174 @@
+"""
+Flux iCalendar (.ics) des réservations confirmées d'un commerçant
+- ETag fort calculé par une seule agrégation (dernier updated_at des réservations et services) :
+  les clients qui interrogent le flux toutes les quelques minutes reçoivent un 304
+- Rendu incrémental : chaque VEVENT est mis en cache par (réservation, updated_at),
+  seuls les événements modifiés sont régénérés ; le flux complet est mis en cache par ETag
+- Accès par jeton secret propre au commerçant (partner_booking_configs.calendar_token) dans l'URL :
+  le flux contient prénoms et notes des membres, l'URL est partagée avec des clients calendrier
+"""
+import hashlib
+import hmac
+import secrets
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+from sqlalchemy import func
+
+from booking_availability import app_cache
+from models import db, Booking, Member, Partner, PartnerBookingConfig, Service
+
+FEED_PAST_DAYS = 90  # Historique conservé dans le flux
+EVENT_CACHE_SIZE = 20000
+FEED_CACHE_SECONDS = 3600
+PRODID = "-//PEP'S//Reservations//FR"
+
+
+def ics_escape(value):
+    """Échappement des valeurs texte (RFC 5545 §3.3.11)"""
+    return (value or '').replace('\\', '\\\\').replace(';', '\\;').replace(',', '\\,').replace('\r\n', '\\n').replace('\n', '\\n')
+
+
+def fold_line(line):
+    """Lignes de 75 octets maximum, continuées par un espace (RFC 5545 §3.1)"""
+    encoded = line.encode('utf-8')
+    if len(encoded) <= 75:
+        return line
+    parts = []
+    limit = 75
+    while encoded:
+        cut = min(limit, len(encoded))
+        # Ne pas couper un caractère UTF-8 multi-octets
+        while cut < len(encoded) and (encoded[cut] & 0xC0) == 0x80:
+            cut -= 1
+        parts.append(encoded[:cut].decode('utf-8'))
+        encoded = encoded[cut:]
+        limit = 74  # L'espace de continuation compte
+    return '\r\n '.join(parts)
+
+
+def _ics_datetime(value):
+    """Datetime UTC naïf -> 20260101T090000Z"""
+    return value.strftime('%Y%m%dT%H%M%SZ')
+
+
+class EventCache:
+    """VEVENT rendus, par (booking_id, updated_at) ; LRU par processus"""
+
+    def __init__(self, size=EVENT_CACHE_SIZE):
+        self.size = size
+        self._events = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            event = self._events.get(key)
+            if event is not None:
+                self._events.move_to_end(key)
+            return event
+
+    def set(self, key, event):
+        with self._lock:
+            self._events[key] = event
+            self._events.move_to_end(key)
+            while len(self._events) > self.size:
+                self._events.popitem(last=False)
+
+
+event_cache = EventCache()
+
+
+def render_event(row):
+    """VEVENT d'une réservation (ligne de _feed_rows)"""
+    key = (row.id, row.updated_at, row.service_name, row.first_name)
+    event = event_cache.get(key)
+    if event is not None:
+        return event
+
+    end = row.booking_date + timedelta(minutes=row.duration_minutes or 30)
+    summary = row.service_name or 'Réservation'
+    if row.first_name:
+        summary = f"{summary} - {row.first_name}"
+    description = f"{row.number_of_people or 1} personne(s)"
+    if row.member_notes:
+        description += f"\n{row.member_notes}"
+    lines = [
+        'BEGIN:VEVENT',
+        f'UID:booking-{row.id}@peps.swiss',
+        f'DTSTAMP:{_ics_datetime(row.updated_at or row.created_at or row.booking_date)}',
+        f'DTSTART:{_ics_datetime(row.booking_date)}',
+        f'DTEND:{_ics_datetime(end)}',
+        f'SUMMARY:{ics_escape(summary)}',
+        f'DESCRIPTION:{ics_escape(description)}',
+        'STATUS:CONFIRMED',
+        'END:VEVENT',
+    ]
+    event = '\r\n'.join(fold_line(line) for line in lines)
+    event_cache.set(key, event)
+    return event
+
+
+def feed_token_valid(partner_id, token):
+    """Jeton du flux d'un commerçant (comparaison à temps constant)"""
+    expected = db.session.query(PartnerBookingConfig.calendar_token).filter(
+        PartnerBookingConfig.partner_id == partner_id
+    ).scalar()
+    return bool(expected and token) and hmac.compare_digest(expected, token)
+
+
+def ensure_feed_token(config, regenerate=False):
+    """Jeton du flux (créé au premier appel ; regenerate : l'ancienne URL cesse de fonctionner), sans commit"""
+    if regenerate or not config.calendar_token:
+        config.calendar_token = secrets.token_urlsafe(32)
+    return config.calendar_token
+
+
+def feed_etag(partner_id):
+    """ETag fort du flux : change dès qu'une réservation ou un service du commerçant change"""
+    bookings = db.session.query(func.max(Booking.updated_at), func.count(Booking.id)).filter(
+        Booking.partner_id == partner_id
+    ).one()
+    services_updated = db.session.query(func.max(Service.updated_at)).filter(Service.partner_id == partner_id).scalar()
+    source = f"{partner_id}|{bookings[0]}|{bookings[1]}|{services_updated}"
+    return hashlib.sha1(source.encode('utf-8')).hexdigest()
+
+
+def _feed_rows(partner_id):
+    return db.session.query(
+        Booking.id, Booking.booking_date, Booking.duration_minutes, Booking.number_of_people,
+        Booking.member_notes, Booking.updated_at, Booking.created_at,
+        Service.name.label('service_name'), Member.first_name
+    ).outerjoin(Service, Service.id == Booking.service_id).outerjoin(Member, Member.id == Booking.member_id).filter(
+        Booking.partner_id == partner_id,
+        Booking.status == 'confirmed',
+        Booking.booking_date >= datetime.utcnow() - timedelta(days=FEED_PAST_DAYS)
+    ).order_by(Booking.booking_date, Booking.id).all()
+
+
+def render_feed(partner_id):
+    """Calendrier iCalendar complet (texte CRLF)"""
+    partner_name = db.session.query(Partner.name).filter(Partner.id == partner_id).scalar() or "PEP'S"
+    header = [
+        'BEGIN:VCALENDAR',
+        'VERSION:2.0',
+        f'PRODID:{PRODID}',
+        'CALSCALE:GREGORIAN',
+        'METHOD:PUBLISH',
+        fold_line(f'X-WR-CALNAME:{ics_escape(f"Réservations {partner_name}")}'),
+        'X-WR-TIMEZONE:Europe/Zurich',
+        'REFRESH-INTERVAL;VALUE=DURATION:PT15M',
+    ]
+    events = [render_event(row) for row in _feed_rows(partner_id)]
+    return '\r\n'.join(header + events + ['END:VCALENDAR']) + '\r\n'
+
+
+def cached_feed(partner_id, etag):
+    """render_feed() partagé entre les workers (cache de l'application, clé = ETag)"""
+    cache = app_cache()
+    key = f"calendar_ics/{partner_id}/{etag}"
+    body = cache.get(key)
+    if body is None:
+        body = render_feed(partner_id)
+        cache.set(key, body, timeout=FEED_CACHE_SECONDS)
+    return body
@@ -0,0 +1,248 @@
+"""
+Notifications des réservations (confirmation, annulation, rappel)
+Les routes ne font qu'ajouter des BookingNotificationLog 'pending' dans leur transaction ;
+un thread par processus les envoie par lots (notification_senders) et enregistre
+les résultats en une seule requête par lot. Les rappels sont détectés par un
+parcours indexé des réservations à venir (idx_bookings_reminder_due).
+"""
+import threading
+import traceback
+from datetime import datetime, timedelta
+
+import pytz
+from sqlalchemy import exists, text, update
+
+from models import db, Booking, BookingNotificationLog, Member, Partner, PartnerBookingConfig, Service, User
+from notification_senders import senders
+from slot_generator import TIMEZONE
+
+POLL_SECONDS = 60  # Rappels et messages créés par les autres workers
+BATCH_SIZE = 50
+REMINDER_HOURS = 24  # Rappel envoyé la veille
+REMINDER_LOCK_ID = 720017  # pg_try_advisory_xact_lock : un seul worker planifie les rappels
+
+# Destinataires par type : le membre est prévenu de tout, le commerçant des nouvelles
+# réservations et des annulations faites par le membre
+RECIPIENTS = {
+    'confirmation': ('member', 'partner'),
+    'reminder': ('member',),
+    'cancellation_by_partner': ('member',),
+    'cancellation_by_member': ('partner',),
+}
+SENT_AT_COLUMNS = {'confirmation': 'confirmation_sent_at', 'reminder': 'reminder_sent_at'}
+
+
+def _channels(recipient_type, config):
+    if recipient_type == 'member':
+        return ['email']
+    if config is None:
+        return []
+    channels = []
+    if config.send_email_notifications and config.notification_email:
+        channels.append('email')
+    if config.send_sms_notifications and config.notification_phone:
+        channels.append('sms')
+    return channels
+
+
+def enqueue_booking_notifications(booking, notification_type, config=None):
+    """
+    Ajoute les notifications d'une réservation à la transaction en cours (sans commit).
+    notification_type : confirmation, reminder, cancellation_by_partner, cancellation_by_member
+    """
+    if booking.id is None:
+        db.session.flush()
+    if config is None:
+        config = PartnerBookingConfig.query.filter_by(partner_id=booking.partner_id).first()
+    for recipient_type in RECIPIENTS[notification_type]:
+        for channel in _channels(recipient_type, config):
+            db.session.add(BookingNotificationLog(
+                booking_id=booking.id, notification_type=notification_type,
+                recipient_type=recipient_type, channel=channel, status='pending'
+            ))
+
+
+def queue_due_reminders(now=None):
+    """
+    Crée les rappels des réservations des prochaines REMINDER_HOURS, retourne leur nombre.
+    Réservation prise moins de REMINDER_HOURS à l'avance : pas de rappel (la confirmation vient de partir).
+    """
+    now = now or datetime.utcnow()
+    if db.engine.dialect.name == 'postgresql':
+        if not db.session.execute(text("SELECT pg_try_advisory_xact_lock(:id)"), {'id': REMINDER_LOCK_ID}).scalar():
+            db.session.rollback()
+            return 0
+
+    already_queued = exists().where(
+        BookingNotificationLog.booking_id == Booking.id,
+        BookingNotificationLog.notification_type == 'reminder'
+    )
+    bookings = Booking.query.filter(
+        Booking.status == 'confirmed',
+        Booking.reminder_sent_at.is_(None),
+        Booking.booking_date >= now,
+        Booking.booking_date < now + timedelta(hours=REMINDER_HOURS),
+        ~already_queued
+    ).all()
+    bookings = [
+        booking for booking in bookings
+        if booking.created_at is None or booking.created_at <= booking.booking_date - timedelta(hours=REMINDER_HOURS)
+    ]
+    configs = {
+        config.partner_id: config
+        for config in PartnerBookingConfig.query.filter(
+            PartnerBookingConfig.partner_id.in_({booking.partner_id for booking in bookings})
+        )
+    } if bookings else {}
+    for booking in bookings:
+        enqueue_booking_notifications(booking, 'reminder', configs.get(booking.partner_id))
+    db.session.commit()
+    return len(bookings)
+
+
+def _local_time(value):
+    return pytz.utc.localize(value).astimezone(TIMEZONE).strftime('%d.%m.%Y à %H:%M')
+
+
+def _message(log, booking, partner, service, member_email, config):
+    """Destinataire et texte d'une notification, None si le destinataire n'a pas d'adresse"""
+    when = _local_time(booking.booking_date)
+    what = f"{service.name} " if service else ""
+    partner_name = partner.name if partner else "votre commerçant"
+
+    if log.recipient_type == 'member':
+        to = member_email
+        texts = {
+            'confirmation': ("Réservation confirmée", f"Votre réservation {what}chez {partner_name} le {when} est confirmée."),
+            'reminder': ("Rappel de réservation", f"Rappel : {what}chez {partner_name} le {when}."),
+            'cancellation_by_partner': (
+                "Réservation annulée",
+                f"{partner_name} a annulé votre réservation {what}du {when}. {booking.cancellation_reason or ''}".strip()
+            ),
+        }
+    else:
+        if config is None:
+            return None
+        to = config.notification_phone if log.channel == 'sms' else config.notification_email
+        people = booking.number_of_people or 1
+        texts = {
+            'confirmation': ("Nouvelle réservation PEP'S", f"Nouvelle réservation {what}le {when} ({people} pers.)."),
+            'cancellation_by_member': (
+                "Réservation annulée par le membre",
+                f"Réservation {what}du {when} annulée par le membre. {booking.cancellation_reason or ''}".strip()
+            ),
+        }
+    if not to:
+        return None
+    subject, body = texts[log.notification_type]
+    return {'to': to, 'subject': subject, 'body': body}
+
+
+def process_notifications(limit=BATCH_SIZE):
+    """
+    Envoie un lot de notifications en attente, retourne le nombre traité.
+    Les lignes restent verrouillées (SKIP LOCKED) pendant l'envoi : si le processus
+    s'arrête, la transaction est annulée et le lot repart en 'pending'.
+    """
+    query = BookingNotificationLog.query.filter_by(status='pending').order_by(BookingNotificationLog.id).limit(limit)
+    if db.engine.dialect.name == 'postgresql':
+        query = query.with_for_update(skip_locked=True)
+    logs = query.all()
+    if not logs:
+        db.session.commit()
+        return 0
+
+    # Données de tout le lot en quelques requêtes
+    bookings = {b.id: b for b in Booking.query.filter(Booking.id.in_({log.booking_id for log in logs}))}
+    partner_ids = {b.partner_id for b in bookings.values()}
+    partners = {p.id: p for p in Partner.query.filter(Partner.id.in_(partner_ids))}
+    configs = {c.partner_id: c for c in PartnerBookingConfig.query.filter(PartnerBookingConfig.partner_id.in_(partner_ids))}
+    service_ids = {b.service_id for b in bookings.values() if b.service_id}
+    services = {s.id: s for s in Service.query.filter(Service.id.in_(service_ids))} if service_ids else {}
+    member_emails = dict(db.session.query(Member.id, User.email).join(User, User.id == Member.user_id).filter(
+        Member.id.in_({b.member_id for b in bookings.values()})
+    ).all())
+
+    now = datetime.utcnow()
+    results = {}
+    outgoing = {}
+    for log in logs:
+        booking = bookings.get(log.booking_id)
+        message = booking and _message(
+            log, booking, partners.get(booking.partner_id), services.get(booking.service_id),
+            member_emails.get(booking.member_id), configs.get(booking.partner_id)
+        )
+        if message is None:
+            results[log.id] = ('failed', 'Destinataire sans adresse')
+        else:
+            outgoing.setdefault(log.channel, []).append((log, message))
+
+    for channel, items in outgoing.items():
+        sender = senders.get(channel)
+        if sender is None:
+            for log, _message_data in items:
+                results[log.id] = ('failed', f'Canal inconnu: {channel}')
+            continue
+        for (log, _message_data), (ok, error) in zip(items, sender.send_batch([m for _log, m in items])):
+            results[log.id] = ('sent', None) if ok else ('failed', (error or '')[:500])
+
+    # Résultats enregistrés en bloc
+    db.session.execute(update(BookingNotificationLog), [
+        {'id': log_id, 'status': status, 'error_message': error, 'sent_at': now if status == 'sent' else None}
+        for log_id, (status, error) in results.items()
+    ])
+    for notification_type, column in SENT_AT_COLUMNS.items():
+        booking_ids = {
+            log.booking_id for log in logs
+            if log.notification_type == notification_type and results[log.id][0] == 'sent'
+        }
+        if booking_ids:
+            Booking.query.filter(Booking.id.in_(booking_ids), getattr(Booking, column).is_(None)).update(
+                {column: now}, synchronize_session=False
+            )
+    db.session.commit()
+
+    failed = sum(1 for status, _error in results.values() if status == 'failed')
+    print(f"📨 Notifications : {len(results) - failed} envoyée(s), {failed} en échec")
+    return len(logs)
+
+
+class NotificationDispatcher:
+    """
+    Thread de fond (un par processus) : envoie la file dès qu'on le réveille
+    (wake() après une réservation) et planifie les rappels toutes les POLL_SECONDS.
+    """
+
+    def __init__(self):
+        self._wake = threading.Event()
+        self._thread = None
+        self.app = None
+
+    def start(self, app):
+        if self._thread is not None:
+            return
+        self.app = app
+        self._thread = threading.Thread(target=self._loop, name='notification-dispatcher', daemon=True)
+        self._thread.start()
+
+    def wake(self):
+        self._wake.set()
+
+    def _loop(self):
+        while True:
+            self._wake.wait(POLL_SECONDS)
+            self._wake.clear()
+            with self.app.app_context():
+                try:
+                    queue_due_reminders()
+                    while process_notifications() > 0:
+                        pass
+                except Exception as e:
+                    db.session.rollback()
+                    print(f"❌ Erreur envoi des notifications: {e}")
+                    traceback.print_exc()
+                finally:
+                    db.session.remove()
+
+
+notification_dispatcher = NotificationDispatcher()
@@ -0,0 +1,99 @@
+"""
+Génère data/postcode_gazetteer.bin à partir des exports GeoNames des codes postaux
+- Source : https://download.geonames.org/export/zip/ (CH.zip, FR.zip, BE.zip), licence CC BY 4.0
+- Un centroïde par code postal (moyenne des localités qui le partagent)
+- Localité retenue : la première listée par GeoNames pour ce code
+
+Usage :
+    python build_postcode_gazetteer.py --download        (build nixpacks / Dockerfile)
+    python build_postcode_gazetteer.py CH.zip FR.zip BE.zip
+    python build_postcode_gazetteer.py CH.txt FR.txt BE.txt --output data/postcode_gazetteer.bin
+"""
+
+import argparse
+import io
+import os
+import tempfile
+import urllib.request
+import zipfile
+
+from utils.postcode_gazetteer import COUNTRIES, DEFAULT_PATH, write_gazetteer
+
+GEONAMES_URL = 'https://download.geonames.org/export/zip/{country}.zip'
+
+
+def download_exports(directory):
+    """Télécharge les exports GeoNames des pays couverts, retourne les chemins des .zip"""
+    paths = []
+    for country in COUNTRIES:
+        url = GEONAMES_URL.format(country=country)
+        path = os.path.join(directory, f'{country}.zip')
+        print(f"  ⬇️ {url}")
+        with urllib.request.urlopen(url, timeout=120) as response, open(path, 'wb') as f:
+            f.write(response.read())
+        paths.append(path)
+    return paths
+
+
+def read_geonames_lines(path):
+    """Lignes d'un export GeoNames (.txt ou .zip contenant <PAYS>.txt)"""
+    if path.endswith('.zip'):
+        with zipfile.ZipFile(path) as archive:
+            name = next(n for n in archive.namelist() if n.endswith('.txt') and not n.lower().startswith('readme'))
+            with archive.open(name) as f:
+                yield from io.TextIOWrapper(f, encoding='utf-8')
+    else:
+        with open(path, encoding='utf-8') as f:
+            yield from f
+
+
+def collect_centroids(paths):
+    """{pays: [(code postal, lat, lng, localité)]} pour les pays couverts"""
+    points = {}
+    for path in paths:
+        for line in read_geonames_lines(path):
+            fields = line.rstrip('\n').split('\t')
+            if len(fields) < 11:
+                continue
+            country, postcode, place = fields[0], fields[1].strip(), fields[2]
+            if country not in COUNTRIES or not postcode.isdigit() or not fields[9] or not fields[10]:
+                continue
+            entry = points.setdefault(country, {}).setdefault(postcode, {'lat': 0.0, 'lng': 0.0, 'count': 0, 'place': place})
+            entry['lat'] += float(fields[9])
+            entry['lng'] += float(fields[10])
+            entry['count'] += 1
+
+    return {
+        country: [
+            (postcode, e['lat'] / e['count'], e['lng'] / e['count'], e['place'])
+            for postcode, e in postcodes.items()
+        ]
+        for country, postcodes in points.items()
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Génère le gazetteer des codes postaux (CH, FR, BE)")
+    parser.add_argument('sources', nargs='*', help="Exports GeoNames (.zip ou .txt)")
+    parser.add_argument('--download', action='store_true', help="Télécharger les exports depuis GeoNames")
+    parser.add_argument('--output', default=DEFAULT_PATH)
+    args = parser.parse_args()
+    if not args.sources and not args.download:
+        parser.error("exports GeoNames ou --download requis")
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    with tempfile.TemporaryDirectory() as directory:
+        sources = list(args.sources)
+        if args.download:
+            print("📮 Téléchargement des exports GeoNames...")
+            sources += download_exports(directory)
+        print("📮 Lecture des exports GeoNames...")
+        centroids = collect_centroids(sources)
+    counts = write_gazetteer(args.output, centroids, source='GeoNames postal codes (CC BY 4.0)')
+    for country, count in counts.items():
+        print(f"  ✅ {country}: {count} codes postaux")
+    print(f"💾 {args.output} ({os.path.getsize(args.output) // 1024} Ko)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,165 @@
+"""
+Expiration à l'heure exacte des offres flash (valid_until) et des activations de privilège (expires_at)
+- Tas (heapq) des prochaines échéances, un thread par processus qui dort jusqu'à la plus proche
+- Échéances ajoutées à la création (schedule()) et rechargées depuis la base toutes les
+  RELOAD_SECONDS (offres créées par les autres workers, redémarrages, échéances modifiées)
+- À l'échéance : offre désactivée (active = FALSE) et retirée des fils des membres, activation
+  passée en 'expired' ; les caches des listes sont invalidés (model_events.notify_change)
+- Mise à jour conditionnelle (échéance toujours dépassée, ligne encore active) : sans effet
+  si l'échéance a été repoussée ou si un autre worker est passé avant
+"""
+import heapq
+import threading
+import time
+import traceback
+from datetime import datetime, timedelta
+
+from sqlalchemy import bindparam, text, update
+
+from models import db, Offer
+from models_activation import PrivilegeActivation
+from model_events import notify_change
+
+RELOAD_SECONDS = 300
+LOOKAHEAD_SECONDS = 2 * RELOAD_SECONDS  # Échéances chargées à l'avance (recouvrement entre deux rechargements)
+
+FLASH_OFFER = 'flash_offer'
+ACTIVATION = 'activation'
+
+
+def expire_flash_offers(offer_ids, now=None):
+    """Désactive les offres flash échues parmi offer_ids, retourne [(id, partner_id)] (sans commit)"""
+    now = now or datetime.utcnow()
+    rows = db.session.execute(
+        update(Offer)
+        .where(
+            Offer.id.in_(offer_ids),
+            Offer.offer_type == 'flash',
+            Offer.active.is_(True),
+            Offer.valid_until <= now
+        )
+        .values(active=False, updated_at=now)
+        .returning(Offer.id, Offer.partner_id)
+        .execution_options(synchronize_session=False)
+    ).fetchall()
+    if rows:
+        db.session.execute(
+            text("DELETE FROM member_flash_feed WHERE offer_id IN :offer_ids").bindparams(
+                bindparam('offer_ids', expanding=True)
+            ),
+            {"offer_ids": [row[0] for row in rows]}
+        )
+    return rows
+
+
+def expire_activations(activation_ids, now=None):
+    """Passe en 'expired' les activations échues parmi activation_ids, retourne leur nombre (sans commit)"""
+    now = now or datetime.utcnow()
+    return db.session.execute(
+        update(PrivilegeActivation)
+        .where(
+            PrivilegeActivation.id.in_(activation_ids),
+            PrivilegeActivation.status == 'active',
+            PrivilegeActivation.expires_at <= now
+        )
+        .values(status='expired', updated_at=now)
+        .execution_options(synchronize_session=False)
+    ).rowcount
+
+
+class ExpiryScheduler:
+    """Thread de fond : tas des échéances (échéance, type, id), réveillé par schedule()"""
+
+    def __init__(self):
+        self._heap = []
+        self._scheduled = set()
+        self._condition = threading.Condition()
+        self._thread = None
+        self._next_reload = 0
+        self.app = None
+
+    def start(self, app):
+        if self._thread is not None:
+            return
+        self.app = app
+        self._thread = threading.Thread(target=self._loop, name='expiry-scheduler', daemon=True)
+        self._thread.start()
+
+    def schedule(self, kind, item_id, deadline):
+        """Ajoute une échéance (UTC naïf) ; le thread se réveille si elle est la plus proche"""
+        if deadline is None:
+            return
+        with self._condition:
+            entry = (deadline, kind, item_id)
+            if entry in self._scheduled:
+                return
+            self._scheduled.add(entry)
+            heapq.heappush(self._heap, entry)
+            self._condition.notify()
+
+    def _pop_due(self, now):
+        due = []
+        while self._heap and self._heap[0][0] <= now:
+            entry = heapq.heappop(self._heap)
+            self._scheduled.discard(entry)
+            due.append(entry)
+        return due
+
+    def _reload(self):
+        horizon = datetime.utcnow() + timedelta(seconds=LOOKAHEAD_SECONDS)
+        offers = db.session.query(Offer.id, Offer.valid_until).filter(
+            Offer.offer_type == 'flash',
+            Offer.active.is_(True),
+            Offer.valid_until <= horizon
+        ).all()
+        activations = db.session.query(PrivilegeActivation.id, PrivilegeActivation.expires_at).filter(
+            PrivilegeActivation.status == 'active',
+            PrivilegeActivation.expires_at <= horizon
+        ).all()
+        db.session.commit()
+        for offer_id, deadline in offers:
+            self.schedule(FLASH_OFFER, offer_id, deadline)
+        for activation_id, deadline in activations:
+            self.schedule(ACTIVATION, activation_id, deadline)
+
+    def _expire(self, due):
+        now = datetime.utcnow()
+        offer_ids = [item_id for _deadline, kind, item_id in due if kind == FLASH_OFFER]
+        activation_ids = [item_id for _deadline, kind, item_id in due if kind == ACTIVATION]
+        expired_offers = expire_flash_offers(offer_ids, now) if offer_ids else []
+        expired_activations = expire_activations(activation_ids, now) if activation_ids else 0
+        db.session.commit()
+        if expired_offers:
+            # Listes en cache (search_v2, index géographique) : SQL en bloc, hors ORM
+            notify_change('offers', [
+                {'id': offer_id, 'partner_id': partner_id, 'active': False} for offer_id, partner_id in expired_offers
+            ])
+        if expired_offers or expired_activations:
+            print(f"⏰ Expiration : {len(expired_offers)} offre(s) flash, {expired_activations} activation(s)")
+
+    def _loop(self):
+        while True:
+            with self.app.app_context():
+                try:
+                    if time.monotonic() >= self._next_reload:
+                        self._reload()
+                        self._next_reload = time.monotonic() + RELOAD_SECONDS
+                    with self._condition:
+                        due = self._pop_due(datetime.utcnow())
+                        if not due:
+                            timeout = self._next_reload - time.monotonic()
+                            if self._heap:
+                                timeout = min(timeout, (self._heap[0][0] - datetime.utcnow()).total_seconds())
+                            self._condition.wait(max(timeout, 0))
+                    if due:
+                        self._expire(due)
+                except Exception as e:
+                    db.session.rollback()
+                    print(f"❌ Erreur expiration des offres: {e}")
+                    traceback.print_exc()
+                    time.sleep(5)
+                finally:
+                    db.session.remove()
+
+
+expiry_scheduler = ExpiryScheduler()
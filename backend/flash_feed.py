@@ -0,0 +1,123 @@
+"""
+Fil des offres flash précalculé par membre (table member_flash_feed)
+- Création d'une offre flash : les membres concernés (favoris du commerçant + membres à moins
+  de FLASH_PROXIMITY_RADIUS_KM de l'un de ses établissements, index idx_members_location)
+  reçoivent l'offre en une seule requête INSERT ... SELECT
+- Favori ajouté : offres flash en cours du commerçant ajoutées au fil ; favori retiré : fil recalculé
+- Offres échues retirées à l'heure exacte (expiry_scheduler), épuisées par prune_flash_feed()
+- GET /api/member/offers/flash ne lit que le fil du membre
+"""
+from sqlalchemy import text
+
+from models import db
+from utils.geo_query import GeoQuery
+
+# Rayon de proximité pour les offres flash (hors favoris)
+FLASH_PROXIMITY_RADIUS_KM = 10
+
+
+def _partner_points(partner_id):
+    """Positions de l'établissement principal et des établissements secondaires"""
+    return db.session.execute(text("""
+        SELECT latitude, longitude FROM partners
+        WHERE id = :partner_id AND latitude IS NOT NULL AND longitude IS NOT NULL
+        UNION
+        SELECT latitude, longitude FROM partner_addresses
+        WHERE partner_id = :partner_id AND latitude IS NOT NULL AND longitude IS NOT NULL
+    """), {"partner_id": partner_id}).fetchall()
+
+
+def fan_out_offer(offer_id):
+    """Ajoute une offre flash au fil des membres concernés (sans commit), retourne le nombre de membres"""
+    offer = db.session.execute(text("""
+        SELECT partner_id, valid_until FROM offers WHERE id = :offer_id AND offer_type = 'flash'
+    """), {"offer_id": offer_id}).fetchone()
+    if offer is None:
+        return 0
+
+    params = {"offer_id": offer_id, "partner_id": offer[0], "valid_until": offer[1]}
+    filters = ["m.id IN (SELECT mf.member_id FROM member_favorites mf WHERE mf.partner_id = :partner_id)"]
+    for i, (lat, lng) in enumerate(_partner_points(offer[0])):
+        # Un rectangle par établissement : chacun servi par l'index (latitude, longitude)
+        geo = GeoQuery(lat, lng, FLASH_PROXIMITY_RADIUS_KM, prefix=f'geo{i}')
+        filters.append(geo.within('m.latitude', 'm.longitude'))
+        params.update(geo.params)
+
+    result = db.session.execute(text(f"""
+        INSERT INTO member_flash_feed (member_id, offer_id, valid_until)
+        SELECT m.id, :offer_id, :valid_until
+        FROM members m
+        WHERE {' OR '.join(filters)}
+        ON CONFLICT (member_id, offer_id) DO NOTHING
+    """), params)
+    return result.rowcount
+
+
+def add_partner_to_feed(member_id, partner_id):
+    """Nouveau favori : offres flash en cours du commerçant ajoutées au fil du membre (sans commit)"""
+    db.session.execute(text("""
+        INSERT INTO member_flash_feed (member_id, offer_id, valid_until)
+        SELECT :member_id, o.id, o.valid_until
+        FROM offers o
+        WHERE o.partner_id = :partner_id
+        AND o.offer_type = 'flash'
+        AND o.active = TRUE
+        ON CONFLICT (member_id, offer_id) DO NOTHING
+    """), {"member_id": member_id, "partner_id": partner_id})
+
+
+def rebuild_member_feed(member_id):
+    """Recalcule le fil d'un membre (favori retiré, position modifiée), sans commit"""
+    member = db.session.execute(text("""
+        SELECT latitude, longitude FROM members WHERE id = :member_id
+    """), {"member_id": member_id}).fetchone()
+    if member is None:
+        return
+
+    params = {"member_id": member_id}
+    filters = ["o.partner_id IN (SELECT mf.partner_id FROM member_favorites mf WHERE mf.member_id = :member_id)"]
+    if member[0] is not None and member[1] is not None:
+        geo = GeoQuery(member[0], member[1], FLASH_PROXIMITY_RADIUS_KM)
+        filters.append(f"o.partner_id IN (SELECT p.id FROM partners p WHERE {geo.within('p.latitude', 'p.longitude')})")
+        filters.append(
+            f"o.partner_id IN (SELECT pa.partner_id FROM partner_addresses pa WHERE {geo.within('pa.latitude', 'pa.longitude')})"
+        )
+        params.update(geo.params)
+
+    db.session.execute(text("DELETE FROM member_flash_feed WHERE member_id = :member_id"), params)
+    db.session.execute(text(f"""
+        INSERT INTO member_flash_feed (member_id, offer_id, valid_until)
+        SELECT :member_id, o.id, o.valid_until
+        FROM offers o
+        WHERE o.offer_type = 'flash'
+        AND o.active = TRUE
+        AND ({' OR '.join(filters)})
+    """), params)
+
+
+def prune_flash_feed():
+    """Retire des fils les offres expirées ou désactivées (sans commit), retourne le nombre de lignes"""
+    result = db.session.execute(text("""
+        DELETE FROM member_flash_feed
+        WHERE valid_until <= NOW()
+        OR offer_id IN (SELECT id FROM offers WHERE offer_type = 'flash' AND active = FALSE)
+    """))
+    return result.rowcount
+
+
+def member_feed_rows(member_id):
+    """Offres flash du fil d'un membre, avec leur commerçant, de la plus proche de l'expiration"""
+    return db.session.execute(text("""
+        SELECT
+            o.id, o.title, o.discount_val, o.description,
+            o.stock, o.stock as current_stock, o.valid_from, o.valid_until,
+            p.id as partner_id, p.name as partner_name, p.city, p.category,
+            p.latitude, p.longitude
+        FROM member_flash_feed f
+        JOIN offers o ON o.id = f.offer_id
+        JOIN partners p ON p.id = o.partner_id
+        WHERE f.member_id = :member_id
+        AND o.active = TRUE
+        AND o.stock > 0
+        ORDER BY f.valid_until ASC, o.id ASC
+    """), {"member_id": member_id}).fetchall()
@@ -0,0 +1,310 @@
+"""
+Compteurs de stock des offres flash (admission des réservations sans verrou sur offers)
+- Chaque réservation est admise ou refusée par un compteur atomique (Redis si REDIS_URL,
+  compteur en mémoire si FLASH_STOCK_COUNTER=local pour un seul processus) avant toute écriture
+- La réservation est insérée avec stock_applied = FALSE ; le stock de la table offers
+  est mis à jour par lots par un thread (write-behind), sans contention sur la ligne de l'offre
+- Sans Redis ni compteur local (gunicorn -w 4 : un compteur en mémoire par worker vendrait
+  le stock plusieurs fois), admission par UPDATE conditionnel de offers.stock dans la
+  transaction de la réservation, insérée alors avec stock_applied = TRUE
+- Un compteur absent (démarrage, éviction) est reconstruit depuis la base :
+  stock - réservations pas encore reportées
+"""
+import os
+import threading
+import traceback
+from datetime import datetime, timedelta
+
+from sqlalchemy import bindparam, text
+
+from models import db
+
+FLUSH_SECONDS = 5
+FLUSH_BATCH_SIZE = 5000
+COUNTER_GRACE_SECONDS = 3600  # Compteurs conservés après la fin de validité de l'offre
+
+# reserve() : stock restant (>= 0) ou l'un de ces codes
+ALREADY_RESERVED = -2
+SOLD_OUT = -1
+_UNKNOWN = -3  # Compteur à initialiser
+
+# KEYS : compteur, membres admis ; ARGV : member_id
+_RESERVE_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 0 then return -3 end
+if redis.call('SADD', KEYS[2], ARGV[1]) == 0 then return -2 end
+local left = redis.call('DECR', KEYS[1])
+if left < 0 then
+    redis.call('INCR', KEYS[1])
+    redis.call('SREM', KEYS[2], ARGV[1])
+    return -1
+end
+return left
+"""
+
+# KEYS : compteur, membres admis ; ARGV : quantité, member_id (facultatif)
+_RESTOCK_SCRIPT = """
+if ARGV[2] then redis.call('SREM', KEYS[2], ARGV[2]) end
+if redis.call('EXISTS', KEYS[1]) == 0 then return -3 end
+return redis.call('INCRBY', KEYS[1], ARGV[1])
+"""
+
+
+def load_offer_stock(offer_id):
+    """(stock disponible, fin de validité) d'une offre flash active, None si indisponible"""
+    row = db.session.execute(text("""
+        SELECT o.stock - (
+                   SELECT COUNT(*) FROM flash_reservations fr
+                   WHERE fr.offer_id = o.id AND fr.stock_applied = FALSE
+               ),
+               o.valid_until
+        FROM offers o
+        WHERE o.id = :offer_id
+        AND o.offer_type = 'flash'
+        AND o.active = TRUE
+        AND o.valid_until > NOW()
+    """), {"offer_id": offer_id}).fetchone()
+    if row is None:
+        return None
+    return max(row[0] or 0, 0), row[1]
+
+
+class LocalStockCounter:
+    """Compteurs en mémoire du processus (un seul worker : sinon chaque worker a son propre stock)"""
+
+    applies_stock = False  # Stock de offers reporté par flush_stock
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._offers = {}  # offer_id -> [stock restant, membres admis, fin de validité]
+
+    def reserve(self, offer_id, member_id):
+        with self._lock:
+            entry = self._offers.get(offer_id)
+            if entry is None:
+                return _UNKNOWN
+            if member_id in entry[1]:
+                return ALREADY_RESERVED
+            if entry[0] <= 0:
+                return SOLD_OUT
+            entry[0] -= 1
+            entry[1].add(member_id)
+            return entry[0]
+
+    def release(self, offer_id, member_id):
+        with self._lock:
+            entry = self._offers.get(offer_id)
+            if entry is not None and member_id in entry[1]:
+                entry[0] += 1
+                entry[1].discard(member_id)
+
+    def restock(self, offer_id, quantity, member_id=None):
+        with self._lock:
+            entry = self._offers.get(offer_id)
+            if entry is not None:
+                entry[0] += quantity
+                entry[1].discard(member_id)
+
+    def initialize(self, offer_id, stock, valid_until):
+        with self._lock:
+            now = datetime.utcnow()
+            for expired in [key for key, entry in self._offers.items() if entry[2] < now]:
+                del self._offers[expired]
+            self._offers.setdefault(offer_id, [stock, set(), valid_until + timedelta(seconds=COUNTER_GRACE_SECONDS)])
+
+    def forget(self, offer_id):
+        with self._lock:
+            self._offers.pop(offer_id, None)
+
+
+class RedisStockCounter:
+    """Compteurs partagés par tous les workers (DECR atomique dans un script Lua)"""
+
+    applies_stock = False
+
+    def __init__(self, url):
+        import redis
+        self.client = redis.Redis.from_url(url)
+        self._reserve = self.client.register_script(_RESERVE_SCRIPT)
+        self._restock = self.client.register_script(_RESTOCK_SCRIPT)
+
+    @staticmethod
+    def _keys(offer_id):
+        return f"flash_stock/{offer_id}", f"flash_stock/{offer_id}/members"
+
+    def reserve(self, offer_id, member_id):
+        return int(self._reserve(keys=self._keys(offer_id), args=[member_id]))
+
+    def release(self, offer_id, member_id):
+        counter, members = self._keys(offer_id)
+        if self.client.srem(members, member_id):
+            self.client.incr(counter)
+
+    def restock(self, offer_id, quantity, member_id=None):
+        args = [quantity] if member_id is None else [quantity, member_id]
+        self._restock(keys=self._keys(offer_id), args=args)
+
+    def initialize(self, offer_id, stock, valid_until):
+        counter, members = self._keys(offer_id)
+        expire_at = valid_until + timedelta(seconds=COUNTER_GRACE_SECONDS)
+        # NX : un autre worker a pu initialiser (et déjà décrémenter) le compteur entre-temps
+        if self.client.set(counter, stock, nx=True):
+            self.client.delete(members)
+        pipe = self.client.pipeline()
+        pipe.expireat(counter, expire_at)
+        pipe.expireat(members, expire_at)
+        pipe.execute()
+
+    def forget(self, offer_id):
+        self.client.delete(*self._keys(offer_id))
+
+
+class DatabaseStockCounter:
+    """
+    Admission directement sur offers.stock (plusieurs workers sans Redis) : la ligne de l'offre
+    reste verrouillée jusqu'au commit de la réservation, un rollback rend la place
+    """
+
+    applies_stock = True  # Réservation insérée déjà décomptée
+
+    def reserve(self, offer_id, member_id):
+        # Réservations d'un autre mode (compteur) pas encore reportées : déduites du stock
+        pending = """
+            (SELECT COUNT(*) FROM flash_reservations
+             WHERE offer_id = :offer_id AND stock_applied = FALSE)
+        """
+        row = db.session.execute(text(f"""
+            UPDATE offers SET stock = stock - 1, updated_at = NOW()
+            WHERE id = :offer_id
+            AND offer_type = 'flash'
+            AND active = TRUE
+            AND valid_until > NOW()
+            AND stock > {pending}
+            RETURNING stock - {pending}
+        """), {"offer_id": offer_id}).fetchone()
+        return SOLD_OUT if row is None else row[0]
+
+    def release(self, offer_id, member_id):
+        pass  # Rendue par le rollback de la transaction
+
+    def restock(self, offer_id, quantity, member_id=None):
+        pass  # offers.stock déjà à jour
+
+
+def _build_counter():
+    url = os.getenv('REDIS_URL')
+    if url:
+        return RedisStockCounter(url)
+    if os.getenv('FLASH_STOCK_COUNTER') == 'local':
+        return LocalStockCounter()
+    return DatabaseStockCounter()
+
+
+stock_counter = _build_counter()
+
+
+def reserve_stock(offer_id, member_id):
+    """
+    Admet (ou refuse) une réservation sur le compteur de l'offre.
+    Retourne le stock restant, SOLD_OUT, ALREADY_RESERVED ou None si l'offre est indisponible.
+    """
+    left = stock_counter.reserve(offer_id, member_id)
+    if left != _UNKNOWN:
+        return left
+    loaded = load_offer_stock(offer_id)
+    if loaded is None:
+        return None
+    stock_counter.initialize(offer_id, *loaded)
+    return stock_counter.reserve(offer_id, member_id)
+
+
+def release_stock(offer_id, member_id):
+    """Rend la place d'une réservation admise mais non enregistrée"""
+    try:
+        stock_counter.release(offer_id, member_id)
+    except Exception as e:
+        print(f"⚠️ Compteur de stock flash {offer_id} non rétabli: {e}")
+
+
+def restock(offer_id, quantity, member_id=None):
+    """
+    Places rendues au compteur (annulation de member_id, stock augmenté), après le commit.
+    Compteur absent : rien à faire, il sera reconstruit depuis la base.
+    """
+    try:
+        stock_counter.restock(offer_id, quantity, member_id)
+    except Exception as e:
+        print(f"⚠️ Compteur de stock flash {offer_id} non rétabli: {e}")
+
+
+def flush_stock(limit=FLUSH_BATCH_SIZE):
+    """
+    Reporte dans offers.stock un lot de réservations pas encore décomptées, retourne leur nombre.
+    Une transaction : les réservations passent à stock_applied = TRUE et le stock de chaque offre
+    diminue d'autant (une requête par lot).
+    """
+    query = """
+        SELECT id, offer_id FROM flash_reservations
+        WHERE stock_applied = FALSE
+        ORDER BY id
+        LIMIT :limit
+    """
+    if db.engine.dialect.name == 'postgresql':
+        query += " FOR UPDATE SKIP LOCKED"
+    rows = db.session.execute(text(query), {"limit": limit}).fetchall()
+    if not rows:
+        db.session.commit()
+        return 0
+
+    per_offer = {}
+    for _reservation_id, offer_id in rows:
+        per_offer[offer_id] = per_offer.get(offer_id, 0) + 1
+    db.session.execute(
+        text("UPDATE offers SET stock = stock - :count, updated_at = NOW() WHERE id = :offer_id"),
+        [{"offer_id": offer_id, "count": count} for offer_id, count in per_offer.items()]
+    )
+    db.session.execute(
+        text("UPDATE flash_reservations SET stock_applied = TRUE WHERE id IN :ids").bindparams(
+            bindparam('ids', expanding=True)
+        ),
+        {"ids": [row[0] for row in rows]}
+    )
+    db.session.commit()
+    print(f"⚡ Stock flash : {len(rows)} réservation(s) reportée(s) sur {len(per_offer)} offre(s)")
+    return len(rows)
+
+
+class FlashStockFlusher:
+    """Thread de fond (un par processus) : report du stock toutes les FLUSH_SECONDS ou sur wake()"""
+
+    def __init__(self):
+        self._wake = threading.Event()
+        self._thread = None
+        self.app = None
+
+    def start(self, app):
+        if self._thread is not None:
+            return
+        self.app = app
+        self._thread = threading.Thread(target=self._loop, name='flash-stock-flusher', daemon=True)
+        self._thread.start()
+
+    def wake(self):
+        self._wake.set()
+
+    def _loop(self):
+        while True:
+            self._wake.wait(FLUSH_SECONDS)
+            self._wake.clear()
+            with self.app.app_context():
+                try:
+                    while flush_stock() >= FLUSH_BATCH_SIZE:
+                        pass
+                except Exception as e:
+                    db.session.rollback()
+                    print(f"❌ Erreur report du stock flash: {e}")
+                    traceback.print_exc()
+                finally:
+                    db.session.remove()
+
+
+flash_stock_flusher = FlashStockFlusher()
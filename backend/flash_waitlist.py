@@ -0,0 +1,200 @@
+"""
+Liste d'attente des offres flash épuisées (table waitlist) et promotion automatique
+- Une place se libère (annulation, stock augmenté, inscription alors qu'il reste du stock) :
+  les N premiers inscrits (ordre joined_at) sont retirés de la file en une seule requête
+- Chaque membre promu reçoit directement sa réservation (admise par le compteur flash_stock),
+  insérée en un seul lot, puis tous sont prévenus par un envoi groupé
+- Un thread par processus traite les promotions hors de la requête HTTP : wake() pour les
+  places libérées par ce processus, et toutes les POLL_SECONDS (et au démarrage) un balayage
+  des offres ayant à la fois des inscrits et du stock libre, recalculé depuis la base :
+  rien n'est perdu au redémarrage d'un worker ni pour les places libérées par un autre
+"""
+import threading
+import time
+import traceback
+
+from sqlalchemy import bindparam, text
+
+from flash_stock import ALREADY_RESERVED, release_stock, reserve_stock, stock_counter
+from models import db
+from notification_senders import senders
+
+POLL_SECONDS = 60
+
+
+def waitlist_position(offer_id, member_id):
+    """Rang (1 = premier) d'un membre dans la file d'une offre, None s'il n'y est pas"""
+    return db.session.execute(text("""
+        SELECT COUNT(*) FROM waitlist w
+        JOIN waitlist mine ON mine.offer_id = w.offer_id AND mine.member_id = :member_id AND mine.notified = FALSE
+        WHERE w.offer_id = :offer_id
+        AND w.notified = FALSE
+        AND (w.joined_at, w.id) <= (mine.joined_at, mine.id)
+    """), {"offer_id": offer_id, "member_id": member_id}).scalar() or None
+
+
+def _pop_waitlist(offer_id, count):
+    """Retire de la file les `count` premiers inscrits (une requête), retourne [(joined_at, waitlist_id, member_id)]"""
+    lock = " FOR UPDATE SKIP LOCKED" if db.engine.dialect.name == 'postgresql' else ""
+    return db.session.execute(text(f"""
+        UPDATE waitlist SET notified = TRUE, notified_at = NOW()
+        WHERE id IN (
+            SELECT id FROM waitlist
+            WHERE offer_id = :offer_id AND notified = FALSE
+            ORDER BY joined_at, id
+            LIMIT :count{lock}
+        )
+        RETURNING joined_at, id, member_id
+    """), {"offer_id": offer_id, "count": count}).fetchall()
+
+
+def promote_waitlist(offer_id, count):
+    """
+    Promeut jusqu'à `count` membres de la file : réservation créée pour chacun tant que
+    le compteur de stock l'admet, les autres reprennent leur place. Retourne le nombre promu.
+    """
+    popped = sorted(_pop_waitlist(offer_id, count))
+    if not popped:
+        db.session.commit()
+        return 0
+
+    holders = set(db.session.execute(
+        text("""
+            SELECT member_id FROM flash_reservations
+            WHERE offer_id = :offer_id AND member_id IN :member_ids AND status != 'cancelled'
+        """).bindparams(bindparam('member_ids', expanding=True)),
+        {"offer_id": offer_id, "member_ids": [row[2] for row in popped]}
+    ).scalars())
+
+    admitted, requeued = [], []
+    for index, (_joined_at, _waitlist_id, member_id) in enumerate(popped):
+        if member_id in holders:
+            continue  # Réservé entre-temps : sort de la file
+        left = reserve_stock(offer_id, member_id)
+        if left == ALREADY_RESERVED:
+            continue
+        if left is None or left < 0:
+            requeued = [row[1] for row in popped[index:]]
+            break
+        admitted.append(member_id)
+
+    try:
+        if requeued:
+            db.session.execute(
+                text("UPDATE waitlist SET notified = FALSE, notified_at = NULL WHERE id IN :ids").bindparams(
+                    bindparam('ids', expanding=True)
+                ),
+                {"ids": requeued}
+            )
+        offer = db.session.execute(text("""
+            SELECT o.partner_id, o.title, p.name FROM offers o JOIN partners p ON p.id = o.partner_id
+            WHERE o.id = :offer_id
+        """), {"offer_id": offer_id}).fetchone()
+        if admitted:
+            db.session.execute(text("""
+                INSERT INTO flash_reservations (member_id, partner_id, offer_id, status, stock_applied, created_at)
+                VALUES (:member_id, :partner_id, :offer_id, 'confirmed', :stock_applied, NOW())
+            """), [
+                {"member_id": member_id, "partner_id": offer[0], "offer_id": offer_id,
+                 "stock_applied": stock_counter.applies_stock}
+                for member_id in admitted
+            ])
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        for member_id in admitted:
+            release_stock(offer_id, member_id)
+        raise
+
+    if admitted:
+        _notify_promoted(admitted, offer[1], offer[2])
+    return len(admitted)
+
+
+def pending_promotions():
+    """{offer_id: places libres} des offres flash valides ayant des inscrits en attente et du stock"""
+    rows = db.session.execute(text("""
+        SELECT o.id, o.stock - (
+                   SELECT COUNT(*) FROM flash_reservations fr
+                   WHERE fr.offer_id = o.id AND fr.stock_applied = FALSE
+               ) AS available
+        FROM offers o
+        WHERE o.id IN (SELECT DISTINCT offer_id FROM waitlist WHERE notified = FALSE)
+        AND o.offer_type = 'flash'
+        AND o.active = TRUE
+        AND o.valid_until > NOW()
+    """)).fetchall()
+    return {offer_id: available for offer_id, available in rows if available > 0}
+
+
+def _notify_promoted(member_ids, offer_title, partner_name):
+    """Prévient les membres promus (un seul envoi groupé)"""
+    emails = db.session.execute(
+        text("""
+            SELECT u.email FROM members m JOIN users u ON u.id = m.user_id
+            WHERE m.id IN :member_ids AND u.email IS NOT NULL
+        """).bindparams(bindparam('member_ids', expanding=True)),
+        {"member_ids": member_ids}
+    ).scalars().all()
+    messages = [{
+        'to': email,
+        'subject': "Une place s'est libérée",
+        'body': f"Bonne nouvelle : une place s'est libérée, votre réservation de l'offre flash "
+                f"« {offer_title} » chez {partner_name} est confirmée."
+    } for email in emails]
+    if messages:
+        sent = sum(1 for ok, _error in senders['email'].send_batch(messages) if ok)
+        print(f"🎟️ Liste d'attente : {len(member_ids)} membre(s) promu(s), {sent} prévenu(s)")
+
+
+class WaitlistPromoter:
+    """Thread de fond (un par processus) : promotions demandées par wake(offer_id, places) et balayage périodique"""
+
+    def __init__(self):
+        self._wake = threading.Event()
+        self._lock = threading.Lock()
+        self._pending = {}  # offer_id -> places libérées
+        self._thread = None
+        self.app = None
+
+    def start(self, app):
+        if self._thread is not None:
+            return
+        self.app = app
+        self._thread = threading.Thread(target=self._loop, name='waitlist-promoter', daemon=True)
+        self._thread.start()
+
+    def wake(self, offer_id, count=1):
+        with self._lock:
+            self._pending[offer_id] = self._pending.get(offer_id, 0) + count
+        self._wake.set()
+
+    def _loop(self):
+        next_sweep = 0
+        while True:
+            with self._lock:
+                pending, self._pending = self._pending, {}
+            with self.app.app_context():
+                if time.monotonic() >= next_sweep:
+                    # Places libérées hors de ce processus (autres workers, redémarrage)
+                    try:
+                        for offer_id, available in pending_promotions().items():
+                            pending[offer_id] = max(pending.get(offer_id, 0), available)
+                        db.session.commit()
+                    except Exception as e:
+                        db.session.rollback()
+                        print(f"❌ Erreur balayage des listes d'attente: {e}")
+                    next_sweep = time.monotonic() + POLL_SECONDS
+                for offer_id, count in pending.items():
+                    try:
+                        promote_waitlist(offer_id, count)
+                    except Exception as e:
+                        db.session.rollback()
+                        print(f"❌ Erreur promotion liste d'attente (offre {offer_id}): {e}")
+                        traceback.print_exc()
+                db.session.remove()
+            self._wake.wait(max(next_sweep - time.monotonic(), 0))
+            self._wake.clear()
+
+
+waitlist_promoter = WaitlistPromoter()
@@ -1,7 +1,8 @@
 """
 Géocodage automatique des partenaires PEP's
 - Utilise Nominatim (OpenStreetMap) - gratuit, pas de clé API requise
-- Rate limiting automatique (1 requête/seconde max)
+- Rate limiting automatique (1 requête/seconde max, appels réseau uniquement)
+- Cache de géocodage partagé : les adresses déjà résolues ne sont pas redemandées
 - Fallback sur plusieurs formats d'adresse
 - Sauvegarde progressive des résultats
 - Logging détaillé pour debug
@@ -11,6 +12,7 @@ from geopy.geocoders import Nominatim
 from geopy.exc import GeocoderTimedOut, GeocoderServiceError
 from sqlalchemy import text
 from models import db, Partner
+from utils.geocoding_cache import geocoding_cache, address_key, structured_address_key
 import time
 import traceback
 from datetime import datetime
@@ -25,11 +27,11 @@ class PartnerGeocoder:
         self.success_count = 0
         self.error_count = 0
         self.skipped_count = 0
-        self.rate_limit_delay = 1.1  # Nominatim limite: 1 req/sec
         
     def build_address_variants(self, partner):
         """
         Construit plusieurs variantes d'adresse pour maximiser les chances de géocodage
+        Retourne une liste de (clé de cache, adresse)
         """
         variants = []
         
@@ -47,51 +49,61 @@ class PartnerGeocoder:
             else:
                 full_address.append('Switzerland')
             
-            variants.append(' '.join(full_address))
+            variants.append((
+                structured_address_key(partner.address_street, partner.address_number,
+                                       partner.address_postal_code, partner.address_city,
+                                       partner.address_country or 'CH'),
+                ' '.join(full_address)
+            ))
         
         # Format 2 : Nom du partenaire + ville (pour commerces connus)
+        free_text_variants = []
         if partner.city:
-            variants.append(f"{partner.name}, {partner.city}, Switzerland")
+            free_text_variants.append(f"{partner.name}, {partner.city}, Switzerland")
         
         # Format 3 : Ville + code postal seulement
         if partner.address_city and partner.address_postal_code:
-            variants.append(f"{partner.address_postal_code} {partner.address_city}, Switzerland")
+            free_text_variants.append(f"{partner.address_postal_code} {partner.address_city}, Switzerland")
         
         # Format 4 : Ville seule (dernière option)
         if partner.city:
-            variants.append(f"{partner.city}, Switzerland")
+            free_text_variants.append(f"{partner.city}, Switzerland")
         elif partner.address_city:
-            variants.append(f"{partner.address_city}, Switzerland")
+            free_text_variants.append(f"{partner.address_city}, Switzerland")
         
+        variants.extend((address_key(address), address) for address in free_text_variants)
         return variants
     
     def geocode_address(self, address_variants, partner_name):
         """
         Tente de géocoder en essayant plusieurs variantes d'adresse
         """
-        for i, address in enumerate(address_variants):
-            try:
-                print(f"    Tentative {i+1}/{len(address_variants)}: {address[:80]}...")
-                
+        for i, (cache_key, address) in enumerate(address_variants):
+            def fetch():
                 location = self.geolocator.geocode(
                     address,
                     exactly_one=True,
                     addressdetails=True,
                     language='fr'
                 )
+                return location.raw if location else None
+            
+            try:
+                print(f"    Tentative {i+1}/{len(address_variants)}: {address[:80]}...")
+                
+                # Rate limiting appliqué par le cache aux seuls appels réseau
+                place = geocoding_cache.geocode(cache_key, fetch)
                 
-                if location:
+                if place:
                     # Vérifier que c'est bien en Suisse
-                    country = location.raw.get('address', {}).get('country', '')
-                    if 'switzerland' in country.lower() or 'suisse' in country.lower():
-                        print(f"    ✅ Trouvé: {location.address[:100]}")
-                        return location.latitude, location.longitude, location.address
+                    place_address = place.get('address', {})
+                    country = place_address.get('country', '')
+                    if place_address.get('country_code') == 'ch' or 'switzerland' in country.lower() or 'suisse' in country.lower():
+                        print(f"    ✅ Trouvé: {place['display_name'][:100]}")
+                        return float(place['lat']), float(place['lon']), place['display_name']
                     else:
                         print(f"    ⚠️  Résultat hors Suisse: {country}")
                 
-                # Rate limiting
-                time.sleep(self.rate_limit_delay)
-                
             except GeocoderTimedOut:
                 print(f"    ⏱️  Timeout - retry...")
                 time.sleep(2)
@@ -188,10 +200,6 @@ class PartnerGeocoder:
                 print(f"{'='*80}")
                 
                 self.geocode_partner(partner)
-                
-                # Pause entre chaque partenaire (rate limiting)
-                if i < total:
-                    time.sleep(self.rate_limit_delay)
             
             # Statistiques finales
             self.print_summary(total)
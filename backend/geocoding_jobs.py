@@ -0,0 +1,215 @@
+"""
+Géocodage des établissements en tâche de fond
+L'inscription enregistre les adresses avec le centroïde de leur code postal
+(gazetteer hors ligne, provisoire) et crée un GeocodingJob par adresse ;
+un thread par processus traite la file (Nominatim via le cache partagé).
+Plusieurs workers gunicorn se partagent la file (FOR UPDATE SKIP LOCKED).
+"""
+import threading
+import traceback
+from datetime import datetime, timedelta
+
+from geopy.geocoders import Nominatim
+from sqlalchemy import text
+
+from models import db, Partner, PartnerAddress, GeocodingJob
+from utils.geocoding_cache import geocoding_cache, structured_address_key
+from utils.postcode_gazetteer import postcode_gazetteer
+
+POLL_SECONDS = 30  # Reprise des retards et des jobs créés par les autres workers
+BATCH_SIZE = 10
+MAX_ATTEMPTS = 5
+RETRY_BASE_SECONDS = 60  # 1, 2, 4, 8 min...
+STALE_RUNNING = timedelta(minutes=10)  # Job "running" d'un worker arrêté en cours de route
+
+geolocator = Nominatim(user_agent="peps_partner_registration")
+
+
+def geocode_partner_address(address):
+    """
+    (latitude, longitude) d'un PartnerAddress, None si Nominatim ne trouve pas l'adresse.
+    Les erreurs réseau sont propagées (le job sera retenté).
+    """
+    full_address = f"{address.number or ''} {address.street}, {address.postal_code} {address.city}"
+
+    def fetch():
+        location = geolocator.geocode(
+            full_address, timeout=10, addressdetails=True, country_codes=(address.country or 'CH').lower()
+        )
+        return location.raw if location else None
+
+    place = geocoding_cache.geocode(
+        structured_address_key(address.street, address.number, address.postal_code, address.city, address.country),
+        fetch
+    )
+    if not place:
+        return None
+    return float(place['lat']), float(place['lon'])
+
+
+def apply_postcode_centroids(partner, addresses):
+    """
+    Coordonnées provisoires instantanées : centroïde du code postal de chaque adresse
+    (remplacées par le résultat Nominatim, conservées s'il échoue)
+    """
+    for address in addresses:
+        centroid = postcode_gazetteer.lookup(address.country, address.postal_code)
+        if centroid is None or address.latitude is not None:
+            continue
+        address.latitude, address.longitude = centroid[0], centroid[1]
+        if address.is_primary and partner.latitude is None:
+            partner.latitude, partner.longitude = centroid[0], centroid[1]
+
+
+def enqueue_partner_addresses(partner_id, addresses):
+    """Crée les jobs de géocodage (dans la transaction de l'appelant, sans commit)"""
+    for address in addresses:
+        db.session.add(GeocodingJob(partner_id=partner_id, partner_address_id=address.id))
+
+
+def _claim_jobs(limit):
+    """Passe jusqu'à `limit` jobs dus en 'running' et retourne leurs IDs"""
+    now = datetime.utcnow()
+    # Jobs abandonnés par un processus arrêté
+    GeocodingJob.query.filter(
+        GeocodingJob.status == 'running',
+        GeocodingJob.updated_at < now - STALE_RUNNING
+    ).update({GeocodingJob.status: 'pending'}, synchronize_session=False)
+
+    if db.engine.dialect.name == 'postgresql':
+        rows = db.session.execute(text("""
+            UPDATE geocoding_jobs
+            SET status = 'running', attempts = attempts + 1, updated_at = :now
+            WHERE id IN (
+                SELECT id FROM geocoding_jobs
+                WHERE status = 'pending' AND next_attempt_at <= :now
+                ORDER BY next_attempt_at, id
+                LIMIT :limit
+                FOR UPDATE SKIP LOCKED
+            )
+            RETURNING id
+        """), {'now': now, 'limit': limit}).fetchall()
+        job_ids = [row.id for row in rows]
+    else:
+        job_ids = [job_id for (job_id,) in db.session.query(GeocodingJob.id).filter(
+            GeocodingJob.status == 'pending',
+            GeocodingJob.next_attempt_at <= now
+        ).order_by(GeocodingJob.next_attempt_at, GeocodingJob.id).limit(limit)]
+        if job_ids:
+            GeocodingJob.query.filter(GeocodingJob.id.in_(job_ids)).update({
+                GeocodingJob.status: 'running',
+                GeocodingJob.attempts: GeocodingJob.attempts + 1,
+                GeocodingJob.updated_at: now
+            }, synchronize_session=False)
+    db.session.commit()
+    return job_ids
+
+
+def _run_job(job):
+    address = PartnerAddress.query.get(job.partner_address_id)
+    if address is None:
+        job.status = 'failed'
+        job.last_error = 'Adresse supprimée'
+        return
+
+    try:
+        coordinates = geocode_partner_address(address)
+    except Exception as e:
+        job.last_error = str(e)[:500]
+        if job.attempts >= MAX_ATTEMPTS:
+            job.status = 'failed'
+        else:
+            job.status = 'pending'
+            job.next_attempt_at = datetime.utcnow() + timedelta(seconds=RETRY_BASE_SECONDS * 2 ** (job.attempts - 1))
+        print(f"⚠️ Géocodage adresse {address.id} (tentative {job.attempts}): {e}")
+        return
+
+    if coordinates is None:
+        job.status = 'not_found'
+        return
+
+    provisional = (address.latitude, address.longitude)
+    address.latitude, address.longitude = coordinates
+    if address.is_primary:
+        # Rétrocompatibilité : la première adresse remplit aussi les champs du Partner
+        # (sauf si ceux-ci ont été modifiés depuis le centroïde provisoire)
+        partner = Partner.query.get(job.partner_id)
+        if partner is not None and (partner.latitude is None or (partner.latitude, partner.longitude) == provisional):
+            partner.latitude, partner.longitude = coordinates
+    job.status = 'done'
+    job.last_error = None
+
+
+def process_geocoding_jobs(limit=BATCH_SIZE):
+    """Traite un lot de jobs dus, retourne le nombre de jobs traités"""
+    job_ids = _claim_jobs(limit)
+    for job_id in job_ids:
+        job = GeocodingJob.query.get(job_id)
+        try:
+            _run_job(job)
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            print(f"❌ Erreur job de géocodage {job_id}: {e}")
+            traceback.print_exc()
+    return len(job_ids)
+
+
+def partner_geocoding_status(partner_id):
+    """
+    Statut global du géocodage d'un partenaire :
+    pending (en cours), done, partial (certaines adresses introuvables/en échec), failed, none (aucun job)
+    """
+    jobs = GeocodingJob.query.filter_by(partner_id=partner_id).order_by(GeocodingJob.id).all()
+    statuses = {job.status for job in jobs}
+    if not jobs:
+        status = 'none'
+    elif statuses & {'pending', 'running'}:
+        status = 'pending'
+    elif statuses == {'done'}:
+        status = 'done'
+    elif 'done' in statuses:
+        status = 'partial'
+    else:
+        status = 'failed'
+    return status, jobs
+
+
+class GeocodingWorker:
+    """
+    Thread de fond (un par processus) : traite la file dès qu'on le réveille
+    (wake() après une inscription) et au plus tard toutes les POLL_SECONDS.
+    """
+
+    def __init__(self):
+        self._wake = threading.Event()
+        self._thread = None
+        self.app = None
+
+    def start(self, app):
+        if self._thread is not None:
+            return
+        self.app = app
+        self._thread = threading.Thread(target=self._loop, name='geocoding-worker', daemon=True)
+        self._thread.start()
+
+    def wake(self):
+        self._wake.set()
+
+    def _loop(self):
+        while True:
+            self._wake.wait(POLL_SECONDS)
+            self._wake.clear()
+            with self.app.app_context():
+                try:
+                    # Vider la file tant que des jobs sont dus
+                    while process_geocoding_jobs() > 0:
+                        pass
+                except Exception as e:
+                    db.session.rollback()
+                    print(f"❌ Erreur worker de géocodage: {e}")
+                finally:
+                    db.session.remove()
+
+
+geocoding_worker = GeocodingWorker()
@@ -0,0 +1,27 @@
+"""
+Migration V33: Index de l'ETag du flux iCalendar
+Index (partner_id, updated_at) : MAX(updated_at) et COUNT(*) des réservations
+d'un commerçant sans lire la table (calcul de l'ETag à chaque interrogation du flux)
+"""
+from models import db
+from sqlalchemy import text
+
+
+def run_booking_feed_index_migration():
+    """Crée l'index de l'ETag du flux .ics (PostgreSQL uniquement)"""
+    print("🚀 Migration V33: Index du flux iCalendar")
+    
+    if db.engine.dialect.name != 'postgresql':
+        print("ℹ️  Base non PostgreSQL, migration ignorée")
+        return
+    
+    try:
+        db.session.execute(text(
+            "CREATE INDEX IF NOT EXISTS idx_bookings_partner_updated ON bookings(partner_id, updated_at)"
+        ))
+        db.session.commit()
+        print("✅ Migration V33 terminée avec succès")
+    
+    except Exception as e:
+        db.session.rollback()
+        print(f"❌ Erreur lors de la migration V33: {str(e)}")
@@ -0,0 +1,32 @@
+"""
+Migration V31: Index de pagination des réservations
+Index (partner_id, booking_date, id) et (member_id, booking_date, id) :
+pagination par curseur des listes de réservations et résumé mensuel de l'agenda
+"""
+from models import db
+from sqlalchemy import text
+
+
+BOOKING_INDEXES = [
+    "CREATE INDEX IF NOT EXISTS idx_bookings_partner_date_id ON bookings(partner_id, booking_date, id)",
+    "CREATE INDEX IF NOT EXISTS idx_bookings_member_date_id ON bookings(member_id, booking_date, id)",
+]
+
+
+def run_booking_indexes_migration():
+    """Crée les index de pagination des réservations (PostgreSQL uniquement)"""
+    print("🚀 Migration V31: Index de pagination des réservations")
+    
+    if db.engine.dialect.name != 'postgresql':
+        print("ℹ️  Base non PostgreSQL, migration ignorée")
+        return
+    
+    try:
+        for command in BOOKING_INDEXES:
+            db.session.execute(text(command))
+        db.session.commit()
+        print("✅ Migration V31 terminée avec succès")
+    
+    except Exception as e:
+        db.session.rollback()
+        print(f"❌ Erreur lors de la migration V31: {str(e)}")
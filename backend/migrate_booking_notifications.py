@@ -0,0 +1,33 @@
+"""
+Migration V32: Index de la file des notifications de réservation
+- idx_bookings_reminder_due : réservations confirmées sans rappel, par date (parcours des rappels)
+- idx_booking_notification_logs_pending : notifications en attente d'envoi
+"""
+from models import db
+from sqlalchemy import text
+
+
+NOTIFICATION_INDEXES = [
+    "CREATE INDEX IF NOT EXISTS idx_bookings_reminder_due ON bookings(booking_date) WHERE status = 'confirmed' AND reminder_sent_at IS NULL",
+    "CREATE INDEX IF NOT EXISTS idx_booking_notification_logs_pending ON booking_notification_logs(id) WHERE status = 'pending'",
+    "CREATE INDEX IF NOT EXISTS idx_booking_notification_logs_booking_type ON booking_notification_logs(booking_id, notification_type)",
+]
+
+
+def run_booking_notifications_migration():
+    """Crée les index de la file des notifications (PostgreSQL uniquement)"""
+    print("🚀 Migration V32: File des notifications de réservation")
+    
+    if db.engine.dialect.name != 'postgresql':
+        print("ℹ️  Base non PostgreSQL, migration ignorée")
+        return
+    
+    try:
+        for command in NOTIFICATION_INDEXES:
+            db.session.execute(text(command))
+        db.session.commit()
+        print("✅ Migration V32 terminée avec succès")
+    
+    except Exception as e:
+        db.session.rollback()
+        print(f"❌ Erreur lors de la migration V32: {str(e)}")
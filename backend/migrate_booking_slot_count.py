@@ -0,0 +1,25 @@
+"""
+Migration V30: Nombre de créneaux réservés par réservation
+bookings.slot_count : série de créneaux consécutifs réservée à partir de creneau_id
+(NULL pour les réservations antérieures, qui n'occupaient que le premier créneau)
+"""
+from models import db
+from sqlalchemy import text
+
+
+def run_booking_slot_count_migration():
+    """Ajoute bookings.slot_count (PostgreSQL uniquement)"""
+    print("🚀 Migration V30: Séries de créneaux des réservations")
+    
+    if db.engine.dialect.name != 'postgresql':
+        print("ℹ️  Base non PostgreSQL, migration ignorée")
+        return
+    
+    try:
+        db.session.execute(text("ALTER TABLE bookings ADD COLUMN IF NOT EXISTS slot_count INTEGER"))
+        db.session.commit()
+        print("✅ Migration V30 terminée avec succès")
+    
+    except Exception as e:
+        db.session.rollback()
+        print(f"❌ Erreur lors de la migration V30: {str(e)}")
@@ -0,0 +1,32 @@
+"""
+Migration V39: Jeton secret du flux iCalendar des commerçants
+partner_booking_configs.calendar_token : exigé dans l'URL du flux .ics
+(généré à la première demande de l'URL par le commerçant)
+"""
+from models import db
+from sqlalchemy import text
+
+
+CALENDAR_TOKEN_COMMANDS = [
+    "ALTER TABLE partner_booking_configs ADD COLUMN IF NOT EXISTS calendar_token VARCHAR(64)",
+    "CREATE UNIQUE INDEX IF NOT EXISTS idx_partner_booking_configs_calendar_token ON partner_booking_configs(calendar_token)",
+]
+
+
+def run_calendar_token_migration():
+    """Ajoute le jeton du flux iCalendar (PostgreSQL uniquement)"""
+    print("🚀 Migration V39: Jeton du flux iCalendar")
+    
+    if db.engine.dialect.name != 'postgresql':
+        print("ℹ️  Base non PostgreSQL, migration ignorée")
+        return
+    
+    try:
+        for command in CALENDAR_TOKEN_COMMANDS:
+            db.session.execute(text(command))
+        db.session.commit()
+        print("✅ Migration V39 terminée avec succès")
+    
+    except Exception as e:
+        db.session.rollback()
+        print(f"❌ Erreur lors de la migration V39: {str(e)}")
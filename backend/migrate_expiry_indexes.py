@@ -0,0 +1,32 @@
+"""
+Migration V36: Index partiels des offres flash actives et des activations en cours
+Les offres échues sont désactivées à l'heure exacte (expiry_scheduler) : les listes ne filtrent
+plus que sur active, et le rechargement des échéances ne lit que les lignes encore actives
+"""
+from models import db
+from sqlalchemy import text
+
+
+EXPIRY_INDEXES = [
+    "CREATE INDEX IF NOT EXISTS idx_offers_flash_active_valid ON offers(valid_until) WHERE offer_type = 'flash' AND active = TRUE",
+    "CREATE INDEX IF NOT EXISTS idx_privilege_activations_active_expires ON privilege_activations(expires_at) WHERE status = 'active'",
+]
+
+
+def run_expiry_indexes_migration():
+    """Crée les index des échéances (PostgreSQL uniquement)"""
+    print("🚀 Migration V36: Index des échéances")
+    
+    if db.engine.dialect.name != 'postgresql':
+        print("ℹ️  Base non PostgreSQL, migration ignorée")
+        return
+    
+    try:
+        for command in EXPIRY_INDEXES:
+            db.session.execute(text(command))
+        db.session.commit()
+        print("✅ Migration V36 terminée avec succès")
+    
+    except Exception as e:
+        db.session.rollback()
+        print(f"❌ Erreur lors de la migration V36: {str(e)}")
@@ -0,0 +1,60 @@
+"""
+Migration V35: Fil des offres flash précalculé par membre
+Table member_flash_feed (membre, offre, fin de validité), index de lecture du fil,
+index idx_members_location (latitude, longitude) des membres pour la diffusion des offres,
+puis diffusion des offres flash en cours
+"""
+from models import db
+from sqlalchemy import text
+
+from flash_feed import fan_out_offer
+
+
+FLASH_FEED_SCHEMA = [
+    """
+    CREATE TABLE IF NOT EXISTS member_flash_feed (
+        member_id INTEGER NOT NULL REFERENCES members(id) ON DELETE CASCADE,
+        offer_id INTEGER NOT NULL REFERENCES offers(id) ON DELETE CASCADE,
+        valid_until TIMESTAMP NOT NULL,
+        created_at TIMESTAMP DEFAULT NOW(),
+        PRIMARY KEY (member_id, offer_id)
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_member_flash_feed_member_valid ON member_flash_feed(member_id, valid_until)",
+    "CREATE INDEX IF NOT EXISTS idx_member_flash_feed_offer ON member_flash_feed(offer_id)",
+    "ALTER TABLE members ADD COLUMN IF NOT EXISTS latitude DECIMAL(10, 8)",
+    "ALTER TABLE members ADD COLUMN IF NOT EXISTS longitude DECIMAL(11, 8)",
+    # Index existant (migration des notifications), créé ici s'il manque ; doublon des premiers déploiements retiré
+    "CREATE INDEX IF NOT EXISTS idx_members_location ON members(latitude, longitude)",
+    "DROP INDEX IF EXISTS idx_members_lat_lng",
+]
+
+
+def run_flash_feed_migration():
+    """Crée le fil des offres flash et le remplit s'il est vide (PostgreSQL uniquement)"""
+    print("🚀 Migration V35: Fil des offres flash")
+    
+    if db.engine.dialect.name != 'postgresql':
+        print("ℹ️  Base non PostgreSQL, migration ignorée")
+        return
+    
+    try:
+        if db.session.execute(text("SELECT to_regclass('member_favorites')")).scalar() is None:
+            print("ℹ️  Table member_favorites absente, migration ignorée")
+            return
+        for command in FLASH_FEED_SCHEMA:
+            db.session.execute(text(command))
+        db.session.commit()
+        
+        if db.session.execute(text("SELECT 1 FROM member_flash_feed LIMIT 1")).first() is None:
+            offer_ids = db.session.execute(text("""
+                SELECT id FROM offers WHERE offer_type = 'flash' AND active = TRUE AND valid_until > NOW()
+            """)).scalars().all()
+            members = sum(fan_out_offer(offer_id) for offer_id in offer_ids)
+            db.session.commit()
+            print(f"   ✅ {len(offer_ids)} offre(s) flash diffusée(s) ({members} entrée(s))")
+        print("✅ Migration V35 terminée avec succès")
+    
+    except Exception as e:
+        db.session.rollback()
+        print(f"❌ Erreur lors de la migration V35: {str(e)}")
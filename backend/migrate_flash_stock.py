@@ -0,0 +1,34 @@
+"""
+Migration V34: Report différé du stock des offres flash
+flash_reservations.stock_applied : FALSE tant que la réservation n'est pas décomptée
+de offers.stock (flash_stock.flush_stock) ; les réservations existantes le sont déjà
+"""
+from models import db
+from sqlalchemy import text
+
+
+def run_flash_stock_migration():
+    """Ajoute stock_applied et l'index des réservations à reporter (PostgreSQL uniquement)"""
+    print("🚀 Migration V34: Stock des offres flash")
+    
+    if db.engine.dialect.name != 'postgresql':
+        print("ℹ️  Base non PostgreSQL, migration ignorée")
+        return
+    
+    try:
+        if db.session.execute(text("SELECT to_regclass('flash_reservations')")).scalar() is None:
+            print("ℹ️  Table flash_reservations absente, migration ignorée")
+            return
+        db.session.execute(text(
+            "ALTER TABLE flash_reservations ADD COLUMN IF NOT EXISTS stock_applied BOOLEAN NOT NULL DEFAULT TRUE"
+        ))
+        db.session.execute(text(
+            "CREATE INDEX IF NOT EXISTS idx_flash_reservations_stock_pending "
+            "ON flash_reservations(offer_id) WHERE stock_applied = FALSE"
+        ))
+        db.session.commit()
+        print("✅ Migration V34 terminée avec succès")
+    
+    except Exception as e:
+        db.session.rollback()
+        print(f"❌ Erreur lors de la migration V34: {str(e)}")
@@ -0,0 +1,34 @@
+"""
+Migration V27: Index pour les recherches de proximité
+Index composite (status, latitude, longitude) pour le filtre rectangle
+et index partiel sur les offres actives pour le comptage par partenaire,
+index (latitude, longitude) des établissements secondaires
+"""
+from models import db
+from sqlalchemy import text
+
+
+GEO_INDEXES = [
+    "CREATE INDEX IF NOT EXISTS idx_partners_status_lat_lng ON partners(status, latitude, longitude)",
+    "CREATE INDEX IF NOT EXISTS idx_offers_partner_active ON offers(partner_id) WHERE active = TRUE",
+    "CREATE INDEX IF NOT EXISTS idx_partner_addresses_lat_lng ON partner_addresses(latitude, longitude) WHERE latitude IS NOT NULL",
+]
+
+
+def run_geo_indexes_migration():
+    """Crée les index géographiques manquants (PostgreSQL uniquement)"""
+    print("🚀 Migration V27: Index de proximité")
+    
+    if db.engine.dialect.name != 'postgresql':
+        print("ℹ️  Base non PostgreSQL, migration ignorée")
+        return
+    
+    try:
+        for command in GEO_INDEXES:
+            db.session.execute(text(command))
+        db.session.commit()
+        print("✅ Migration V27 terminée avec succès")
+    
+    except Exception as e:
+        db.session.rollback()
+        print(f"❌ Erreur lors de la migration V27: {str(e)}")
@@ -0,0 +1,42 @@
+"""
+Migration V40: File persistante des notifications push des offres flash
+push_fanout_jobs : un job par offre (pending -> running -> done | failed), traité par
+proximity_push hors requête HTTP ; survit aux redémarrages et se partage entre workers
+"""
+from models import db
+from sqlalchemy import text
+
+
+PUSH_FANOUT_SCHEMA = [
+    """
+    CREATE TABLE IF NOT EXISTS push_fanout_jobs (
+        id SERIAL PRIMARY KEY,
+        offer_id INTEGER NOT NULL UNIQUE REFERENCES offers(id) ON DELETE CASCADE,
+        status VARCHAR(20) NOT NULL DEFAULT 'pending',
+        attempts INTEGER NOT NULL DEFAULT 0,
+        last_error TEXT,
+        created_at TIMESTAMP NOT NULL DEFAULT NOW(),
+        updated_at TIMESTAMP NOT NULL DEFAULT NOW()
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_push_fanout_jobs_open ON push_fanout_jobs(id) WHERE status IN ('pending', 'running')",
+]
+
+
+def run_push_fanout_jobs_migration():
+    """Crée la file des notifications push (PostgreSQL uniquement)"""
+    print("🚀 Migration V40: File des notifications push")
+    
+    if db.engine.dialect.name != 'postgresql':
+        print("ℹ️  Base non PostgreSQL, migration ignorée")
+        return
+    
+    try:
+        for command in PUSH_FANOUT_SCHEMA:
+            db.session.execute(text(command))
+        db.session.commit()
+        print("✅ Migration V40 terminée avec succès")
+    
+    except Exception as e:
+        db.session.rollback()
+        print(f"❌ Erreur lors de la migration V40: {str(e)}")
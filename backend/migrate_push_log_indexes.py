@@ -0,0 +1,35 @@
+"""
+Migration V38: Index du journal des notifications push
+(member_id, sent_at) : envois du jour par membre (plafond quotidien) ;
+(offer_id, member_id) : membres déjà notifiés pour une offre
+"""
+from models import db
+from sqlalchemy import text
+
+
+PUSH_LOG_INDEXES = [
+    "CREATE INDEX IF NOT EXISTS idx_push_log_member_sent ON push_notifications_log(member_id, sent_at)",
+    "CREATE INDEX IF NOT EXISTS idx_push_log_offer_member ON push_notifications_log(offer_id, member_id)",
+]
+
+
+def run_push_log_indexes_migration():
+    """Crée les index du journal des notifications push (PostgreSQL uniquement)"""
+    print("🚀 Migration V38: Index des notifications push")
+    
+    if db.engine.dialect.name != 'postgresql':
+        print("ℹ️  Base non PostgreSQL, migration ignorée")
+        return
+    
+    try:
+        if db.session.execute(text("SELECT to_regclass('push_notifications_log')")).scalar() is None:
+            print("ℹ️  Table push_notifications_log absente, migration ignorée")
+            return
+        for command in PUSH_LOG_INDEXES:
+            db.session.execute(text(command))
+        db.session.commit()
+        print("✅ Migration V38 terminée avec succès")
+    
+    except Exception as e:
+        db.session.rollback()
+        print(f"❌ Erreur lors de la migration V38: {str(e)}")
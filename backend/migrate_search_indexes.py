@@ -0,0 +1,38 @@
+"""
+Migration V28: Index trigrammes pour la recherche texte des partenaires
+Active pg_trgm (si les droits le permettent) et crée des index GIN sur name et city,
+qui servent directement les filtres ILIKE '%q%'
+"""
+from models import db
+from sqlalchemy import text
+
+
+TRIGRAM_INDEXES = [
+    "CREATE INDEX IF NOT EXISTS idx_partners_name_trgm ON partners USING gin (name gin_trgm_ops)",
+    "CREATE INDEX IF NOT EXISTS idx_partners_city_trgm ON partners USING gin (city gin_trgm_ops)",
+]
+
+
+def run_search_indexes_migration():
+    """
+    Crée les index trigrammes (PostgreSQL uniquement)
+    Retourne True si la recherche peut s'appuyer sur pg_trgm
+    """
+    print("🚀 Migration V28: Index trigrammes")
+    
+    if db.engine.dialect.name != 'postgresql':
+        print("ℹ️  Base non PostgreSQL, recherche en mémoire")
+        return False
+    
+    try:
+        db.session.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+        for command in TRIGRAM_INDEXES:
+            db.session.execute(text(command))
+        db.session.commit()
+        print("✅ Migration V28 terminée avec succès")
+        return True
+    
+    except Exception as e:
+        db.session.rollback()
+        print(f"⚠️  pg_trgm indisponible, recherche en mémoire: {str(e)}")
+        return False
@@ -0,0 +1,33 @@
+"""
+Migration V29: Réservations en mode virtuel (sans Creneau)
+- bookings.creneau_id devient facultatif
+- index partiel (partner_id, booking_date) des réservations actives,
+  utilisé pour calculer la charge des créneaux virtuels
+"""
+from models import db
+from sqlalchemy import text
+
+
+VIRTUAL_BOOKING_COMMANDS = [
+    "ALTER TABLE bookings ALTER COLUMN creneau_id DROP NOT NULL",
+    "CREATE INDEX IF NOT EXISTS idx_bookings_partner_date_active ON bookings(partner_id, booking_date) WHERE status <> 'cancelled'",
+]
+
+
+def run_virtual_bookings_migration():
+    """Rend creneau_id facultatif et indexe les réservations actives (PostgreSQL uniquement)"""
+    print("🚀 Migration V29: Réservations virtuelles")
+    
+    if db.engine.dialect.name != 'postgresql':
+        print("ℹ️  Base non PostgreSQL, migration ignorée")
+        return
+    
+    try:
+        for command in VIRTUAL_BOOKING_COMMANDS:
+            db.session.execute(text(command))
+        db.session.commit()
+        print("✅ Migration V29 terminée avec succès")
+    
+    except Exception as e:
+        db.session.rollback()
+        print(f"❌ Erreur lors de la migration V29: {str(e)}")
@@ -0,0 +1,30 @@
+"""
+Migration V37: Index de la file d'attente des offres flash
+Index partiel (offer_id, joined_at, id) des inscrits pas encore promus : les N premiers
+de la file sont lus dans l'ordre de l'index (flash_waitlist.promote_waitlist)
+"""
+from models import db
+from sqlalchemy import text
+
+
+def run_waitlist_index_migration():
+    """Crée l'index de la liste d'attente (PostgreSQL uniquement)"""
+    print("🚀 Migration V37: Index de la liste d'attente")
+    
+    if db.engine.dialect.name != 'postgresql':
+        print("ℹ️  Base non PostgreSQL, migration ignorée")
+        return
+    
+    try:
+        if db.session.execute(text("SELECT to_regclass('waitlist')")).scalar() is None:
+            print("ℹ️  Table waitlist absente, migration ignorée")
+            return
+        db.session.execute(text(
+            "CREATE INDEX IF NOT EXISTS idx_waitlist_offer_queue ON waitlist(offer_id, joined_at, id) WHERE notified = FALSE"
+        ))
+        db.session.commit()
+        print("✅ Migration V37 terminée avec succès")
+    
+    except Exception as e:
+        db.session.rollback()
+        print(f"❌ Erreur lors de la migration V37: {str(e)}")
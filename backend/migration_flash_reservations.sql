@@ -10,6 +10,7 @@ CREATE TABLE IF NOT EXISTS flash_reservations (
     partner_notes TEXT,
     used_at TIMESTAMP,
     cancelled_at TIMESTAMP,
+    stock_applied BOOLEAN NOT NULL DEFAULT TRUE,
     created_at TIMESTAMP DEFAULT NOW(),
     updated_at TIMESTAMP DEFAULT NOW()
 );
@@ -19,3 +20,4 @@ CREATE INDEX idx_flash_reservations_partner ON flash_reservations(partner_id);
 CREATE INDEX idx_flash_reservations_offer ON flash_reservations(offer_id);
 CREATE INDEX idx_flash_reservations_status ON flash_reservations(status);
 CREATE INDEX idx_flash_reservations_created ON flash_reservations(created_at);
+CREATE INDEX idx_flash_reservations_stock_pending ON flash_reservations(offer_id) WHERE stock_applied = FALSE;
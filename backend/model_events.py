@@ -0,0 +1,80 @@
+"""
+Notifications de changement des modèles
+Permet aux index et caches en mémoire d'être rafraîchis quand des lignes changent
+"""
+import threading
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session
+
+_listeners = {}  # nom de table -> [callbacks]
+_lock = threading.Lock()
+
+
+def on_change(*tables):
+    """
+    Décorateur : enregistre un callback appelé après chaque commit
+    qui a modifié une des tables données.
+
+    Le callback reçoit (table, changes) où changes est une liste de dict
+    (colonnes chargées + previous_<colonne> pour les valeurs modifiées).
+    """
+    def decorator(func):
+        with _lock:
+            for table in tables:
+                _listeners.setdefault(table, []).append(func)
+        return func
+    return decorator
+
+
+def notify_change(table, changes):
+    """
+    Déclenche les callbacks d'une table manuellement
+    (pour les écritures en SQL brut qui ne passent pas par l'ORM)
+    """
+    for callback in list(_listeners.get(table, [])):
+        try:
+            callback(table, changes)
+        except Exception as e:
+            print(f"Erreur callback on_change({table}): {e}")
+
+
+def _snapshot(obj):
+    """Copie les colonnes chargées d'une instance (et leurs anciennes valeurs)"""
+    state = inspect(obj)
+    data = {}
+    for key in state.mapper.column_attrs.keys():
+        if key not in state.dict:
+            continue
+        data[key] = state.dict[key]
+        history = state.attrs[key].history
+        if history.deleted and history.deleted[0] is not None:
+            data[f'previous_{key}'] = history.deleted[0]
+    if data.get('id') is None and state.identity:
+        data['id'] = state.identity[0]
+    return data
+
+
+@event.listens_for(Session, 'after_flush')
+def _collect_changes(session, flush_context):
+    pending = session.info.setdefault('model_changes', {})
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        table = getattr(obj, '__tablename__', None)
+        if table not in _listeners:
+            continue
+        snapshot = _snapshot(obj)
+        snapshot['deleted'] = obj in session.deleted
+        pending.setdefault(table, []).append(snapshot)
+
+
+@event.listens_for(Session, 'after_commit')
+def _dispatch_changes(session):
+    pending = session.info.pop('model_changes', None)
+    if not pending:
+        return
+    for table, changes in pending.items():
+        notify_change(table, changes)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_changes(session):
+    session.info.pop('model_changes', None)
@@ -179,6 +179,8 @@ class Partner(db.Model):
     addresses = db.relationship('PartnerAddress', backref='partner', lazy='dynamic', cascade="all, delete-orphan")
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    # Recherche de proximité : filtre rectangle sur les partenaires actifs (voir utils/geo_query.py)
+    __table_args__ = (db.Index('idx_partners_status_lat_lng', 'status', 'latitude', 'longitude'),)
 
 class AccessSlot(db.Model):
     __tablename__ = 'access_slots'
@@ -369,7 +371,7 @@ class PartnerBookingConfig(db.Model):
     __tablename__ = 'partner_booking_configs'
     id = db.Column(db.Integer, primary_key=True)
     partner_id = db.Column(db.Integer, db.ForeignKey('partners.id'), nullable=False, unique=True, index=True)
-    booking_mode = db.Column(db.String(20), default='catalog', nullable=False)
+    booking_mode = db.Column(db.String(20), default='catalog', nullable=False)  # simple, catalog ou virtual (sans Creneau)
     is_enabled = db.Column(db.Boolean, default=False)
     slot_duration_minutes = db.Column(db.Integer, default=30)
     advance_booking_days = db.Column(db.Integer, default=30)
@@ -382,6 +384,7 @@ class PartnerBookingConfig(db.Model):
     send_sms_notifications = db.Column(db.Boolean, default=False)
     send_email_notifications = db.Column(db.Boolean, default=True)
     cancellation_hours = db.Column(db.Integer, default=24)
+    calendar_token = db.Column(db.String(64), unique=True)  # Secret de l'URL du flux iCalendar (hors to_dict)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
@@ -427,10 +430,11 @@ class Booking(db.Model):
     member_id = db.Column(db.Integer, db.ForeignKey('members.id'), nullable=False, index=True)
     partner_id = db.Column(db.Integer, db.ForeignKey('partners.id'), nullable=False, index=True)
     service_id = db.Column(db.Integer, db.ForeignKey('services.id'), nullable=True, index=True)
-    creneau_id = db.Column(db.Integer, db.ForeignKey('creneaux.id'), nullable=False, index=True)
+    creneau_id = db.Column(db.Integer, db.ForeignKey('creneaux.id'), nullable=True, index=True)  # NULL en mode virtuel
     booking_date = db.Column(db.DateTime, nullable=False, index=True)
     duration_minutes = db.Column(db.Integer, nullable=False)
     number_of_people = db.Column(db.Integer, default=1)
+    slot_count = db.Column(db.Integer)  # Créneaux consécutifs réservés à partir de creneau_id (NULL : ancienne réservation)
     price_original = db.Column(db.Float)
     price_final = db.Column(db.Float)
     discount_applied = db.Column(db.Float, default=0)
@@ -452,6 +456,7 @@ class Booking(db.Model):
             'service_id': self.service_id, 'creneau_id': self.creneau_id,
             'booking_date': self.booking_date.isoformat() if self.booking_date else None,
             'duration_minutes': self.duration_minutes, 'number_of_people': self.number_of_people,
+            'slot_count': self.slot_count,
             'price_original': self.price_original, 'price_final': self.price_final,
             'discount_applied': self.discount_applied, 'status': self.status,
             'member_notes': self.member_notes, 'partner_notes': self.partner_notes,
@@ -551,3 +556,47 @@ class PartnerAddress(db.Model):
 
     def __repr__(self):
         return f"<PartnerAddress {self.street} {self.number}, {self.city}>"
+
+
+class GeocodeCacheEntry(db.Model):
+    """
+    Cache persistant des réponses Nominatim (géocodage direct et inverse)
+    partagé par tous les géocodeurs (inscription, scripts, GeocodingService)
+    """
+    __tablename__ = 'geocode_cache'
+
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(10), nullable=False)  # 'forward' ou 'reverse'
+    query_key = db.Column(db.String(500), nullable=False)  # Adresse normalisée ou "lat,lng" arrondis
+    place = db.Column(db.JSON)  # Résultat brut Nominatim (None = adresse introuvable)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+
+    __table_args__ = (
+        db.UniqueConstraint('kind', 'query_key', name='uq_geocode_cache_kind_key'),
+    )
+
+    def __repr__(self):
+        return f"<GeocodeCacheEntry {self.kind} {self.query_key}>"
+
+
+class GeocodingJob(db.Model):
+    """
+    File d'attente du géocodage des établissements (hors requête HTTP)
+    Statuts : pending -> running -> done | not_found | failed
+    """
+    __tablename__ = 'geocoding_jobs'
+
+    id = db.Column(db.Integer, primary_key=True)
+    partner_id = db.Column(db.Integer, db.ForeignKey('partners.id', ondelete='CASCADE'), nullable=False, index=True)
+    partner_address_id = db.Column(db.Integer, db.ForeignKey('partner_addresses.id', ondelete='CASCADE'), nullable=False)
+    status = db.Column(db.String(20), default='pending', nullable=False)
+    attempts = db.Column(db.Integer, default=0, nullable=False)
+    last_error = db.Column(db.Text)
+    next_attempt_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    __table_args__ = (db.Index('idx_geocoding_jobs_status_next', 'status', 'next_attempt_at'),)
+
+    def __repr__(self):
+        return f"<GeocodingJob {self.id} address={self.partner_address_id} {self.status}>"
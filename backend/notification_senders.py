@@ -0,0 +1,177 @@
+"""
+Expéditeurs des notifications (SMS Twilio, email SMTP, push FCM) et expéditeur local de substitution
+- Un seul client Twilio par processus, une connexion SMTP par lot,
+  une session HTTP FCM partagée (envois d'un lot en parallèle)
+- Sans identifiants (ou NOTIFICATION_SENDER=local) : messages simulés, les derniers conservés en mémoire
+"""
+import os
+import smtplib
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from email.message import EmailMessage
+
+import requests
+from requests.adapters import HTTPAdapter
+
+OUTBOX_LIMIT = 500  # Messages simulés conservés par canal
+
+
+class LocalSender:
+    """Expéditeur de substitution : affiche et conserve les messages (développement, tests)"""
+
+    def __init__(self, channel):
+        self.channel = channel
+        self.outbox = deque(maxlen=OUTBOX_LIMIT)
+
+    def send_batch(self, messages):
+        results = []
+        for message in messages:
+            self.outbox.append(message)
+            print(f"📨 [{self.channel.upper()} SIMULÉ] Vers: {message['to']} | Msg: {message['body']}")
+            results.append((True, None))
+        return results
+
+
+class TwilioSmsSender:
+    """SMS via Twilio, client partagé (créé au premier envoi)"""
+
+    def __init__(self, sid, token, sender):
+        self.sid, self.token, self.sender = sid, token, sender
+        self._client = None
+        self._lock = threading.Lock()
+
+    @property
+    def client(self):
+        with self._lock:
+            if self._client is None:
+                from twilio.rest import Client  # Dépendance optionnelle
+                self._client = Client(self.sid, self.token)
+            return self._client
+
+    def send_batch(self, messages):
+        results = []
+        for message in messages:
+            try:
+                self.client.messages.create(body=message['body'], from_=self.sender, to=message['to'])
+                results.append((True, None))
+            except Exception as e:
+                results.append((False, str(e)))
+        return results
+
+
+class SmtpEmailSender:
+    """Emails via SMTP : une connexion ouverte pour tout le lot"""
+
+    def __init__(self, host, port, user, password, sender):
+        self.host, self.port, self.user, self.password, self.sender = host, port, user, password, sender
+
+    def send_batch(self, messages):
+        try:
+            connection = smtplib.SMTP(self.host, self.port, timeout=20)
+            connection.starttls()
+            if self.user:
+                connection.login(self.user, self.password)
+        except Exception as e:
+            return [(False, f"SMTP indisponible: {e}")] * len(messages)
+
+        results = []
+        try:
+            for message in messages:
+                email = EmailMessage()
+                email['From'] = self.sender
+                email['To'] = message['to']
+                email['Subject'] = message.get('subject') or "PEP'S"
+                email.set_content(message['body'])
+                try:
+                    connection.send_message(email)
+                    results.append((True, None))
+                except Exception as e:
+                    results.append((False, str(e)))
+        finally:
+            try:
+                connection.quit()
+            except Exception:
+                pass
+        return results
+
+
+class FcmPushSender:
+    """Notifications push via Firebase Cloud Messaging (API HTTP v1), compte de service"""
+
+    SCOPE = 'https://www.googleapis.com/auth/firebase.messaging'
+
+    def __init__(self, credentials_path, workers=16):
+        self.credentials_path = credentials_path
+        self.workers = workers
+        self._credentials = None
+        self._lock = threading.Lock()
+        self._session = requests.Session()
+        self._session.mount('https://', HTTPAdapter(pool_maxsize=workers))
+
+    def _access_token(self):
+        with self._lock:
+            if self._credentials is None:
+                from google.oauth2 import service_account  # Dépendance optionnelle
+                self._credentials = service_account.Credentials.from_service_account_file(
+                    self.credentials_path, scopes=[self.SCOPE]
+                )
+            if not self._credentials.valid:
+                from google.auth.transport.requests import Request
+                self._credentials.refresh(Request())
+            return self._credentials.token
+
+    def _send(self, message, access_token):
+        payload = {'message': {
+            'token': message['to'],
+            'notification': {'title': message.get('subject') or "PEP'S", 'body': message['body']},
+            'data': {key: str(value) for key, value in (message.get('data') or {}).items()},
+        }}
+        try:
+            response = self._session.post(
+                f"https://fcm.googleapis.com/v1/projects/{self._credentials.project_id}/messages:send",
+                headers={'Authorization': f'Bearer {access_token}'}, json=payload, timeout=10
+            )
+            if response.ok:
+                return True, None
+            return False, f"FCM {response.status_code}: {response.text[:200]}"
+        except Exception as e:
+            return False, str(e)
+
+    def send_batch(self, messages):
+        try:
+            access_token = self._access_token()
+        except Exception as e:
+            return [(False, f"FCM indisponible: {e}")] * len(messages)
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            return list(pool.map(lambda message: self._send(message, access_token), messages))
+
+
+def _build_senders():
+    force_local = os.getenv('NOTIFICATION_SENDER') == 'local'
+
+    sid, token = os.getenv('TWILIO_ACCOUNT_SID'), os.getenv('TWILIO_AUTH_TOKEN')
+    if sid and token and not force_local:
+        sms = TwilioSmsSender(sid, token, os.getenv('TWILIO_PHONE_NUMBER'))
+    else:
+        sms = LocalSender('sms')
+
+    host = os.getenv('SMTP_HOST')
+    if host and not force_local:
+        email = SmtpEmailSender(
+            host, int(os.getenv('SMTP_PORT', 587)), os.getenv('SMTP_USER'), os.getenv('SMTP_PASSWORD'),
+            os.getenv('SMTP_FROM', 'no-reply@peps.swiss')
+        )
+    else:
+        email = LocalSender('email')
+
+    credentials = os.getenv('FIREBASE_CREDENTIALS')  # Fichier JSON du compte de service
+    if credentials and not force_local:
+        push = FcmPushSender(credentials)
+    else:
+        push = LocalSender('push')
+
+    return {'sms': sms, 'email': email, 'push': push}
+
+
+senders = _build_senders()
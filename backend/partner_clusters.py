@@ -0,0 +1,154 @@
+"""
+Clustering des partenaires pour la carte Leaflet
+Grille hiérarchique (projection Web Mercator) : chaque niveau de zoom est
+agrégé à partir du niveau plus fin, les clusters sont servis par tuile
+"""
+import threading
+from collections import OrderedDict
+from math import cos, floor, log, pi, radians, tan
+
+from partner_geo_index import partner_geo_index
+
+MAX_CLUSTER_ZOOM = 16  # Au-delà, chaque cellule ne contient plus qu'un commerce en pratique
+CELLS_PER_TILE_SHIFT = 2  # 4x4 cellules par tuile de 256 px, soit des cellules de 64 px
+MAX_CACHED_TILES = 5000
+MAX_TILES_PER_REQUEST = 256
+
+
+def _project(lat, lng, zoom):
+    """Coordonnées Web Mercator (en tuiles, non arrondies) d'un point au zoom donné"""
+    lat = max(-85.05112878, min(85.05112878, lat))
+    n = 2 ** zoom
+    x = (lng + 180.0) / 360.0 * n
+    y = (1.0 - log(tan(radians(lat)) + 1.0 / cos(radians(lat))) / pi) / 2.0 * n
+    return x, y
+
+
+class _Cluster:
+    __slots__ = ('count', 'lat_sum', 'lng_sum', 'categories', 'partner')
+
+    def __init__(self):
+        self.count = 0
+        self.lat_sum = 0.0
+        self.lng_sum = 0.0
+        self.categories = {}
+        self.partner = None
+
+    def add_partner(self, partner):
+        self.count += 1
+        self.lat_sum += partner['latitude']
+        self.lng_sum += partner['longitude']
+        category = partner['category'] or 'Autre'
+        self.categories[category] = self.categories.get(category, 0) + 1
+        self.partner = partner if self.count == 1 else None
+
+    def merge(self, other):
+        self.partner = other.partner if self.count == 0 else None
+        self.count += other.count
+        self.lat_sum += other.lat_sum
+        self.lng_sum += other.lng_sum
+        for category, count in other.categories.items():
+            self.categories[category] = self.categories.get(category, 0) + count
+
+    def to_dict(self, zoom, cell):
+        data = {
+            'id': f"{zoom}/{cell[0]}/{cell[1]}",
+            'lat': self.lat_sum / self.count,
+            'lng': self.lng_sum / self.count,
+            'count': self.count,
+            'categories': self.categories
+        }
+        if self.partner is not None:
+            data['partner'] = {
+                'id': self.partner['id'],
+                'name': self.partner['name'],
+                'category': self.partner['category'],
+                'city': self.partner['city'] or "",
+                'img': self.partner['image_url']
+            }
+        return data
+
+
+class PartnerClusterIndex:
+    """
+    levels[zoom] = {(tile_x, tile_y): {(cell_x, cell_y): _Cluster}}
+    Reconstruit quand la génération de l'index géographique change ;
+    les réponses sérialisées sont mises en cache par (zoom, tuile).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._generation = None
+        self._levels = []
+        self._tile_cache = OrderedDict()
+
+    def _build(self, partners):
+        cell_zoom = MAX_CLUSTER_ZOOM + CELLS_PER_TILE_SHIFT
+        finest = {}
+        for partner in partners:
+            if partner['latitude'] is None or partner['longitude'] is None:
+                continue  # Partenaire localisé uniquement par ses établissements
+            x, y = _project(partner['latitude'], partner['longitude'], cell_zoom)
+            cell = (floor(x), floor(y))
+            finest.setdefault(cell, _Cluster()).add_partner(partner)
+
+        cells_by_level = [None] * (MAX_CLUSTER_ZOOM + 1)
+        cells_by_level[MAX_CLUSTER_ZOOM] = finest
+        for zoom in range(MAX_CLUSTER_ZOOM - 1, -1, -1):
+            parent_cells = {}
+            for (cell_x, cell_y), cluster in cells_by_level[zoom + 1].items():
+                parent = (cell_x >> 1, cell_y >> 1)
+                parent_cells.setdefault(parent, _Cluster()).merge(cluster)
+            cells_by_level[zoom] = parent_cells
+
+        levels = []
+        for cells in cells_by_level:
+            tiles = {}
+            for cell, cluster in cells.items():
+                tile = (cell[0] >> CELLS_PER_TILE_SHIFT, cell[1] >> CELLS_PER_TILE_SHIFT)
+                tiles.setdefault(tile, {})[cell] = cluster
+            levels.append(tiles)
+        return levels
+
+    def _ensure_fresh(self):
+        generation, partners = partner_geo_index.snapshot()
+        with self._lock:
+            if generation != self._generation:
+                self._levels = self._build(partners)
+                self._tile_cache.clear()
+                self._generation = generation
+
+    def _tile_clusters(self, zoom, tile):
+        key = (zoom, tile)
+        cached = self._tile_cache.get(key)
+        if cached is not None:
+            self._tile_cache.move_to_end(key)
+            return cached
+        cells = self._levels[zoom].get(tile, {})
+        clusters = [cluster.to_dict(zoom, cell) for cell, cluster in cells.items()]
+        self._tile_cache[key] = clusters
+        if len(self._tile_cache) > MAX_CACHED_TILES:
+            self._tile_cache.popitem(last=False)
+        return clusters
+
+    def clusters(self, min_lng, min_lat, max_lng, max_lat, zoom):
+        """Clusters des tuiles qui recouvrent le rectangle au zoom demandé"""
+        zoom = max(0, min(MAX_CLUSTER_ZOOM, int(zoom)))
+        self._ensure_fresh()
+        x_min, y_min = _project(max_lat, min_lng, zoom)  # coin nord-ouest
+        x_max, y_max = _project(min_lat, max_lng, zoom)  # coin sud-est
+        last = 2 ** zoom - 1
+        tile_x_range = range(max(0, floor(x_min)), min(last, floor(x_max)) + 1)
+        tile_y_range = range(max(0, floor(y_min)), min(last, floor(y_max)) + 1)
+        if len(tile_x_range) * len(tile_y_range) > MAX_TILES_PER_REQUEST:
+            raise ValueError("Rectangle trop grand pour ce niveau de zoom")
+
+        results = []
+        with self._lock:
+            for tile_x in tile_x_range:
+                for tile_y in tile_y_range:
+                    results.extend(self._tile_clusters(zoom, (tile_x, tile_y)))
+        return zoom, results
+
+
+partner_cluster_index = PartnerClusterIndex()
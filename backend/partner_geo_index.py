@@ -0,0 +1,356 @@
+"""
+Index géographique des partenaires actifs (par processus)
+Chaque partenaire est indexé à sa position principale et à celle de chacun de
+ses établissements (PartnerAddress) ; les recherches renvoient un partenaire une
+seule fois, à son établissement le plus proche.
+Construit au démarrage, rafraîchi quand les partenaires, adresses ou offres changent
+"""
+import threading
+import time
+
+import numpy as np
+from sqlalchemy import func
+
+from models import db, Partner, PartnerAddress, Offer
+from model_events import on_change
+from utils.spatial_index import SpatialGrid, haversine_km_array, nearest_indices
+
+# Colonnes nécessaires pour répondre à /api/partners/nearby
+PARTNER_FIELDS = (
+    'id', 'name', 'category', 'city', 'latitude', 'longitude', 'image_url',
+    'address_street', 'address_number', 'address_postal_code', 'address_city',
+    'phone', 'website', 'status'
+)
+
+# Colonnes des établissements (adresses multiples)
+BRANCH_FIELDS = ('id', 'partner_id', 'street', 'number', 'postal_code', 'city', 'latitude', 'longitude', 'is_primary')
+
+
+def format_partner_address(partner):
+    """Adresse complète sur une ligne (numéro, rue, NPA, ville)"""
+    address_parts = [
+        partner[field] for field in ('address_number', 'address_street', 'address_postal_code', 'address_city')
+        if partner[field]
+    ]
+    return ' '.join(address_parts) if address_parts else None
+
+
+def format_branch_address(branch):
+    """Adresse d'un établissement (PartnerAddress) sur une ligne"""
+    address_parts = [branch[field] for field in ('number', 'street', 'postal_code', 'city') if branch[field]]
+    return ' '.join(address_parts) if address_parts else None
+
+
+def _partner_points(partner, branches):
+    """
+    Positions indexées d'un partenaire : (clé du point, lat, lng, établissement).
+    L'établissement vaut None pour la position principale (champs Partner.latitude/longitude).
+    """
+    points = []
+    if partner['latitude'] is not None and partner['longitude'] is not None:
+        points.append(((partner['id'], None), partner['latitude'], partner['longitude'], None))
+    for branch in branches:
+        points.append(((partner['id'], branch['id']), branch['latitude'], branch['longitude'], branch))
+    return points
+
+
+class PartnerGeoIndex:
+    """
+    Grille spatiale des positions (principale + établissements) des partenaires actifs,
+    compteur d'offres actives.
+    Les points de la grille sont identifiés par (partner_id, address_id),
+    address_id valant None pour la position principale.
+    Les autres workers gunicorn ne voient pas nos commits : l'index est
+    reconstruit entièrement au plus tard toutes les MAX_AGE_SECONDS, par une seule
+    requête à la fois (les autres continuent de lire l'index précédent).
+    Les requêtes SQL sont faites hors de _lock, tenu seulement pour remplacer les données.
+    """
+
+    MAX_AGE_SECONDS = 300
+
+    def __init__(self, cell_size_deg=0.1):
+        self.cell_size_deg = cell_size_deg
+        self._lock = threading.RLock()
+        self._build_lock = threading.Lock()  # Une seule reconstruction complète à la fois
+        self.grid = SpatialGrid(cell_size_deg)
+        self.partners = {}
+        self.points = {}  # partner_id -> [(clé, lat, lng, établissement)]
+        self.offer_counts = {}
+        self.built_at = None
+        # Incrémenté à chaque changement, permet aux caches dérivés de s'invalider
+        self.generation = 0
+        # Coordonnées de tous les points en tableaux contigus, groupés par partenaire :
+        # les points du partenaire _ids[i] occupent _lats[_offsets[i]:_offsets[i + 1]]
+        self._ids = np.empty(0, dtype=np.int64)
+        self._offsets = np.zeros(1, dtype=np.intp)
+        self._lats = np.empty(0, dtype=np.float64)
+        self._lngs = np.empty(0, dtype=np.float64)
+        self._arrays_dirty = True
+        self._dirty_partner_ids = set()
+        self._dirty_offer_partner_ids = set()
+        self._offer_counts_stale = False
+
+    # --- Construction ---
+
+    def build(self):
+        """Recharge tous les partenaires actifs, leurs établissements et les compteurs d'offres"""
+        with self._lock:
+            # Changements signalés pendant la reconstruction : appliqués ensuite par ensure_fresh
+            self._dirty_partner_ids.clear()
+            self._dirty_offer_partner_ids.clear()
+            self._offer_counts_stale = False
+        rows = self._partners_query().all()
+        branches = self._load_branches()
+
+        grid = SpatialGrid(self.cell_size_deg)
+        partners = {}
+        points = {}
+        for row in rows:
+            partner = dict(row._mapping)
+            partner_points = _partner_points(partner, branches.get(partner['id'], []))
+            if not partner_points:
+                continue
+            partners[partner['id']] = partner
+            points[partner['id']] = partner_points
+            for key, lat, lng, _branch in partner_points:
+                grid.insert(key, lat, lng)
+
+        offer_counts = self._load_offer_counts()
+
+        with self._lock:
+            self.grid = grid
+            self.partners = partners
+            self.points = points
+            self.offer_counts = offer_counts
+            self.built_at = time.monotonic()
+            self.generation += 1
+            self._arrays_dirty = True
+        print(f"🗺️ Index géographique construit : {len(partners)} partenaires, {len(grid)} positions")
+
+    def _partners_query(self):
+        columns = [getattr(Partner, field) for field in PARTNER_FIELDS]
+        return db.session.query(*columns).filter(Partner.status == 'active')
+
+    def _load_branches(self, partner_ids=None):
+        """Établissements géocodés, groupés par partenaire"""
+        columns = [getattr(PartnerAddress, field) for field in BRANCH_FIELDS]
+        query = db.session.query(*columns).filter(
+            PartnerAddress.latitude.isnot(None),
+            PartnerAddress.longitude.isnot(None)
+        )
+        if partner_ids is not None:
+            query = query.filter(PartnerAddress.partner_id.in_(partner_ids))
+        branches = {}
+        for row in query.order_by(PartnerAddress.partner_id, PartnerAddress.id):
+            branches.setdefault(row.partner_id, []).append(dict(row._mapping))
+        return branches
+
+    def _load_offer_counts(self, partner_ids=None):
+        query = db.session.query(Offer.partner_id, func.count(Offer.id)).filter(Offer.active.is_(True))
+        if partner_ids is not None:
+            query = query.filter(Offer.partner_id.in_(partner_ids))
+        return dict(query.group_by(Offer.partner_id).all())
+
+    def _fetch_partners(self, partner_ids):
+        """Lignes à jour de partenaires modifiés (sans verrou) : (partenaires trouvés, établissements)"""
+        rows = self._partners_query().filter(Partner.id.in_(partner_ids)).all()
+        return {row.id: dict(row._mapping) for row in rows}, self._load_branches(partner_ids)
+
+    def _apply_partners(self, partner_ids, found, branches):
+        """Remplace les positions de partenaires modifiés (sous _lock)"""
+        for partner_id in partner_ids:
+            for key, _lat, _lng, _branch in self.points.pop(partner_id, []):
+                self.grid.remove(key)
+            self.partners.pop(partner_id, None)
+            partner = found.get(partner_id)
+            if partner is None:
+                continue
+            partner_points = _partner_points(partner, branches.get(partner_id, []))
+            if not partner_points:
+                continue
+            self.partners[partner_id] = partner
+            self.points[partner_id] = partner_points
+            for key, lat, lng, _branch in partner_points:
+                self.grid.insert(key, lat, lng)
+        self.generation += 1
+        self._arrays_dirty = True
+
+    def _rebuild_arrays(self):
+        partner_ids = list(self.points)
+        points = [point for partner_id in partner_ids for point in self.points[partner_id]]
+        self._ids = np.fromiter(partner_ids, dtype=np.int64, count=len(partner_ids))
+        counts = np.fromiter((len(self.points[i]) for i in partner_ids), dtype=np.intp, count=len(partner_ids))
+        self._offsets = np.concatenate(([0], np.cumsum(counts))).astype(np.intp)
+        self._lats = np.fromiter((point[1] for point in points), dtype=np.float64, count=len(points))
+        self._lngs = np.fromiter((point[2] for point in points), dtype=np.float64, count=len(points))
+        self._arrays_dirty = False
+
+    def _is_stale(self):
+        return self.built_at is None or time.monotonic() - self.built_at > self.MAX_AGE_SECONDS
+
+    def ensure_fresh(self):
+        """Applique les changements en attente (ou reconstruit si l'index est trop vieux)"""
+        if self._is_stale():
+            if self.built_at is None:
+                # Pas d'index utilisable : on attend la reconstruction en cours
+                with self._build_lock:
+                    if self.built_at is None:
+                        self.build()
+            elif self._build_lock.acquire(blocking=False):
+                # Index trop vieux : une seule requête le reconstruit, les autres lisent l'ancien
+                try:
+                    if self._is_stale():
+                        self.build()
+                finally:
+                    self._build_lock.release()
+
+        with self._lock:
+            reload_counts = self._offer_counts_stale
+            dirty_partner_ids = list(self._dirty_partner_ids)
+            dirty_offer_partner_ids = [] if reload_counts else list(self._dirty_offer_partner_ids)
+            self._offer_counts_stale = False
+            self._dirty_partner_ids.clear()
+            self._dirty_offer_partner_ids.clear()
+        if not (reload_counts or dirty_partner_ids or dirty_offer_partner_ids):
+            return
+
+        # Lectures hors verrou : les recherches concurrentes ne sont pas bloquées
+        try:
+            all_counts = self._load_offer_counts() if reload_counts else None
+            partners = self._fetch_partners(dirty_partner_ids) if dirty_partner_ids else None
+            counts = self._load_offer_counts(dirty_offer_partner_ids) if dirty_offer_partner_ids else None
+        except Exception:
+            with self._lock:
+                # Changements conservés pour la prochaine requête
+                self._offer_counts_stale |= reload_counts
+                self._dirty_partner_ids.update(dirty_partner_ids)
+                self._dirty_offer_partner_ids.update(dirty_offer_partner_ids)
+            raise
+
+        with self._lock:
+            if all_counts is not None:
+                self.offer_counts = all_counts
+            if partners is not None:
+                self._apply_partners(dirty_partner_ids, *partners)
+            if counts is not None:
+                for partner_id in dirty_offer_partner_ids:
+                    self.offer_counts[partner_id] = counts.get(partner_id, 0)
+
+    # --- Invalidation ---
+
+    def invalidate_all(self):
+        """Force une reconstruction complète à la prochaine requête"""
+        with self._lock:
+            self.built_at = None
+
+    def invalidate_partners(self, partner_ids):
+        with self._lock:
+            self._dirty_partner_ids.update(partner_ids)
+
+    def invalidate_offers(self, partner_ids=None):
+        """partner_ids=None : partenaires inconnus, tous les compteurs sont rechargés"""
+        with self._lock:
+            if partner_ids is None:
+                self._offer_counts_stale = True
+            else:
+                self._dirty_offer_partner_ids.update(partner_ids)
+
+    # --- Requêtes ---
+
+    def snapshot(self):
+        """(generation, liste des partenaires) cohérents entre eux (latitude éventuellement None)"""
+        self.ensure_fresh()
+        with self._lock:
+            return self.generation, list(self.partners.values())
+
+    def _branch(self, partner_id, address_id):
+        if address_id is None:
+            return None
+        for key, _lat, _lng, branch in self.points[partner_id]:
+            if key[1] == address_id:
+                return branch
+        return None
+
+    def nearby(self, lat, lng, radius_km, limit):
+        """
+        Partenaires actifs dont au moins une position est dans le rayon, triés par distance.
+        Retourne une liste de (distance_km, partner_dict, offers_count, branch_dict),
+        branch_dict étant l'établissement le plus proche (None = position principale).
+        """
+        self.ensure_fresh()
+        with self._lock:
+            results = []
+            seen = set()
+            # Points triés par distance : le premier point d'un partenaire est son plus proche
+            for distance, (partner_id, address_id) in self.grid.query_radius(lat, lng, radius_km):
+                if partner_id in seen:
+                    continue
+                seen.add(partner_id)
+                results.append((
+                    distance, self.partners[partner_id], self.offer_counts.get(partner_id, 0),
+                    self._branch(partner_id, address_id)
+                ))
+                if limit is not None and len(results) >= limit:
+                    break
+            return results
+
+    def nearest(self, lat, lng, limit):
+        """
+        Les `limit` partenaires actifs les plus proches, sans limite de rayon.
+        Distances de tous les points calculées en un seul passage NumPy,
+        minimum par partenaire avec reduceat, sélection par argpartition.
+        Même format de retour que nearby().
+        """
+        self.ensure_fresh()
+        with self._lock:
+            if self._arrays_dirty:
+                self._rebuild_arrays()
+            if self._ids.size == 0:
+                return []
+            distances = haversine_km_array(lat, lng, self._lats, self._lngs)
+            partner_distances = np.minimum.reduceat(distances, self._offsets[:-1])
+            results = []
+            for i in nearest_indices(partner_distances, limit):
+                partner_id = int(self._ids[i])
+                start, end = self._offsets[i], self._offsets[i + 1]
+                _key, _lat, _lng, branch = self.points[partner_id][int(np.argmin(distances[start:end]))]
+                results.append((
+                    float(partner_distances[i]), self.partners[partner_id],
+                    self.offer_counts.get(partner_id, 0), branch
+                ))
+            return results
+
+
+partner_geo_index = PartnerGeoIndex()
+
+
+@on_change('partners')
+def _on_partners_change(table, changes):
+    partner_geo_index.invalidate_partners({c['id'] for c in changes if c.get('id') is not None})
+
+
+@on_change('partner_addresses')
+def _on_partner_addresses_change(table, changes):
+    partner_ids = set()
+    for change in changes:
+        if change.get('partner_id') is None:
+            # Suppression sans colonnes chargées : partenaire inconnu, reconstruction complète
+            partner_geo_index.invalidate_all()
+            return
+        partner_ids.add(change['partner_id'])
+        if change.get('previous_partner_id') is not None:
+            partner_ids.add(change['previous_partner_id'])
+    partner_geo_index.invalidate_partners(partner_ids)
+
+
+@on_change('offers')
+def _on_offers_change(table, changes):
+    partner_ids = set()
+    for change in changes:
+        if change.get('partner_id') is None:
+            partner_geo_index.invalidate_offers()
+            return
+        partner_ids.add(change['partner_id'])
+        if change.get('previous_partner_id') is not None:
+            partner_ids.add(change['previous_partner_id'])
+    partner_geo_index.invalidate_offers(partner_ids)
@@ -0,0 +1,115 @@
+"""
+Recherche textuelle des partenaires (carte / barre de recherche)
+PostgreSQL + pg_trgm : les ILIKE sont servis par les index GIN trigrammes.
+Sinon : index n-gramme en mémoire, mis à jour quand les partenaires changent.
+"""
+import threading
+import time
+
+from models import db, Partner
+from model_events import on_change
+from utils.text_index import NgramIndex
+
+SEARCH_FIELDS = ('name', 'city', 'category')
+
+
+class PartnerSearchIndex:
+    """
+    Index n-gramme des partenaires géolocalisés (même périmètre que search_v2).
+    Comme l'index géographique, reconstruit au plus tard toutes les MAX_AGE_SECONDS
+    pour voir les écritures des autres workers (une requête à la fois, les autres lisent
+    l'index précédent) ; requêtes SQL faites hors de _lock.
+    """
+
+    MAX_AGE_SECONDS = 300
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._build_lock = threading.Lock()
+        self.index = NgramIndex(SEARCH_FIELDS)
+        self.partners = {}
+        self.built_at = None
+        self.trigram_available = False  # Mis à jour par la migration V28 au démarrage
+        self._dirty_partner_ids = set()
+
+    def _query(self):
+        return db.session.query(Partner.id, Partner.name, Partner.city, Partner.category).filter(
+            Partner.latitude.isnot(None)
+        )
+
+    def build(self):
+        with self._lock:
+            self._dirty_partner_ids.clear()  # Changements pendant la reconstruction : appliqués ensuite
+        index = NgramIndex(SEARCH_FIELDS)
+        partners = {}
+        for row in self._query().all():
+            partners[row.id] = dict(row._mapping)
+            index.add(row.id, partners[row.id])
+        with self._lock:
+            self.index = index
+            self.partners = partners
+            self.built_at = time.monotonic()
+
+    def invalidate_partners(self, partner_ids):
+        with self._lock:
+            self._dirty_partner_ids.update(partner_ids)
+
+    def _is_stale(self):
+        return self.built_at is None or time.monotonic() - self.built_at > self.MAX_AGE_SECONDS
+
+    def ensure_fresh(self):
+        if self._is_stale():
+            if self.built_at is None:
+                with self._build_lock:
+                    if self.built_at is None:
+                        self.build()
+            elif self._build_lock.acquire(blocking=False):
+                try:
+                    if self._is_stale():
+                        self.build()
+                finally:
+                    self._build_lock.release()
+
+        with self._lock:
+            if not self._dirty_partner_ids:
+                return
+            partner_ids = list(self._dirty_partner_ids)
+            self._dirty_partner_ids.clear()
+        try:
+            found = {row.id: dict(row._mapping) for row in self._query().filter(Partner.id.in_(partner_ids))}
+        except Exception:
+            with self._lock:
+                self._dirty_partner_ids.update(partner_ids)
+            raise
+        with self._lock:
+            for partner_id in partner_ids:
+                if partner_id in found:
+                    self.partners[partner_id] = found[partner_id]
+                    self.index.add(partner_id, found[partner_id])
+                else:
+                    self.partners.pop(partner_id, None)
+                    self.index.remove(partner_id)
+
+    def search_ids(self, q, category=None, limit=None):
+        """IDs des partenaires dont le nom ou la ville contient q"""
+        self.ensure_fresh()
+        with self._lock:
+            ids = self.index.search(q, fields=('name', 'city'))
+            if category:
+                ids = [i for i in ids if self.partners[i]['category'] == category]
+            ids = sorted(ids)
+        return ids[:limit] if limit else ids
+
+    def autocomplete(self, q, limit=10):
+        """Partenaires dont un mot (nom, ville, catégorie) commence par q, classés"""
+        self.ensure_fresh()
+        with self._lock:
+            return [self.partners[i] for i in self.index.prefix(q, limit)]
+
+
+partner_search_index = PartnerSearchIndex()
+
+
+@on_change('partners')
+def _on_partners_change(table, changes):
+    partner_search_index.invalidate_partners({c['id'] for c in changes if c.get('id') is not None})
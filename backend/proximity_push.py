@@ -0,0 +1,262 @@
+"""
+Notifications push de proximité à la création d'une offre flash
+- Destinataires en une requête : membres géolocalisés (index idx_members_location) dans leur
+  proximity_radius_km d'un établissement du commerçant, notifications activées, catégorie
+  dans favorite_categories (liste vide = toutes), hors heures calmes (heure de Zurich),
+  plafond max_notifications_per_day (un seul agrégat des envois du jour)
+- Envoi par paquets de PUSH_CHUNK_SIZE (notification_senders['push']), journal
+  push_notifications_log écrit en INSERT multi-lignes après chaque paquet
+- File persistante push_fanout_jobs : create_flash_offer ajoute un job dans sa transaction
+  (enqueue_push), un thread par processus la traite (FOR UPDATE SKIP LOCKED entre workers) ;
+  un redémarrage ou un déploiement ne perd aucune diffusion
+- Membres déjà notifiés pour l'offre exclus : une offre retraitée ne renotifie personne
+- Sans FCM (expéditeur local) : aucune diffusion, rien n'est journalisé (un envoi simulé
+  compterait dans le plafond du jour et bloquerait l'envoi réel de l'offre), les jobs attendent
+"""
+import threading
+import traceback
+from datetime import datetime, timedelta
+
+import pytz
+from sqlalchemy import text
+
+from models import db
+from notification_senders import LocalSender, senders
+from slot_generator import TIMEZONE
+from utils.geo_query import GeoQuery
+
+PUSH_CHUNK_SIZE = 500
+MAX_PUSH_RADIUS_KM = 20  # Plafond de proximity_radius_km (taille du rectangle indexé)
+DEFAULT_RADIUS_KM = 3
+DEFAULT_MAX_PER_DAY = 5
+NOTIFICATION_TYPE = 'flash_offer_nearby'
+
+POLL_SECONDS = 30  # Jobs créés par les autres workers, reprises après erreur
+BATCH_SIZE = 10
+MAX_ATTEMPTS = 3
+STALE_RUNNING = timedelta(minutes=10)  # Job "running" d'un worker arrêté en cours de route
+
+
+def _local_day_start_utc(now):
+    """Minuit (heure de Zurich) du jour de `now`, en UTC naïf (format de sent_at)"""
+    local = pytz.utc.localize(now).astimezone(TIMEZONE)
+    midnight = TIMEZONE.localize(datetime.combine(local.date(), datetime.min.time()))
+    return midnight.astimezone(pytz.utc).replace(tzinfo=None)
+
+
+def _offer(offer_id):
+    return db.session.execute(text("""
+        SELECT o.id, o.partner_id, o.title, o.discount_val, p.name, p.category
+        FROM offers o JOIN partners p ON p.id = o.partner_id
+        WHERE o.id = :offer_id AND o.offer_type = 'flash' AND o.active = TRUE
+    """), {"offer_id": offer_id}).fetchone()
+
+
+def _partner_points(partner_id):
+    return db.session.execute(text("""
+        SELECT latitude, longitude FROM partners
+        WHERE id = :partner_id AND latitude IS NOT NULL AND longitude IS NOT NULL
+        UNION
+        SELECT latitude, longitude FROM partner_addresses
+        WHERE partner_id = :partner_id AND latitude IS NOT NULL AND longitude IS NOT NULL
+    """), {"partner_id": partner_id}).fetchall()
+
+
+def select_recipients(offer, now=None):
+    """[(member_id, firebase_token)] des membres à notifier pour une offre (une requête)"""
+    now = now or datetime.utcnow()
+    points = _partner_points(offer.partner_id)
+    if not points:
+        return []
+
+    radius = f"LEAST(COALESCE(s.proximity_radius_km, {DEFAULT_RADIUS_KM}), {MAX_PUSH_RADIUS_KM})"
+    params = {
+        "offer_id": offer.id,
+        "category": offer.category or '',
+        "local_time": pytz.utc.localize(now).astimezone(TIMEZONE).time().replace(microsecond=0),
+        "day_start": _local_day_start_utc(now),
+    }
+    nearby = []
+    for i, (lat, lng) in enumerate(points):
+        # Rectangle au rayon maximal (indexé), puis rayon propre à chaque membre
+        geo = GeoQuery(lat, lng, MAX_PUSH_RADIUS_KM, prefix=f'geo{i}')
+        nearby.append(
+            f"({geo.bbox('m.latitude', 'm.longitude')} AND {geo.distance('m.latitude', 'm.longitude')} <= {radius})"
+        )
+        params.update(geo.params)
+
+    return db.session.execute(text(f"""
+        WITH candidates AS (
+            SELECT m.id AS member_id, s.firebase_token,
+                   COALESCE(s.max_notifications_per_day, {DEFAULT_MAX_PER_DAY}) AS daily_cap
+            FROM members m
+            JOIN member_notification_settings s ON s.member_id = m.id
+            WHERE s.notifications_enabled = TRUE
+            AND s.firebase_token IS NOT NULL
+            AND ({' OR '.join(nearby)})
+            AND (
+                s.favorite_categories IS NULL
+                OR jsonb_array_length(s.favorite_categories) = 0
+                OR s.favorite_categories ? :category
+            )
+            AND NOT COALESCE(CASE
+                WHEN s.quiet_hours_start <= s.quiet_hours_end
+                    THEN :local_time >= s.quiet_hours_start AND :local_time < s.quiet_hours_end
+                ELSE :local_time >= s.quiet_hours_start OR :local_time < s.quiet_hours_end
+            END, FALSE)
+            AND NOT EXISTS (
+                SELECT 1 FROM push_notifications_log l WHERE l.member_id = m.id AND l.offer_id = :offer_id
+            )
+        ),
+        sent_today AS (
+            SELECT l.member_id, COUNT(*) AS sent
+            FROM push_notifications_log l
+            WHERE l.member_id IN (SELECT member_id FROM candidates)
+            AND l.sent_at >= :day_start
+            GROUP BY l.member_id
+        )
+        SELECT c.member_id, c.firebase_token
+        FROM candidates c
+        LEFT JOIN sent_today t ON t.member_id = c.member_id
+        WHERE COALESCE(t.sent, 0) < c.daily_cap
+        ORDER BY c.member_id
+    """), params).fetchall()
+
+
+def fan_out_push(offer_id, now=None):
+    """Notifie les membres proches d'une offre flash, retourne le nombre de notifications envoyées"""
+    if isinstance(senders['push'], LocalSender):
+        print(f"ℹ️ Offre flash {offer_id} : notifications push non configurées (FIREBASE_CREDENTIALS)")
+        return 0
+    offer = _offer(offer_id)
+    if offer is None:
+        db.session.commit()
+        return 0
+    recipients = select_recipients(offer, now)
+    db.session.commit()
+
+    title = f"⚡ Offre flash chez {offer.name}"
+    body = f"{offer.title} ({offer.discount_val})" if offer.discount_val else offer.title
+    sent = 0
+    for start in range(0, len(recipients), PUSH_CHUNK_SIZE):
+        chunk = recipients[start:start + PUSH_CHUNK_SIZE]
+        results = senders['push'].send_batch([
+            {'to': token, 'subject': title, 'body': body, 'data': {'offer_id': offer.id, 'type': NOTIFICATION_TYPE}}
+            for _member_id, token in chunk
+        ])
+        sent_at = datetime.utcnow()
+        rows = [
+            {"member_id": member_id, "partner_id": offer.partner_id, "offer_id": offer.id,
+             "notification_type": NOTIFICATION_TYPE, "title": title, "body": body, "sent_at": sent_at}
+            for (member_id, _token), (ok, _error) in zip(chunk, results) if ok
+        ]
+        if rows:
+            db.session.execute(text("""
+                INSERT INTO push_notifications_log (member_id, partner_id, offer_id, notification_type, title, body, sent_at)
+                VALUES (:member_id, :partner_id, :offer_id, :notification_type, :title, :body, :sent_at)
+            """), rows)
+            db.session.commit()
+        sent += len(rows)
+
+    print(f"📲 Offre flash {offer_id} : {sent}/{len(recipients)} notification(s) push envoyée(s)")
+    return sent
+
+
+def enqueue_push(offer_id):
+    """Ajoute la diffusion d'une offre à la file (dans la transaction de l'appelant, sans commit)"""
+    db.session.execute(text("""
+        INSERT INTO push_fanout_jobs (offer_id) VALUES (:offer_id)
+        ON CONFLICT (offer_id) DO NOTHING
+    """), {"offer_id": offer_id})
+
+
+def _claim_jobs(limit):
+    """Passe jusqu'à `limit` jobs en 'running' et retourne [(job_id, offer_id)]"""
+    now = datetime.utcnow()
+    # Jobs abandonnés par un processus arrêté (membres déjà notifiés exclus à la reprise)
+    db.session.execute(text("""
+        UPDATE push_fanout_jobs SET status = 'pending', updated_at = :now
+        WHERE status = 'running' AND updated_at < :stale
+    """), {"now": now, "stale": now - STALE_RUNNING})
+    lock = " FOR UPDATE SKIP LOCKED" if db.engine.dialect.name == 'postgresql' else ""
+    rows = db.session.execute(text(f"""
+        UPDATE push_fanout_jobs
+        SET status = 'running', attempts = attempts + 1, updated_at = :now
+        WHERE id IN (
+            SELECT id FROM push_fanout_jobs
+            WHERE status = 'pending'
+            ORDER BY id
+            LIMIT :limit{lock}
+        )
+        RETURNING id, offer_id
+    """), {"now": now, "limit": limit}).fetchall()
+    db.session.commit()
+    return rows
+
+
+def process_push_jobs(limit=BATCH_SIZE):
+    """Traite un lot de diffusions en attente, retourne le nombre de jobs traités"""
+    if isinstance(senders['push'], LocalSender):
+        return 0  # Jobs conservés jusqu'à la configuration de FCM
+    jobs = _claim_jobs(limit)
+    for job_id, offer_id in jobs:
+        try:
+            fan_out_push(offer_id)
+            status, error = 'done', None
+        except Exception as e:
+            db.session.rollback()
+            print(f"❌ Erreur notifications push (offre {offer_id}): {e}")
+            traceback.print_exc()
+            status, error = 'retry', str(e)[:500]
+        db.session.execute(text("""
+            UPDATE push_fanout_jobs
+            SET status = CASE
+                    WHEN :status = 'done' THEN 'done'
+                    WHEN attempts >= :max_attempts THEN 'failed'
+                    ELSE 'pending'
+                END,
+                last_error = :error, updated_at = :now
+            WHERE id = :job_id
+        """), {"status": status, "max_attempts": MAX_ATTEMPTS, "error": error,
+               "now": datetime.utcnow(), "job_id": job_id})
+        db.session.commit()
+    return len(jobs)
+
+
+class ProximityPushFanout:
+    """
+    Thread de fond (un par processus) : traite la file dès qu'on le réveille
+    (wake() après la création d'une offre) et au plus tard toutes les POLL_SECONDS.
+    """
+
+    def __init__(self):
+        self._wake = threading.Event()
+        self._thread = None
+        self.app = None
+
+    def start(self, app):
+        if self._thread is not None:
+            return
+        self.app = app
+        self._thread = threading.Thread(target=self._loop, name='proximity-push', daemon=True)
+        self._thread.start()
+
+    def wake(self):
+        self._wake.set()
+
+    def _loop(self):
+        while True:
+            with self.app.app_context():
+                try:
+                    while process_push_jobs() > 0:
+                        pass
+                except Exception as e:
+                    db.session.rollback()
+                    print(f"❌ Erreur file des notifications push: {e}")
+                finally:
+                    db.session.remove()
+            self._wake.wait(POLL_SECONDS)
+            self._wake.clear()
+
+
+proximity_push = ProximityPushFanout()
@@ -4,6 +4,7 @@ Reverse Geocoding et Enrichissement des Adresses PEP's
 - Complète les champs manquants (rue, numéro, code postal, ville, pays)
 - Corrige les adresses incomplètes ou erronées
 - Normalise les formats d'adresse
+- Cache de géocodage partagé (coordonnées arrondies) : pas de nouvel appel à la relance
 - Logging détaillé pour audit
 """
 
@@ -11,6 +12,7 @@ from geopy.geocoders import Nominatim
 from geopy.exc import GeocoderTimedOut, GeocoderServiceError
 from sqlalchemy import text
 from models import db, Partner
+from utils.geocoding_cache import geocoding_cache
 import time
 import traceback
 from datetime import datetime
@@ -26,7 +28,6 @@ class AddressEnricher:
         self.error_count = 0
         self.skipped_count = 0
         self.partial_count = 0
-        self.rate_limit_delay = 1.1
         
     def extract_house_number(self, address_dict):
         """
@@ -63,14 +64,14 @@ class AddressEnricher:
         
         return None
     
-    def normalize_address_data(self, location):
+    def normalize_address_data(self, place):
         """
-        Normalise les données d'adresse de Nominatim
+        Normalise les données d'adresse de Nominatim (réponse brute)
         """
-        if not location or not location.raw:
+        if not place:
             return None
         
-        address_dict = location.raw.get('address', {})
+        address_dict = place.get('address', {})
         
         # Extraire les composants
         house_number = self.extract_house_number(address_dict)
@@ -103,7 +104,7 @@ class AddressEnricher:
             'country': country,
             'country_code': country_code,
             'state': state,
-            'full_address': location.address,
+            'full_address': place.get('display_name', ''),
             'raw': address_dict
         }
     
@@ -111,31 +112,24 @@ class AddressEnricher:
         """
         Effectue le reverse geocoding pour des coordonnées GPS
         """
-        try:
+        def fetch():
             location = self.geolocator.reverse(
                 f"{latitude}, {longitude}",
                 exactly_one=True,
                 language='fr',
                 addressdetails=True
             )
-            
-            if location:
-                return self.normalize_address_data(location)
-            
-            return None
+            return location.raw if location else None
+        
+        try:
+            # Rate limiting appliqué par le cache aux seuls appels réseau
+            return self.normalize_address_data(geocoding_cache.reverse(latitude, longitude, fetch))
             
         except GeocoderTimedOut:
             print(f"    ⏱️  Timeout - retry...")
             time.sleep(2)
             try:
-                location = self.geolocator.reverse(
-                    f"{latitude}, {longitude}",
-                    exactly_one=True,
-                    language='fr',
-                    addressdetails=True
-                )
-                if location:
-                    return self.normalize_address_data(location)
+                return self.normalize_address_data(geocoding_cache.reverse(latitude, longitude, fetch))
             except:
                 return None
         except GeocoderServiceError as e:
@@ -291,10 +285,6 @@ class AddressEnricher:
                 print(f"{'='*80}")
                 
                 self.enrich_partner(partner)
-                
-                # Rate limiting
-                if i < total:
-                    time.sleep(self.rate_limit_delay)
             
             # Statistiques finales
             self.print_summary(total)
@@ -5,6 +5,7 @@ from flask import Blueprint, jsonify, request
 from flask_jwt_extended import jwt_required, get_jwt_identity
 from models import db, Member, Partner, Offer, Subscription
 from models_activation import PrivilegeActivation
+from expiry_scheduler import ACTIVATION, expiry_scheduler
 from datetime import datetime, timedelta
 import secrets
 import string
@@ -141,6 +142,7 @@ def activate_privilege():
         
         db.session.add(activation)
         db.session.commit()
+        expiry_scheduler.schedule(ACTIVATION, activation.id, activation.expires_at)
         
         # Récupérer les informations du partenaire et de l'offre
         partner = Partner.query.get(offer.partner_id)
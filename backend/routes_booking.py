@@ -1,17 +1,77 @@
 """
 Routes API pour le système de réservation PEP'S
 """
-from flask import Blueprint, request, jsonify
+import base64
+
+from flask import Blueprint, Response, request, jsonify, url_for
+from flask_jwt_extended import get_jwt_identity, jwt_required
 from models import (
     db, Partner, Member, Service, PartnerBookingConfig, Creneau, Booking, 
     GoogleCalendarToken, BookingNotificationLog
 )
-from datetime import datetime, timedelta
-from sqlalchemy import and_, or_
-import pytz
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import and_, func, or_
+
+from availability_search import MAX_WINDOW_DAYS, search_available
+from booking_availability import (
+    booking_slot_ids, cached_availability, cached_availability_batch, claim_slots, invalidate_availability,
+    is_virtual_start_available, local_month_bounds, release_booking_slots, required_slot_count
+)
+from booking_ics import cached_feed, ensure_feed_token, feed_etag, feed_token_valid
+from booking_notifications import enqueue_booking_notifications, notification_dispatcher
+from partner_geo_index import format_branch_address, format_partner_address
+from slot_generator import BOOKING_MODE_VIRTUAL, TIMEZONE, resync_partner_slots
 
 booking_bp = Blueprint('booking', __name__)
 
+BOOKINGS_PAGE_SIZE = 50
+MAX_BOOKINGS_PAGE_SIZE = 200
+
+
+def _parse_utc_datetime(value):
+    """Date ISO d'un paramètre de requête -> datetime UTC naïf (format de booking_date)"""
+    parsed = datetime.fromisoformat(value)
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
+
+
+def _encode_booking_cursor(booking):
+    """Curseur opaque (booking_date, id) de la dernière réservation d'une page"""
+    value = f"{booking.booking_date.isoformat()}|{booking.id}"
+    return base64.urlsafe_b64encode(value.encode('utf-8')).decode('ascii')
+
+
+def _paginate_bookings(query):
+    """
+    Pagination par curseur sur (booking_date, id), du plus récent au plus ancien.
+    Query params : limit, cursor (next_cursor de la page précédente).
+    Retourne (réservations, next_cursor) ; lève ValueError si les paramètres sont invalides.
+    """
+    limit = min(max(request.args.get('limit', BOOKINGS_PAGE_SIZE, type=int), 1), MAX_BOOKINGS_PAGE_SIZE)
+    cursor = request.args.get('cursor')
+    if cursor:
+        try:
+            date_value, booking_id = base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8').split('|')
+            cursor_date, cursor_id = datetime.fromisoformat(date_value), int(booking_id)
+        except Exception:
+            raise ValueError('Curseur invalide')
+        query = query.filter(or_(
+            Booking.booking_date < cursor_date,
+            and_(Booking.booking_date == cursor_date, Booking.id < cursor_id)
+        ))
+
+    bookings = query.order_by(Booking.booking_date.desc(), Booking.id.desc()).limit(limit + 1).all()
+    next_cursor = _encode_booking_cursor(bookings[limit - 1]) if len(bookings) > limit else None
+    return bookings[:limit], next_cursor
+
+
+# Champs de configuration qui changent les créneaux générés
+SLOT_CONFIG_FIELDS = {
+    'booking_mode', 'is_enabled', 'slot_duration_minutes', 'advance_booking_days',
+    'opening_hours', 'closed_dates', 'max_concurrent_bookings'
+}
+
 # ===========================
 # ROUTES COMMERÇANT
 # ===========================
@@ -71,6 +131,26 @@ def update_partner_booking_config(partner_id):
             config = PartnerBookingConfig(partner_id=partner_id)
             db.session.add(config)
         
+        # Sortie du mode virtuel : les créneaux générés ignoreraient les réservations
+        # virtuelles à venir (creneau_id NULL), leur capacité serait vendue deux fois
+        if (
+            'booking_mode' in data and data['booking_mode'] != BOOKING_MODE_VIRTUAL
+            and config.booking_mode == BOOKING_MODE_VIRTUAL
+        ):
+            pending = Booking.query.filter(
+                Booking.partner_id == partner_id,
+                Booking.creneau_id.is_(None),
+                Booking.status != 'cancelled',
+                Booking.booking_date >= datetime.utcnow()
+            ).count()
+            if pending:
+                db.session.rollback()
+                return jsonify({
+                    'success': False,
+                    'error': f'{pending} réservation(s) à venir prise(s) en mode virtuel : '
+                             'changement de mode possible une fois celles-ci passées ou annulées'
+                }), 400
+        
         # Mise à jour des champs
         if 'booking_mode' in data:
             config.booking_mode = data['booking_mode']
@@ -100,7 +180,11 @@ def update_partner_booking_config(partner_id):
             config.cancellation_hours = data['cancellation_hours']
         
         config.updated_at = datetime.utcnow()
+        # Horaires modifiés : réaligner les créneaux déjà générés sur tout l'horizon
+        if config.is_enabled and config.booking_mode != BOOKING_MODE_VIRTUAL and SLOT_CONFIG_FIELDS & set(data):
+            resync_partner_slots(config)
         db.session.commit()
+        invalidate_availability(partner_id)
         
         return jsonify({
             'success': True,
@@ -213,6 +297,7 @@ def update_service(partner_id, service_id):
         
         service.updated_at = datetime.utcnow()
         db.session.commit()
+        invalidate_availability(partner_id)
         
         return jsonify({
             'success': True,
@@ -242,6 +327,7 @@ def delete_service(partner_id, service_id):
         service.is_active = False
         service.updated_at = datetime.utcnow()
         db.session.commit()
+        invalidate_availability(partner_id)
         
         return jsonify({
             'success': True,
@@ -256,7 +342,7 @@ def delete_service(partner_id, service_id):
 @booking_bp.route('/api/partner/<int:partner_id>/bookings', methods=['GET'])
 def get_partner_bookings(partner_id):
     """
-    Récupérer toutes les réservations d'un commerçant
+    Récupérer les réservations d'un commerçant (paginées, voir _paginate_bookings)
     """
     try:
         # Filtres optionnels
@@ -267,17 +353,76 @@ def get_partner_bookings(partner_id):
         query = Booking.query.filter_by(partner_id=partner_id)
         
         if start_date:
-            query = query.filter(Booking.booking_date >= datetime.fromisoformat(start_date))
+            query = query.filter(Booking.booking_date >= _parse_utc_datetime(start_date))
         if end_date:
-            query = query.filter(Booking.booking_date <= datetime.fromisoformat(end_date))
+            query = query.filter(Booking.booking_date <= _parse_utc_datetime(end_date))
         if status:
             query = query.filter(Booking.status == status)
         
-        bookings = query.order_by(Booking.booking_date.desc()).all()
+        try:
+            bookings, next_cursor = _paginate_bookings(query)
+        except ValueError as e:
+            return jsonify({'success': False, 'error': str(e)}), 400
         
         return jsonify({
             'success': True,
-            'bookings': [b.to_dict() for b in bookings]
+            'bookings': [b.to_dict() for b in bookings],
+            'next_cursor': next_cursor
+        }), 200
+        
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+
+@booking_bp.route('/api/partner/<int:partner_id>/bookings/calendar', methods=['GET'])
+def get_partner_bookings_calendar(partner_id):
+    """
+    Résumé d'un mois de l'agenda, par jour (heure de Zurich), calculé en SQL :
+    réservations confirmées, personnes, chiffre d'affaires (price_final) et annulations.
+    
+    Query params:
+    - month: AAAA-MM (défaut: mois courant)
+    """
+    try:
+        try:
+            month_value = request.args.get('month', datetime.now(TIMEZONE).strftime('%Y-%m'))
+            year, month = int(month_value[:4]), int(month_value[5:7])
+            start, end = local_month_bounds(year, month)
+        except ValueError:
+            return jsonify({'success': False, 'error': 'Paramètre month (AAAA-MM) invalide'}), 400
+        
+        if db.engine.dialect.name == 'postgresql':
+            day = func.date(func.timezone(TIMEZONE.zone, func.timezone('UTC', Booking.booking_date)))
+        else:
+            day = func.date(Booking.booking_date)
+        active = Booking.status != 'cancelled'
+        
+        rows = db.session.query(
+            day.label('day'),
+            func.count(Booking.id).filter(active).label('bookings'),
+            func.coalesce(func.sum(Booking.number_of_people).filter(active), 0).label('people'),
+            func.coalesce(func.sum(Booking.price_final).filter(active), 0).label('revenue'),
+            func.count(Booking.id).filter(Booking.status == 'cancelled').label('cancelled')
+        ).filter(
+            Booking.partner_id == partner_id,
+            Booking.booking_date >= start,
+            Booking.booking_date < end
+        ).group_by(day).order_by(day).all()
+        
+        days = [{
+            'date': str(row.day),
+            'bookings': row.bookings,
+            'people': int(row.people),
+            'revenue': round(float(row.revenue), 2),
+            'cancelled': row.cancelled
+        } for row in rows]
+        
+        return jsonify({
+            'success': True,
+            'month': f"{year:04d}-{month:02d}",
+            'days': days,
+            'total_bookings': sum(d['bookings'] for d in days),
+            'total_revenue': round(sum(d['revenue'] for d in days), 2)
         }), 200
         
     except Exception as e:
@@ -309,16 +454,13 @@ def partner_cancel_booking(partner_id, booking_id):
         booking.cancellation_reason = data.get('reason', '')
         booking.updated_at = datetime.utcnow()
         
-        # Libérer le créneau
-        creneau = Creneau.query.get(booking.creneau_id)
-        if creneau:
-            creneau.booked_count -= 1
-            if creneau.booked_count < creneau.capacity:
-                creneau.is_available = True
+        # Libérer les créneaux
+        release_booking_slots(booking)
+        enqueue_booking_notifications(booking, 'cancellation_by_partner')
         
         db.session.commit()
-        
-        # TODO: Envoyer notification au membre
+        invalidate_availability(booking.partner_id, booking.booking_date)
+        notification_dispatcher.wake()
         
         return jsonify({
             'success': True,
@@ -359,62 +501,119 @@ def get_partner_availability(partner_id):
         if not config or not config.is_enabled:
             return jsonify({'success': False, 'error': 'Réservation désactivée'}), 400
 
-        # 3. Calculer le nombre de slots nécessaires
-        service_duration = service.duration_minutes
-        slot_duration = config.slot_duration_minutes
-        required_slots = (service_duration + slot_duration - 1) // slot_duration
+        # 3. Recherche des séries de créneaux consécutifs libres (un seul passage)
+        return jsonify({
+            'success': True,
+            'creneaux': cached_availability(partner_id, service, config, year, month)
+        }), 200
 
-        # 4. Récupérer tous les créneaux du mois
-        start_date = datetime(year, month, 1, tzinfo=pytz.UTC)
-        if month == 12:
-            end_date = datetime(year + 1, 1, 1, tzinfo=pytz.UTC)
-        else:
-            end_date = datetime(year, month + 1, 1, tzinfo=pytz.UTC)
-
-        all_creneaux = Creneau.query.filter(
-            Creneau.partner_id == partner_id,
-            Creneau.start_datetime >= start_date,
-            Creneau.start_datetime < end_date
-        ).order_by(Creneau.start_datetime).all()
-
-        # 5. Algorithme de recherche de créneaux consécutifs
-        available_booking_slots = []
-        if not all_creneaux:
-            return jsonify({'success': True, 'creneaux': []}), 200
-
-        for i in range(len(all_creneaux) - required_slots + 1):
-            # Vérifier si la séquence de créneaux est consécutive et disponible
-            is_sequence_valid = True
-            for j in range(required_slots):
-                current_creneau = all_creneaux[i+j]
-                
-                # Vérifier la disponibilité
-                if not current_creneau.is_available or current_creneau.booked_count >= current_creneau.capacity:
-                    is_sequence_valid = False
-                    break
-                
-                # Vérifier la consécutivité (sauf pour le premier)
-                if j > 0:
-                    previous_creneau = all_creneaux[i+j-1]
-                    expected_start = previous_creneau.start_datetime + timedelta(minutes=slot_duration)
-                    if current_creneau.start_datetime != expected_start:
-                        is_sequence_valid = False
-                        break
-            
-            if is_sequence_valid:
-                # Le premier créneau de la séquence est un slot de réservation valide
-                valid_start_creneau = all_creneaux[i]
-                available_booking_slots.append(valid_start_creneau)
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+
+MAX_BATCH_MONTHS = 6
+
+@booking_bp.route('/api/member/partners/<int:partner_id>/availability/batch', methods=['GET'])
+def get_partner_availability_batch(partner_id):
+    """
+    Disponibilités de plusieurs services et/ou plusieurs mois en un appel.
+    
+    Query params:
+    - service_ids: IDs séparés par des virgules (défaut: tous les services actifs)
+    - months: mois AAAA-MM séparés par des virgules (défaut: mois courant, max 6)
+    """
+    try:
+        config = PartnerBookingConfig.query.filter_by(partner_id=partner_id).first()
+        if not config or not config.is_enabled:
+            return jsonify({'success': False, 'error': 'Réservation désactivée'}), 400
+
+        try:
+            months = [
+                (int(value[:4]), int(value[5:7]))
+                for value in request.args.get('months', datetime.now().strftime('%Y-%m')).split(',') if value.strip()
+            ]
+            service_ids = [int(value) for value in request.args.get('service_ids', '').split(',') if value.strip()]
+        except ValueError:
+            return jsonify({'success': False, 'error': 'Paramètres months (AAAA-MM) ou service_ids invalides'}), 400
+        if not months or len(months) > MAX_BATCH_MONTHS or any(not 1 <= month <= 12 for _year, month in months):
+            return jsonify({'success': False, 'error': f'Entre 1 et {MAX_BATCH_MONTHS} mois valides requis'}), 400
+
+        query = Service.query.filter_by(partner_id=partner_id, is_active=True)
+        if service_ids:
+            query = query.filter(Service.id.in_(service_ids))
+        services = query.all()
+
+        availability = cached_availability_batch(partner_id, services, config, months)
 
         return jsonify({
             'success': True,
-            'creneaux': [c.to_dict() for c in available_booking_slots]
+            'availability': {str(service_id): by_month for service_id, by_month in availability.items()}
         }), 200
 
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
 
+MAX_SEARCH_RADIUS_KM = 50
+MAX_SEARCH_RESULTS = 50
+
+@booking_bp.route('/api/member/availability/search', methods=['GET'])
+def search_availability_nearby():
+    """
+    Premiers créneaux libres des commerçants proches, en une seule requête.
+    
+    Query params:
+    - lat, lng: position du membre (obligatoires)
+    - radius: rayon en km (défaut: 5, max 50)
+    - category: catégorie de commerçant (optionnel)
+    - start, end: jours AAAA-MM-JJ (défaut: aujourd'hui et 7 jours, max 14 jours)
+    - people: nombre de personnes (défaut: 1)
+    - limit: nombre de créneaux (défaut: 20, max 50)
+    """
+    try:
+        try:
+            lat = float(request.args['lat'])
+            lng = float(request.args['lng'])
+            radius = min(float(request.args.get('radius', 5)), MAX_SEARCH_RADIUS_KM)
+            today = datetime.now(TIMEZONE).date()
+            first_day = datetime.strptime(request.args['start'], '%Y-%m-%d').date() if request.args.get('start') else today
+            last_day = (
+                datetime.strptime(request.args['end'], '%Y-%m-%d').date() if request.args.get('end')
+                else first_day + timedelta(days=6)
+            )
+            people = max(int(request.args.get('people', 1)), 1)
+            limit = min(max(int(request.args.get('limit', 20)), 1), MAX_SEARCH_RESULTS)
+        except (KeyError, ValueError):
+            return jsonify({'success': False, 'error': 'Paramètres lat, lng, radius, start, end (AAAA-MM-JJ) ou people invalides'}), 400
+        first_day = max(first_day, today)
+        if last_day < first_day or (last_day - first_day).days >= MAX_WINDOW_DAYS:
+            return jsonify({'success': False, 'error': f'Fenêtre de 1 à {MAX_WINDOW_DAYS} jours requise'}), 400
+        
+        slots, partners_searched = search_available(
+            lat, lng, radius, first_day, last_day, category=request.args.get('category'), people=people, limit=limit
+        )
+        
+        return jsonify({
+            'success': True,
+            'slots': [{
+                'start_datetime': start.isoformat(),
+                'end_datetime': end.isoformat(),
+                'partner': {
+                    'id': partner['id'],
+                    'name': partner['name'],
+                    'category': partner['category'],
+                    'address': format_branch_address(branch) if branch else format_partner_address(partner),
+                    'branch_id': branch['id'] if branch else None,
+                    'distance_km': round(distance, 2)
+                }
+            } for start, end, distance, partner, branch in slots],
+            'partners_searched': partners_searched
+        }), 200
+    
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+
 @booking_bp.route('/api/member/bookings', methods=['POST'])
 def create_booking():
     """
@@ -428,21 +627,36 @@ def create_booking():
             return jsonify({'success': False, 'error': 'member_id requis'}), 400
         if not data.get('partner_id'):
             return jsonify({'success': False, 'error': 'partner_id requis'}), 400
-        if not data.get('creneau_id'):
-            return jsonify({'success': False, 'error': 'creneau_id requis'}), 400
         
         member_id = int(data['member_id'])
         partner_id = int(data['partner_id'])
-        creneau_id = int(data['creneau_id'])
         service_id = data.get('service_id')
+        number_of_people = int(data.get('number_of_people', 1))
+        if number_of_people < 1:
+            return jsonify({'success': False, 'error': 'number_of_people doit être au moins 1'}), 400
         
-        # Vérifier que le créneau est disponible
-        creneau = Creneau.query.get(creneau_id)
-        if not creneau:
-            return jsonify({'success': False, 'error': 'Créneau non trouvé'}), 404
+        config = PartnerBookingConfig.query.filter_by(partner_id=partner_id).first()
+        virtual = config is not None and config.booking_mode == BOOKING_MODE_VIRTUAL
+        
+        creneau = None
+        if virtual:
+            if not data.get('start_datetime'):
+                return jsonify({'success': False, 'error': 'start_datetime requis'}), 400
+            start_datetime = datetime.fromisoformat(data['start_datetime'])
+            if start_datetime.tzinfo is not None:
+                start_datetime = start_datetime.astimezone(timezone.utc).replace(tzinfo=None)
+        else:
+            if not data.get('creneau_id'):
+                return jsonify({'success': False, 'error': 'creneau_id requis'}), 400
+            
+            creneau = Creneau.query.get(int(data['creneau_id']))
+            if not creneau or creneau.partner_id != partner_id:
+                return jsonify({'success': False, 'error': 'Créneau non trouvé'}), 404
+            start_datetime = creneau.start_datetime
         
-        if not creneau.is_available or creneau.booked_count >= creneau.capacity:
-            return jsonify({'success': False, 'error': 'Créneau non disponible'}), 400
+        capacity = creneau.capacity if creneau else (config.max_concurrent_bookings or 1)
+        if number_of_people > capacity:
+            return jsonify({'success': False, 'error': f'Capacité maximale : {capacity} personne(s)'}), 400
         
         # Récupérer les informations du service
         service = None
@@ -465,15 +679,36 @@ def create_booking():
                 price_final = price_original - discount_applied
                 duration_minutes = service.duration_minutes
         
+        if virtual:
+            # Verrou sur la configuration : les réservations virtuelles d'un commerçant
+            # sont vérifiées l'une après l'autre (même calcul que le calendrier)
+            db.session.query(PartnerBookingConfig.id).filter_by(id=config.id).with_for_update().first()
+            if not is_virtual_start_available(partner_id, service, config, start_datetime, number_of_people):
+                db.session.rollback()
+                return jsonify({'success': False, 'error': 'Créneau non disponible'}), 400
+            if service is None:
+                duration_minutes = config.slot_duration_minutes
+        
+        slot_count = None
+        if creneau:
+            # Tous les créneaux couverts par la prestation, réservés en un seul UPDATE conditionnel
+            slot_duration = config.slot_duration_minutes if config else duration_minutes
+            slot_count = required_slot_count(duration_minutes, slot_duration) if service else 1
+            slot_ids = booking_slot_ids(partner_id, creneau.start_datetime, slot_count, creneau.service_id or service_id)
+            if not slot_ids or not claim_slots(slot_ids, number_of_people):
+                db.session.rollback()
+                return jsonify({'success': False, 'error': 'Créneau non disponible'}), 400
+        
         # Créer la réservation
         booking = Booking(
             member_id=member_id,
             partner_id=partner_id,
             service_id=service_id,
-            creneau_id=creneau_id,
-            booking_date=creneau.start_datetime,
+            creneau_id=creneau.id if creneau else None,
+            booking_date=start_datetime,
             duration_minutes=duration_minutes,
-            number_of_people=int(data.get('number_of_people', 1)),
+            number_of_people=number_of_people,
+            slot_count=slot_count,
             price_original=price_original,
             price_final=price_final,
             discount_applied=discount_applied,
@@ -481,15 +716,12 @@ def create_booking():
             member_notes=data.get('member_notes', '')
         )
         
-        # Augmenter le compteur de réservations
-        creneau.booked_count += 1
-        if creneau.booked_count >= creneau.capacity:
-            creneau.is_available = False
-        
         db.session.add(booking)
+        enqueue_booking_notifications(booking, 'confirmation', config)
         db.session.commit()
+        invalidate_availability(partner_id, start_datetime)
+        notification_dispatcher.wake()
         
-        # TODO: Envoyer notifications
         # TODO: Créer événement Google Calendar
         
         return jsonify({
@@ -506,7 +738,7 @@ def create_booking():
 @booking_bp.route('/api/member/<int:member_id>/bookings', methods=['GET'])
 def get_member_bookings(member_id):
     """
-    Récupérer toutes les réservations d'un membre
+    Récupérer les réservations d'un membre (paginées, voir _paginate_bookings)
     """
     try:
         status = request.args.get('status')
@@ -516,11 +748,15 @@ def get_member_bookings(member_id):
         if status:
             query = query.filter(Booking.status == status)
         
-        bookings = query.order_by(Booking.booking_date.desc()).all()
+        try:
+            bookings, next_cursor = _paginate_bookings(query)
+        except ValueError as e:
+            return jsonify({'success': False, 'error': str(e)}), 400
         
         return jsonify({
             'success': True,
-            'bookings': [b.to_dict() for b in bookings]
+            'bookings': [b.to_dict() for b in bookings],
+            'next_cursor': next_cursor
         }), 200
         
     except Exception as e:
@@ -563,16 +799,14 @@ def member_cancel_booking(booking_id):
         booking.cancellation_reason = data.get('reason', '')
         booking.updated_at = datetime.utcnow()
         
-        # Libérer le créneau
-        creneau = Creneau.query.get(booking.creneau_id)
-        if creneau:
-            creneau.booked_count -= 1
-            if creneau.booked_count < creneau.capacity:
-                creneau.is_available = True
+        # Libérer les créneaux
+        release_booking_slots(booking)
+        enqueue_booking_notifications(booking, 'cancellation_by_member', config)
         
         db.session.commit()
+        invalidate_availability(booking.partner_id, booking.booking_date)
+        notification_dispatcher.wake()
         
-        # TODO: Envoyer notification au commerçant
         # TODO: Supprimer événement Google Calendar
         
         return jsonify({
@@ -586,6 +820,61 @@ def member_cancel_booking(booking_id):
         return jsonify({'success': False, 'error': str(e)}), 500
 
 
+@booking_bp.route('/api/partner/<int:partner_id>/calendar.ics', methods=['GET'])
+def get_partner_calendar_feed(partner_id):
+    """
+    Flux iCalendar des réservations confirmées (abonnement Google/Apple/Outlook).
+    Query param : token (jeton secret, voir /calendar-feed) ; 404 s'il est absent ou invalide.
+    ETag fort : 304 Not Modified tant qu'aucune réservation n'a changé.
+    """
+    try:
+        if not feed_token_valid(partner_id, request.args.get('token')):
+            return jsonify({'success': False, 'error': 'Flux non trouvé'}), 404
+        
+        etag = feed_etag(partner_id)
+        if etag in request.if_none_match:
+            response = Response(status=304)
+        else:
+            response = Response(cached_feed(partner_id, etag), mimetype='text/calendar')
+            response.headers['Content-Disposition'] = f'inline; filename="peps-reservations-{partner_id}.ics"'
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = 'private, max-age=0, must-revalidate'
+        return response
+        
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+
+@booking_bp.route('/api/partner/<int:partner_id>/calendar-feed', methods=['GET'])
+@booking_bp.route('/api/partner/<int:partner_id>/calendar-feed/regenerate', methods=['POST'])
+@jwt_required()
+def get_partner_calendar_feed_url(partner_id):
+    """
+    URL secrète du flux iCalendar (commerçant connecté uniquement).
+    POST .../regenerate : nouveau jeton, l'ancienne URL cesse de fonctionner.
+    """
+    try:
+        partner = Partner.query.filter_by(id=partner_id, user_id=int(get_jwt_identity())).first()
+        if not partner:
+            return jsonify({'success': False, 'error': 'Partenaire non trouvé'}), 404
+        
+        config = PartnerBookingConfig.query.filter_by(partner_id=partner_id).first()
+        if not config:
+            return jsonify({'success': False, 'error': 'Système de réservation non configuré'}), 404
+        
+        token = ensure_feed_token(config, regenerate=request.method == 'POST')
+        db.session.commit()
+        
+        return jsonify({
+            'success': True,
+            'url': url_for('booking.get_partner_calendar_feed', partner_id=partner_id, token=token, _external=True)
+        }), 200
+        
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+
 # ===========================
 # ROUTES GOOGLE CALENDAR
 # ===========================
@@ -5,6 +5,7 @@ from flask import Blueprint, jsonify, request
 from flask_jwt_extended import jwt_required, get_jwt_identity
 from sqlalchemy import text
 from models import db, Member, Partner
+from flash_feed import add_partner_to_feed, rebuild_member_feed
 from datetime import datetime
 
 favorites_bp = Blueprint('favorites', __name__)
@@ -118,6 +119,7 @@ def add_favorite(partner_id):
             INSERT INTO member_favorites (member_id, partner_id, created_at)
             VALUES (:member_id, :partner_id, NOW())
         """), {"member_id": member_id, "partner_id": partner_id})
+        add_partner_to_feed(member_id, partner_id)  # Offres flash en cours du commerçant
         
         db.session.commit()
         
@@ -157,6 +159,8 @@ def remove_favorite(partner_id):
             WHERE member_id = :member_id AND partner_id = :partner_id
             RETURNING id
         """), {"member_id": member_id, "partner_id": partner_id})
+        if result.rowcount:
+            rebuild_member_feed(member_id)  # Les offres restent si le commerçant est proche
         
         db.session.commit()
         
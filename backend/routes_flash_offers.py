@@ -5,6 +5,13 @@ from flask import Blueprint, jsonify, request
 from flask_jwt_extended import jwt_required, get_jwt_identity
 from sqlalchemy import text
 from models import db, Partner
+from flash_feed import fan_out_offer, member_feed_rows
+from expiry_scheduler import FLASH_OFFER, expiry_scheduler
+from flash_stock import (
+    ALREADY_RESERVED, SOLD_OUT, flash_stock_flusher, release_stock, reserve_stock, restock, stock_counter
+)
+from flash_waitlist import waitlist_position, waitlist_promoter
+from proximity_push import enqueue_push, proximity_push
 from datetime import datetime, timedelta
 import re
 
@@ -15,6 +22,7 @@ flash_offers_bp = Blueprint('flash_offers', __name__)
 def get_public_flash_offers():
     """
     Récupérer les offres flash disponibles (endpoint public)
+    Offres échues désactivées à l'heure exacte (expiry_scheduler) : pas de filtre sur valid_until
     """
     try:
         # Récupérer toutes les offres flash actives et non expirées
@@ -41,7 +49,6 @@ def get_public_flash_offers():
             ) reserved ON o.id = reserved.offer_id
             WHERE o.offer_type = 'flash'
             AND o.active = TRUE
-            AND o.valid_until > NOW()
             AND o.stock > COALESCE(reserved.count, 0)
             ORDER BY o.valid_until ASC
         """)).fetchall()
@@ -190,7 +197,11 @@ def create_flash_offer():
         })
         
         offer_id = result.fetchone()[0]
+        fan_out_offer(offer_id)  # Fil des membres concernés, dans la même transaction
+        enqueue_push(offer_id)  # Notifications push : job persistant, envoyé en arrière-plan
         db.session.commit()
+        expiry_scheduler.schedule(FLASH_OFFER, offer_id, validity_end)
+        proximity_push.wake()
         
         return jsonify({
             "success": True,
@@ -210,62 +221,21 @@ def create_flash_offer():
 def get_available_flash_offers():
     """
     Récupérer les offres flash disponibles pour un membre
-    Basé sur les favoris + proximité géographique
+    Basé sur les favoris + proximité géographique (fil précalculé à la création des offres)
     """
     try:
         user_id = get_jwt_identity()
         
-        # Récupérer le member_id et sa position
+        # Récupérer le member_id
         member = db.session.execute(text("""
-            SELECT id, latitude, longitude FROM members WHERE user_id = :user_id
+            SELECT id FROM members WHERE user_id = :user_id
         """), {"user_id": user_id}).fetchone()
         
         if not member:
             return jsonify({"success": False, "error": "Membre non trouvé"}), 404
         
-        member_id = member[0]
-        member_lat = member[1]
-        member_lon = member[2]
-        
-        # Récupérer les IDs des partenaires favoris
-        favorites = db.session.execute(text("""
-            SELECT partner_id FROM member_favorites WHERE member_id = :member_id
-        """), {"member_id": member_id}).fetchall()
-        
-        favorite_ids = [f[0] for f in favorites] if favorites else []
-        
-        # Récupérer les offres flash disponibles
-        # Critères : (Partenaire en favori OU dans un rayon de 10km) ET stock > 0 ET pas encore expiré
-        query = """
-            SELECT 
-                o.id, o.title, o.discount_val, o.description,
-                o.stock, o.stock as current_stock, o.valid_from, o.valid_until,
-                p.id as partner_id, p.name as partner_name, p.city, p.category,
-                p.latitude, p.longitude
-            FROM offers o
-            JOIN partners p ON o.partner_id = p.id
-            WHERE o.offer_type = 'flash'
-            AND o.active = TRUE
-            AND o.stock > 0
-            AND o.valid_until > NOW()
-        """
-        
-        # Filtrer par favoris OU proximité
-        if favorite_ids:
-            query += f" AND (o.partner_id IN ({','.join(map(str, favorite_ids))})"
-            if member_lat and member_lon:
-                # Formule de distance approximative (1 degré ≈ 111 km)
-                query += f" OR (p.latitude IS NOT NULL AND p.longitude IS NOT NULL AND "
-                query += f"SQRT(POW((p.latitude - {member_lat}) * 111, 2) + POW((p.longitude - {member_lon}) * 111 * COS(RADIANS({member_lat})), 2)) < 10))"
-            else:
-                query += ")"
-        elif member_lat and member_lon:
-            query += f" AND p.latitude IS NOT NULL AND p.longitude IS NOT NULL AND "
-            query += f"SQRT(POW((p.latitude - {member_lat}) * 111, 2) + POW((p.longitude - {member_lon}) * 111 * COS(RADIANS({member_lat})), 2)) < 10"
-        
-        query += " ORDER BY o.validity_end ASC"
-        
-        result = db.session.execute(text(query)).fetchall()
+        # Fil précalculé (favoris + proximité, voir flash_feed) : une seule lecture indexée
+        result = member_feed_rows(member[0])
         
         offers = []
         for row in result:
@@ -302,7 +272,9 @@ def get_available_flash_offers():
 @jwt_required()
 def reserve_flash_offer(offer_id):
     """
-    Réserver une offre flash (gestion atomique du stock)
+    Réserver une offre flash
+    Stock décompté par un compteur atomique (flash_stock) : pas de verrou sur la ligne de l'offre
+    (sauf sans Redis avec plusieurs workers : UPDATE conditionnel du stock)
     """
     try:
         user_id = get_jwt_identity()
@@ -318,16 +290,14 @@ def reserve_flash_offer(offer_id):
         member_id = member[0]
         member_name = f"{member[1]} {member[2]}"
         
-        # Vérifier que l'offre existe et est disponible (AVEC LOCK FOR UPDATE pour éviter les race conditions)
+        # Offre (lecture simple : le stock est géré par le compteur, sans verrou sur la ligne)
         offer = db.session.execute(text("""
-            SELECT id, partner_id, title, discount_val, stock, valid_until
+            SELECT id, partner_id, title, discount_val
             FROM offers
             WHERE id = :offer_id
             AND offer_type = 'flash'
             AND active = TRUE
-            AND stock > 0
             AND valid_until > NOW()
-            FOR UPDATE
         """), {"offer_id": offer_id}).fetchone()
         
         if not offer:
@@ -352,30 +322,47 @@ def reserve_flash_offer(offer_id):
                 "error": "Vous avez déjà réservé cette offre flash"
             }), 400
         
-        # Décrémenter le stock de manière atomique
-        db.session.execute(text("""
-            UPDATE offers
-            SET stock = stock - 1
-            WHERE id = :offer_id
-        """), {"offer_id": offer_id})
-        
-        # Créer la réservation flash
-        result = db.session.execute(text("""
-            INSERT INTO flash_reservations (
-                member_id, partner_id, offer_id, status, created_at
-            )
-            VALUES (
-                :member_id, :partner_id, :offer_id, 'confirmed', NOW()
-            )
-            RETURNING id
-        """), {
-            "member_id": member_id,
-            "partner_id": partner_id,
-            "offer_id": offer_id
-        })
+        # Admission par le compteur atomique (voir flash_stock) avant toute écriture
+        left = reserve_stock(offer_id, member_id)
+        if left == ALREADY_RESERVED:
+            return jsonify({
+                "success": False,
+                "error": "Vous avez déjà réservé cette offre flash"
+            }), 400
+        if left is None or left == SOLD_OUT:
+            return jsonify({
+                "success": False,
+                "error": "Offre flash non disponible (stock épuisé ou expirée)"
+            }), 404
         
-        reservation_id = result.fetchone()[0]
-        db.session.commit()
+        # Créer la réservation flash (stock de l'offre reporté par lots, sauf admission en base)
+        try:
+            result = db.session.execute(text("""
+                INSERT INTO flash_reservations (
+                    member_id, partner_id, offer_id, status, stock_applied, created_at
+                )
+                VALUES (
+                    :member_id, :partner_id, :offer_id, 'confirmed', :stock_applied, NOW()
+                )
+                RETURNING id
+            """), {
+                "member_id": member_id,
+                "partner_id": partner_id,
+                "offer_id": offer_id,
+                "stock_applied": stock_counter.applies_stock
+            })
+            reservation_id = result.fetchone()[0]
+            db.session.execute(text("""
+                DELETE FROM waitlist WHERE offer_id = :offer_id AND member_id = :member_id
+            """), {"offer_id": offer_id, "member_id": member_id})
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            release_stock(offer_id, member_id)
+            raise
+        
+        if left == 0:
+            flash_stock_flusher.wake()  # Dernière place : stock à 0 en base sans attendre
         
         # TODO: Envoyer une notification au partenaire
         
@@ -394,6 +381,186 @@ def reserve_flash_offer(offer_id):
         return jsonify({"success": False, "error": str(e)}), 500
 
 
+def _current_member_id():
+    """member_id de l'utilisateur connecté, None s'il n'a pas de profil membre"""
+    member = db.session.execute(text("""
+        SELECT id FROM members WHERE user_id = :user_id
+    """), {"user_id": get_jwt_identity()}).fetchone()
+    return member[0] if member else None
+
+
+@flash_offers_bp.route('/api/member/offers/flash/<int:offer_id>/waitlist', methods=['POST'])
+@jwt_required()
+def join_flash_waitlist(offer_id):
+    """
+    S'inscrire sur la liste d'attente d'une offre flash
+    Le membre reçoit automatiquement une réservation dès qu'une place se libère (flash_waitlist)
+    """
+    try:
+        member_id = _current_member_id()
+        if member_id is None:
+            return jsonify({"success": False, "error": "Membre non trouvé"}), 404
+        
+        offer = db.session.execute(text("""
+            SELECT id FROM offers
+            WHERE id = :offer_id AND offer_type = 'flash' AND active = TRUE AND valid_until > NOW()
+        """), {"offer_id": offer_id}).fetchone()
+        
+        if not offer:
+            return jsonify({"success": False, "error": "Offre flash non disponible ou expirée"}), 404
+        
+        existing = db.session.execute(text("""
+            SELECT id FROM flash_reservations
+            WHERE member_id = :member_id AND offer_id = :offer_id AND status != 'cancelled'
+        """), {"member_id": member_id, "offer_id": offer_id}).fetchone()
+        
+        if existing:
+            return jsonify({"success": False, "error": "Vous avez déjà réservé cette offre flash"}), 400
+        
+        # Réinscription après une promotion sans place : retour en fin de file
+        db.session.execute(text("""
+            INSERT INTO waitlist (offer_id, member_id, joined_at, notified)
+            VALUES (:offer_id, :member_id, NOW(), FALSE)
+            ON CONFLICT (offer_id, member_id) DO UPDATE
+            SET joined_at = NOW(), notified = FALSE, notified_at = NULL
+            WHERE waitlist.notified = TRUE
+        """), {"offer_id": offer_id, "member_id": member_id})
+        db.session.commit()
+        
+        # Il reste peut-être du stock (annulation entre-temps) : le premier de la file en profite
+        waitlist_promoter.wake(offer_id)
+        
+        return jsonify({
+            "success": True,
+            "message": "Vous êtes sur la liste d'attente",
+            "position": waitlist_position(offer_id, member_id)
+        }), 201
+        
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({"success": False, "error": str(e)}), 500
+
+
+@flash_offers_bp.route('/api/member/offers/flash/<int:offer_id>/waitlist', methods=['DELETE'])
+@jwt_required()
+def leave_flash_waitlist(offer_id):
+    """
+    Quitter la liste d'attente d'une offre flash
+    """
+    try:
+        member_id = _current_member_id()
+        if member_id is None:
+            return jsonify({"success": False, "error": "Membre non trouvé"}), 404
+        
+        result = db.session.execute(text("""
+            DELETE FROM waitlist
+            WHERE offer_id = :offer_id AND member_id = :member_id AND notified = FALSE
+        """), {"offer_id": offer_id, "member_id": member_id})
+        db.session.commit()
+        
+        if result.rowcount == 0:
+            return jsonify({"success": False, "error": "Vous n'êtes pas sur la liste d'attente"}), 404
+        
+        return jsonify({"success": True, "message": "Vous avez quitté la liste d'attente"}), 200
+        
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({"success": False, "error": str(e)}), 500
+
+
+@flash_offers_bp.route('/api/member/flash-reservations/<int:reservation_id>/cancel', methods=['POST'])
+@jwt_required()
+def cancel_flash_reservation(reservation_id):
+    """
+    Annuler sa réservation d'offre flash : la place revient au premier de la liste d'attente
+    """
+    try:
+        member_id = _current_member_id()
+        if member_id is None:
+            return jsonify({"success": False, "error": "Membre non trouvé"}), 404
+        
+        lock = " FOR UPDATE" if db.engine.dialect.name == 'postgresql' else ""
+        reservation = db.session.execute(text(f"""
+            SELECT id, offer_id, status, stock_applied
+            FROM flash_reservations
+            WHERE id = :reservation_id AND member_id = :member_id{lock}
+        """), {"reservation_id": reservation_id, "member_id": member_id}).fetchone()
+        
+        if not reservation:
+            return jsonify({"success": False, "error": "Réservation non trouvée"}), 404
+        
+        if reservation[2] != 'confirmed':
+            return jsonify({"success": False, "error": "Cette réservation ne peut plus être annulée"}), 400
+        
+        offer_id = reservation[1]
+        # Place déjà décomptée de offers.stock : rendue ; sinon, plus jamais décomptée
+        if reservation[3]:
+            db.session.execute(text("""
+                UPDATE offers SET stock = stock + 1, updated_at = NOW() WHERE id = :offer_id
+            """), {"offer_id": offer_id})
+        db.session.execute(text("""
+            UPDATE flash_reservations
+            SET status = 'cancelled', cancelled_at = NOW(), updated_at = NOW(), stock_applied = TRUE
+            WHERE id = :reservation_id
+        """), {"reservation_id": reservation_id})
+        db.session.commit()
+        
+        restock(offer_id, 1, member_id)
+        waitlist_promoter.wake(offer_id)
+        
+        return jsonify({"success": True, "message": "Réservation annulée"}), 200
+        
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({"success": False, "error": str(e)}), 500
+
+
+@flash_offers_bp.route('/api/partner/offers/flash/<int:offer_id>/restock', methods=['POST'])
+@jwt_required()
+def restock_flash_offer(offer_id):
+    """
+    Augmenter le stock d'une offre flash (body : quantity) ; les places vont d'abord à la liste d'attente
+    """
+    try:
+        partner = db.session.execute(text("""
+            SELECT id FROM partners WHERE user_id = :user_id
+        """), {"user_id": get_jwt_identity()}).fetchone()
+        
+        if not partner:
+            return jsonify({"success": False, "error": "Partenaire non trouvé"}), 404
+        
+        data = request.get_json() or {}
+        try:
+            quantity = int(data.get('quantity', 0))
+        except (TypeError, ValueError):
+            quantity = 0
+        if quantity <= 0:
+            return jsonify({"success": False, "error": "quantity doit être un entier positif"}), 400
+        
+        # Offre épuisée désactivée par la maintenance : réactivée tant qu'elle n'est pas échue
+        offer = db.session.execute(text("""
+            UPDATE offers SET stock = stock + :quantity, active = TRUE, updated_at = NOW()
+            WHERE id = :offer_id AND partner_id = :partner_id
+            AND offer_type = 'flash' AND valid_until > NOW()
+            RETURNING id
+        """), {"offer_id": offer_id, "partner_id": partner[0], "quantity": quantity}).fetchone()
+        
+        if not offer:
+            return jsonify({"success": False, "error": "Offre flash non trouvée ou expirée"}), 404
+        
+        fan_out_offer(offer_id)  # Fils retirés si l'offre avait été désactivée
+        db.session.commit()
+        
+        restock(offer_id, quantity)
+        waitlist_promoter.wake(offer_id, quantity)
+        
+        return jsonify({"success": True, "message": f"Stock augmenté de {quantity}"}), 200
+        
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({"success": False, "error": str(e)}), 500
+
+
 @flash_offers_bp.route('/api/partner/flash-reservations/<int:reservation_id>/validate', methods=['POST'])
 @jwt_required()
 def validate_flash_reservation(reservation_id):
@@ -24,6 +24,7 @@ def migrate_flash_reservations():
             partner_notes TEXT,
             used_at TIMESTAMP,
             cancelled_at TIMESTAMP,
+            stock_applied BOOLEAN NOT NULL DEFAULT TRUE,
             created_at TIMESTAMP DEFAULT NOW(),
             updated_at TIMESTAMP DEFAULT NOW()
         );
@@ -33,6 +34,7 @@ def migrate_flash_reservations():
         CREATE INDEX IF NOT EXISTS idx_flash_reservations_offer ON flash_reservations(offer_id);
         CREATE INDEX IF NOT EXISTS idx_flash_reservations_status ON flash_reservations(status);
         CREATE INDEX IF NOT EXISTS idx_flash_reservations_created ON flash_reservations(created_at);
+        CREATE INDEX IF NOT EXISTS idx_flash_reservations_stock_pending ON flash_reservations(offer_id) WHERE stock_applied = FALSE;
         """
         
         db.session.execute(text(sql))
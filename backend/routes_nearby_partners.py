@@ -5,32 +5,10 @@ Routes API pour la liste géolocalisée des partenaires
 from flask import Blueprint, jsonify, request
 from flask_jwt_extended import jwt_required, get_jwt_identity
 from models import db, Partner, User, followers
-from sqlalchemy import func
-from math import radians, cos, sin, asin, sqrt
+from partner_geo_index import partner_geo_index, format_partner_address, format_branch_address
 
 nearby_partners_bp = Blueprint('nearby_partners', __name__, url_prefix='/api')
 
-def haversine(lat1, lon1, lat2, lon2):
-    """
-    Calcule la distance entre deux points géographiques en kilomètres
-    Formule Haversine
-    """
-    # Rayon de la Terre en km
-    R = 6371
-    
-    # Convertir en radians
-    lat1, lon1, lat2, lon2 = map(radians, [lat1, lon1, lat2, lon2])
-    
-    # Différences
-    dlat = lat2 - lat1
-    dlon = lon2 - lon1
-    
-    # Formule Haversine
-    a = sin(dlat/2)**2 + cos(lat1) * cos(lat2) * sin(dlon/2)**2
-    c = 2 * asin(sqrt(a))
-    
-    return R * c
-
 @nearby_partners_bp.route('/partners/nearby', methods=['POST'])
 @jwt_required()
 def get_nearby_partners():
@@ -56,45 +34,32 @@ def get_nearby_partners():
         if not user_lat or not user_lon:
             return jsonify({'error': 'Latitude et longitude requises'}), 400
         
-        # Récupérer tous les partenaires actifs
-        partners = Partner.query.filter_by(status='active').all()
+        # Distances calculées en un seul passage vectorisé sur l'index en mémoire
+        nearest = partner_geo_index.nearest(float(user_lat), float(user_lon), int(limit))
         
-        # Calculer la distance pour chaque partenaire
-        partners_with_distance = []
+        # Favoris de l'utilisateur en une seule requête
+        favorite_ids = {
+            row.partner_id for row in
+            db.session.query(followers.c.partner_id).filter(followers.c.user_id == user_id)
+        }
         
-        for partner in partners:
-            if partner.latitude and partner.longitude:
-                distance_km = haversine(user_lat, user_lon, partner.latitude, partner.longitude)
-                
-                # Vérifier si le partenaire est dans les favoris
-                is_favorite = db.session.query(followers).filter_by(
-                    user_id=user_id,
-                    partner_id=partner.id
-                ).first() is not None
-                
-                partners_with_distance.append({
-                    'id': partner.id,
-                    'name': partner.business_name,
-                    'category': partner.category or 'Commerce',
-                    'address': partner.address,
-                    'latitude': partner.latitude,
-                    'longitude': partner.longitude,
-                    'distance': round(distance_km, 2) if distance_km >= 1 else int(distance_km * 1000),
-                    'distance_unit': 'km' if distance_km >= 1 else 'm',
-                    'distance_raw': distance_km,  # Pour le tri
-                    'is_favorite': is_favorite,
-                    'logo_url': partner.logo_url if hasattr(partner, 'logo_url') else None
-                })
-        
-        # Trier par distance
-        partners_with_distance.sort(key=lambda x: x['distance_raw'])
-        
-        # Limiter le nombre de résultats
-        partners_with_distance = partners_with_distance[:limit]
-        
-        # Retirer distance_raw (utilisé uniquement pour le tri)
-        for partner in partners_with_distance:
-            del partner['distance_raw']
+        partners_with_distance = []
+        for distance_km, partner, _offers_count, branch in nearest:
+            # Établissement le plus proche (branch), sinon adresse principale
+            location = branch or partner
+            partners_with_distance.append({
+                'id': partner['id'],
+                'name': partner['name'],
+                'category': partner['category'] or 'Commerce',
+                'address': format_branch_address(branch) if branch else format_partner_address(partner),
+                'branch_id': branch['id'] if branch else None,
+                'latitude': location['latitude'],
+                'longitude': location['longitude'],
+                'distance': round(distance_km, 2) if distance_km >= 1 else int(distance_km * 1000),
+                'distance_unit': 'km' if distance_km >= 1 else 'm',
+                'is_favorite': partner['id'] in favorite_ids,
+                'logo_url': partner['image_url']
+            })
         
         return jsonify({
             'partners': partners_with_distance,
@@ -5,14 +5,11 @@ Routes API pour l'inscription et la gestion des partenaires
 from flask import Blueprint, request, jsonify
 from datetime import datetime, date
 from werkzeug.security import generate_password_hash
-from geopy.geocoders import Nominatim
-from geopy.exc import GeocoderTimedOut, GeocoderServiceError
 import re
 
-partners_bp = Blueprint('partners', __name__)
+from geocoding_jobs import apply_postcode_centroids, enqueue_partner_addresses, geocoding_worker, partner_geocoding_status
 
-# Initialiser le géocodeur Nominatim
-geolocator = Nominatim(user_agent="peps_partner_registration")
+partners_bp = Blueprint('partners', __name__)
 
 
 def validate_email(email: str) -> bool:
@@ -46,29 +43,6 @@ def calculate_age(birth_date: date) -> int:
     return today.year - birth_date.year - ((today.month, today.day) < (birth_date.month, birth_date.day))
 
 
-def geocode_address(address_data: dict) -> tuple:
-    """
-    Géocode une adresse en utilisant Nominatim.
-    Retourne (latitude, longitude) ou (None, None) en cas d'échec.
-    """
-    street = address_data.get('street', '')
-    number = address_data.get('number', '')
-    postal_code = address_data.get('postal_code', '')
-    city = address_data.get('city', '')
-    country = address_data.get('country', 'CH')
-
-    full_address = f"{number} {street}, {postal_code} {city}, {country}"
-    
-    try:
-        location = geolocator.geocode(full_address, timeout=10)
-        if location:
-            return location.latitude, location.longitude
-        return None, None
-    except (GeocoderTimedOut, GeocoderServiceError, ValueError) as e:
-        print(f"Erreur de géocodage pour {full_address}: {e}")
-        return None, None
-
-
 @partners_bp.route('/register', methods=['POST'])
 def register_partner():
     """
@@ -167,9 +141,9 @@ def register_partner():
         db.session.add(user)
         db.session.flush()  # Obtenir l'ID de l'utilisateur
         
-        # Géocoder la première adresse pour remplir les champs du Partner (rétrocompatibilité)
+        # Première adresse = champs du Partner (rétrocompatibilité)
+        # Coordonnées provisoires (centroïde du code postal), géocodage précis en tâche de fond (geocoding_jobs)
         primary_address = addresses_data[0]
-        primary_lat, primary_lon = geocode_address(primary_address)
         
         # Création du profil partenaire
         partner = Partner(
@@ -177,8 +151,6 @@ def register_partner():
             name=data['establishment_name'],
             category=establishment_type,
             city=primary_address['city'],
-            latitude=primary_lat,
-            longitude=primary_lon,
             image_url=data.get('logo_url'),
             # Rétrocompatibilité : Remplir les champs address_* avec la première adresse
             address_street=primary_address['street'],
@@ -195,9 +167,8 @@ def register_partner():
         db.session.flush()  # Obtenir l'ID du partenaire
         
         # Créer les enregistrements PartnerAddress pour chaque adresse
+        partner_addresses = []
         for i, addr_data in enumerate(addresses_data):
-            lat, lon = geocode_address(addr_data)
-            
             partner_address = PartnerAddress(
                 partner_id=partner.id,
                 street=addr_data['street'],
@@ -206,14 +177,19 @@ def register_partner():
                 city=addr_data['city'],
                 canton=addr_data.get('canton', ''),
                 country=country_name_to_iso(addr_data['country']),
-                latitude=lat,
-                longitude=lon,
                 is_primary=(i == 0)  # La première adresse est primaire
             )
             db.session.add(partner_address)
+            partner_addresses.append(partner_address)
+        apply_postcode_centroids(partner, partner_addresses)
+        db.session.flush()  # Obtenir les IDs des adresses
+        
+        # Jobs de géocodage créés dans la même transaction que les adresses
+        enqueue_partner_addresses(partner.id, partner_addresses)
         
         # Commit de toute la transaction
         db.session.commit()
+        geocoding_worker.wake()
         
         # TODO: Envoyer un email de confirmation au partenaire
         # TODO: Envoyer un email de notification à l'admin
@@ -223,7 +199,8 @@ def register_partner():
             'message': 'Inscription réussie. Votre compte est en attente de validation par notre équipe. Vous recevrez un email de confirmation sous 24-48h.',
             'partner_id': partner.id,
             'addresses_count': len(addresses_data),
-            'status': 'pending'
+            'status': 'pending',
+            'geocoding_status': 'pending'
         }), 201
     
     except Exception as e:
@@ -232,6 +209,30 @@ def register_partner():
         return jsonify({'success': False, 'error': f'Erreur serveur: {str(e)}'}), 500
 
 
+@partners_bp.route('/<int:partner_id>/geocoding-status', methods=['GET'])
+def get_geocoding_status(partner_id):
+    """
+    Avancement du géocodage des adresses d'un partenaire (fait en tâche de fond après l'inscription)
+    """
+    try:
+        status, jobs = partner_geocoding_status(partner_id)
+        
+        return jsonify({
+            'success': True,
+            'partner_id': partner_id,
+            'geocoding_status': status,
+            'addresses': [{
+                'address_id': job.partner_address_id,
+                'status': job.status,
+                'attempts': job.attempts,
+                'next_attempt_at': job.next_attempt_at.isoformat() if job.status == 'pending' else None
+            } for job in jobs]
+        }), 200
+    
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+
 @partners_bp.route('/categories', methods=['GET'])
 def get_categories():
     """
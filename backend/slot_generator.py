@@ -0,0 +1,285 @@
+"""
+Génération incrémentale des créneaux (Creneau) de tous les commerçants
+- Chaque nuit, seuls les jours manquants en fin d'horizon (advance_booking_days) sont ajoutés
+- Les créneaux existants ne sont jamais supprimés ni réinsérés (index idx_partner_start_available stable)
+- Insertion en INSERT multi-lignes par lots
+- resync_partner_slots() réaligne tout l'horizon après une modification de la configuration
+- Horaires compilés en bitmaps par jour de semaine (CompiledSchedule), partagés avec
+  le calcul des disponibilités, la recherche et la validation des réservations
+"""
+import threading
+from datetime import datetime, timedelta
+
+import pytz
+from sqlalchemy import exists, func, text
+
+from models import db, Booking, Creneau, PartnerBookingConfig
+
+TIMEZONE = pytz.timezone('Europe/Zurich')  # Horaires d'ouverture saisis en heure locale
+INSERT_BATCH_SIZE = 1000
+GENERATION_LOCK_ID = 720013  # pg_try_advisory_lock : une seule génération à la fois (workers gunicorn)
+
+BOOKING_MODE_VIRTUAL = 'virtual'  # PartnerBookingConfig.booking_mode : aucun Creneau matérialisé
+
+WEEKDAYS = ('monday', 'tuesday', 'wednesday', 'thursday', 'friday', 'saturday', 'sunday')
+
+
+def _minutes(hour_minute):
+    """'HH:MM' -> minutes depuis minuit"""
+    value = datetime.strptime(hour_minute, '%H:%M')
+    return value.hour * 60 + value.minute
+
+
+class CompiledSchedule:
+    """
+    Horaires d'un commerçant compilés une fois pour toutes (au lieu de relire le JSON
+    à chaque calcul) : par jour de semaine, une bitmap entière des créneaux ouverts.
+    Bit i = créneau commençant à origin + i × slot_minutes (minutes locales depuis minuit),
+    origin alignant la grille sur l'heure d'ouverture.
+    """
+
+    def __init__(self, config):
+        self.partner_id = config.partner_id
+        self.slot_minutes = config.slot_duration_minutes
+        self.closed = frozenset(config.closed_dates or [])
+        self.weekdays = []
+        for weekday in WEEKDAYS:
+            day_config = (config.opening_hours or {}).get(weekday)
+            if not day_config or not day_config.get('enabled'):
+                self.weekdays.append((0, 0))
+                continue
+            try:
+                open_minutes, close_minutes = _minutes(day_config['open']), _minutes(day_config['close'])
+            except (ValueError, KeyError) as e:
+                print(f"   ❌ Partenaire {config.partner_id} : horaire invalide pour {weekday} ({e})")
+                self.weekdays.append((0, 0))
+                continue
+            origin = open_minutes % self.slot_minutes
+            first = open_minutes // self.slot_minutes
+            count = max((close_minutes - origin) // self.slot_minutes - first, 0)
+            self.weekdays.append((origin, ((1 << count) - 1) << first))
+
+    def day(self, day):
+        """(origin, bitmap des créneaux ouverts) d'un jour local"""
+        if day.isoformat() in self.closed:
+            return 0, 0
+        return self.weekdays[day.weekday()]
+
+    def start_of(self, day, origin, index):
+        """Début (UTC naïf) du créneau `index` d'un jour local"""
+        local = datetime.combine(day, datetime.min.time()) + timedelta(minutes=origin + index * self.slot_minutes)
+        return TIMEZONE.localize(local).astimezone(pytz.utc).replace(tzinfo=None)
+
+    def index_of(self, day, origin, start_utc):
+        """Position dans la bitmap d'un jour local d'un début UTC naïf"""
+        local = pytz.utc.localize(start_utc).astimezone(TIMEZONE).replace(tzinfo=None)
+        minutes = int((local - datetime.combine(day, datetime.min.time())).total_seconds() // 60)
+        return (minutes - origin) // self.slot_minutes
+
+    def slots(self, day, mask=None):
+        """Créneaux (début, fin) UTC des bits de `mask` (défaut : tous les créneaux ouverts)"""
+        origin, opened = self.day(day)
+        mask = opened if mask is None else mask
+        step = timedelta(minutes=self.slot_minutes)
+        result = []
+        index = 0
+        while mask:
+            if mask & 1:
+                start = self.start_of(day, origin, index)
+                result.append((start, start + step))
+            mask >>= 1
+            index += 1
+        return result
+
+
+_compiled = {}
+_compiled_lock = threading.Lock()
+
+
+def compiled_schedule(config):
+    """CompiledSchedule d'une configuration, recompilé seulement quand elle change (updated_at)"""
+    version = (config.updated_at, config.slot_duration_minutes)
+    if config.updated_at is None:
+        return CompiledSchedule(config)  # Configuration pas encore enregistrée
+    with _compiled_lock:
+        entry = _compiled.get(config.partner_id)
+        if entry is not None and entry[0] == version:
+            return entry[1]
+    schedule = CompiledSchedule(config)
+    with _compiled_lock:
+        _compiled[config.partner_id] = (version, schedule)
+    return schedule
+
+
+def runs_of(mask, length):
+    """Bits i tels que les bits i .. i+length-1 sont tous à 1 (départs d'une série)"""
+    result = mask
+    for shift in range(1, length):
+        result &= mask >> shift
+    return result
+
+
+def day_slots(config, day):
+    """Créneaux (début, fin) en UTC d'une journée selon les horaires d'ouverture"""
+    return compiled_schedule(config).slots(day)
+
+
+def horizon(config, today=None):
+    """[premier jour, dernier jour] réservables (dates locales)"""
+    today = today or datetime.now(TIMEZONE).date()
+    return today, today + timedelta(days=max(config.advance_booking_days or 0, 1) - 1)
+
+
+def _day_start_utc(day):
+    return TIMEZONE.localize(datetime.combine(day, datetime.min.time())).astimezone(pytz.utc).replace(tzinfo=None)
+
+
+def _existing_starts(partner_id, first_day, last_day):
+    """Débuts des créneaux génériques (service_id NULL) existants sur [first_day, last_day]"""
+    rows = db.session.query(Creneau.start_datetime).filter(
+        Creneau.partner_id == partner_id,
+        Creneau.service_id.is_(None),
+        Creneau.start_datetime >= _day_start_utc(first_day),
+        Creneau.start_datetime < _day_start_utc(last_day + timedelta(days=1))
+    )
+    return {start for (start,) in rows}
+
+
+def _insert_slots(rows):
+    """INSERT multi-lignes par lots (insertmanyvalues de SQLAlchemy sur PostgreSQL)"""
+    for i in range(0, len(rows), INSERT_BATCH_SIZE):
+        db.session.execute(Creneau.__table__.insert(), rows[i:i + INSERT_BATCH_SIZE])
+
+
+def generate_partner_slots(config, first_day, last_day):
+    """
+    Ajoute les créneaux manquants de [first_day, last_day] pour un commerçant (sans commit).
+    Retourne le nombre de créneaux insérés.
+    """
+    if first_day > last_day:
+        return 0
+    existing = _existing_starts(config.partner_id, first_day, last_day)
+    now = datetime.utcnow()
+    rows = []
+    day = first_day
+    while day <= last_day:
+        for start, end in day_slots(config, day):
+            if start in existing:
+                continue
+            rows.append({
+                'partner_id': config.partner_id, 'service_id': None,
+                'start_datetime': start, 'end_datetime': end,
+                'capacity': config.max_concurrent_bookings or 1, 'booked_count': 0,
+                'is_available': True, 'created_at': now
+            })
+        day += timedelta(days=1)
+    _insert_slots(rows)
+    return len(rows)
+
+
+def resync_partner_slots(config, today=None):
+    """
+    Réaligne tout l'horizon sur la configuration actuelle (sans commit) :
+    ajoute les créneaux manquants, supprime les créneaux futurs sans réservation
+    qui ne correspondent plus aux horaires (désactive ceux qu'une réservation annulée
+    référence encore), met à jour leur capacité.
+    Retourne (ajoutés, retirés).
+    """
+    first_day, last_day = horizon(config, today)
+    wanted = {}
+    day = first_day
+    while day <= last_day:
+        wanted.update(day_slots(config, day))
+        day += timedelta(days=1)
+
+    capacity = config.max_concurrent_bookings or 1
+    obsolete = []
+    for slot in Creneau.query.filter(
+        Creneau.partner_id == config.partner_id,
+        Creneau.service_id.is_(None),
+        Creneau.start_datetime >= max(_day_start_utc(first_day), datetime.utcnow())
+    ):
+        if slot.booked_count:
+            continue
+        if wanted.get(slot.start_datetime) != slot.end_datetime:
+            obsolete.append(slot.id)
+        elif slot.capacity != capacity:
+            slot.capacity = capacity
+    if obsolete:
+        # Créneaux encore référencés par une réservation (annulée) : désactivés, pas supprimés
+        referenced = exists().where(Booking.creneau_id == Creneau.id)
+        Creneau.query.filter(Creneau.id.in_(obsolete), referenced).update(
+            {Creneau.is_available: False}, synchronize_session=False
+        )
+        Creneau.query.filter(Creneau.id.in_(obsolete), ~referenced).delete(synchronize_session=False)
+
+    added = generate_partner_slots(config, first_day, last_day)
+    return added, len(obsolete)
+
+
+def generate_all_slots(today=None):
+    """
+    Prolonge l'horizon de tous les commerçants dont la réservation est activée.
+    Un commit par commerçant ; retourne {'partners', 'created', 'errors'}.
+    """
+    # Importé ici : booking_availability dépend du cache de l'application
+    from booking_availability import invalidate_availability
+
+    configs = PartnerBookingConfig.query.filter(
+        PartnerBookingConfig.is_enabled.is_(True),
+        PartnerBookingConfig.booking_mode != BOOKING_MODE_VIRTUAL  # Disponibilités calculées, sans créneaux
+    ).order_by(PartnerBookingConfig.partner_id).all()
+    # Dernier créneau générique de chaque commerçant (une seule requête)
+    last_starts = dict(db.session.query(Creneau.partner_id, func.max(Creneau.start_datetime)).filter(
+        Creneau.service_id.is_(None)
+    ).group_by(Creneau.partner_id).all())
+
+    print(f"🗓️ Génération des créneaux : {len(configs)} commerçant(s)")
+    summary = {'partners': len(configs), 'created': 0, 'errors': 0}
+    for position, config in enumerate(configs, start=1):
+        first_day, last_day = horizon(config, today)
+        last_start = last_starts.get(config.partner_id)
+        if last_start is not None:
+            # Reprise le lendemain du dernier jour déjà généré
+            last_generated = pytz.utc.localize(last_start).astimezone(TIMEZONE).date()
+            first_day = max(first_day, last_generated + timedelta(days=1))
+        try:
+            created = generate_partner_slots(config, first_day, last_day)
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            summary['errors'] += 1
+            print(f"   ❌ [{position}/{len(configs)}] Partenaire {config.partner_id} : {e}")
+            continue
+        summary['created'] += created
+        if created:
+            invalidate_availability(config.partner_id)
+        days = (last_day - first_day).days + 1 if first_day <= last_day else 0
+        print(f"   ✅ [{position}/{len(configs)}] Partenaire {config.partner_id} : +{created} créneaux ({days} jour(s))")
+
+    print(f"✅ {summary['created']} créneaux générés, {summary['errors']} erreur(s)")
+    return summary
+
+
+def scheduled_slot_generation(app):
+    """Tâche planifiée : un seul worker à la fois génère (verrou PostgreSQL)"""
+    with app.app_context():
+        if db.engine.dialect.name != 'postgresql':
+            try:
+                generate_all_slots()
+            except Exception as e:
+                db.session.rollback()
+                print(f"❌ Erreur génération des créneaux: {e}")
+            return
+        with db.engine.connect() as lock_conn:
+            if not lock_conn.execute(text("SELECT pg_try_advisory_lock(:id)"), {'id': GENERATION_LOCK_ID}).scalar():
+                print("ℹ️ Génération des créneaux déjà en cours dans un autre processus")
+                return
+            try:
+                generate_all_slots()
+            except Exception as e:
+                db.session.rollback()
+                print(f"❌ Erreur génération des créneaux: {e}")
+            finally:
+                lock_conn.execute(text("SELECT pg_advisory_unlock(:id)"), {'id': GENERATION_LOCK_ID})
+                db.session.remove()
@@ -1,20 +1,10 @@
-import os
-from twilio.rest import Client
+from notification_senders import senders
 
 def send_sms(to_number, message_body):
-    sid = os.getenv('TWILIO_ACCOUNT_SID')
-    token = os.getenv('TWILIO_AUTH_TOKEN')
-    sender = os.getenv('TWILIO_PHONE_NUMBER')
-
-    if not sid or not token:
-        print(f"📱 [SMS SIMULÉ] Vers: {to_number} | Msg: {message_body}")
-        return True
-
-    try:
-        client = Client(sid, token)
-        msg = client.messages.create(body=message_body, from_=sender, to=to_number)
-        print(f"✅ SMS envoyé: {msg.sid}")
-        return True
-    except Exception as e:
-        print(f"❌ Erreur SMS: {e}")
-        return False
+    # Client Twilio partagé (voir notification_senders), SMS simulé sans identifiants
+    ok, error = senders['sms'].send_batch([{'to': to_number, 'body': message_body}])[0]
+    if ok:
+        print(f"✅ SMS envoyé vers {to_number}")
+    else:
+        print(f"❌ Erreur SMS: {error}")
+    return ok
@@ -0,0 +1,82 @@
+"""
+Construction de requêtes SQL de proximité
+Filtre d'abord sur un rectangle latitude/longitude (servi par l'index
+idx_partners_status_lat_lng), puis calcule la distance exacte sur les survivants
+"""
+
+from typing import Dict, Optional
+
+from .spatial_index import EARTH_RADIUS_KM, bounding_box
+
+
+class GeoQuery:
+    """
+    Fragments SQL paramétrés pour une recherche autour d'un point.
+
+    Example:
+        >>> geo = GeoQuery(46.52, 6.63, 10)
+        >>> sql = f"SELECT p.id, {geo.distance('p.latitude', 'p.longitude')} AS d FROM partners p WHERE {geo.within('p.latitude', 'p.longitude')}"
+        >>> db.session.execute(text(sql), geo.params)
+    """
+
+    def __init__(self, lat: float, lng: float, radius_km: float, prefix: str = 'geo'):
+        self.lat = float(lat)
+        self.lng = float(lng)
+        self.radius_km = float(radius_km)
+        self.prefix = prefix
+        min_lat, max_lat, min_lng, max_lng = bounding_box(self.lat, self.lng, self.radius_km)
+        self.params: Dict[str, float] = {
+            f'{prefix}_lat': self.lat,
+            f'{prefix}_lng': self.lng,
+            f'{prefix}_radius_km': self.radius_km,
+            f'{prefix}_min_lat': min_lat,
+            f'{prefix}_max_lat': max_lat,
+            f'{prefix}_min_lng': min_lng,
+            f'{prefix}_max_lng': max_lng,
+        }
+
+    def _param(self, name: str) -> str:
+        return f':{self.prefix}_{name}'
+
+    def bbox(self, lat_col: str, lng_col: str) -> str:
+        """Prédicat rectangle (indexable, sans trigonométrie)"""
+        return (
+            f"{lat_col} BETWEEN {self._param('min_lat')} AND {self._param('max_lat')} "
+            f"AND {lng_col} BETWEEN {self._param('min_lng')} AND {self._param('max_lng')}"
+        )
+
+    def distance(self, lat_col: str, lng_col: str) -> str:
+        """Expression SQL de la distance Haversine en km"""
+        lat, lng = self._param('lat'), self._param('lng')
+        return (
+            f"(2 * {EARTH_RADIUS_KM} * asin(sqrt(LEAST(1.0, "
+            f"power(sin(radians({lat_col} - {lat}) / 2), 2) "
+            f"+ cos(radians({lat})) * cos(radians({lat_col})) "
+            f"* power(sin(radians({lng_col} - {lng}) / 2), 2)))))"
+        )
+
+    def within(self, lat_col: str, lng_col: str) -> str:
+        """Rectangle puis distance exacte"""
+        return f"({self.bbox(lat_col, lng_col)} AND {self.distance(lat_col, lng_col)} <= {self._param('radius_km')})"
+
+    def nearby_query(self, select: str, from_clause: str, lat_col: str, lng_col: str,
+                     where: str = 'TRUE', limit: Optional[int] = None) -> str:
+        """
+        Requête complète : sélection dans le rectangle, distance calculée
+        pour les seules lignes restantes, tri par distance.
+        La distance est exposée sous le nom `distance_km`.
+        """
+        query = f"""
+            SELECT * FROM (
+                SELECT {select}, {self.distance(lat_col, lng_col)} AS distance_km
+                FROM {from_clause}
+                WHERE {self.bbox(lat_col, lng_col)}
+                    AND ({where})
+            ) AS geo_candidates
+            WHERE distance_km <= {self._param('radius_km')}
+            ORDER BY distance_km ASC
+        """
+        if limit is not None:
+            self.params[f'{self.prefix}_limit'] = int(limit)
+            query += f" LIMIT {self._param('limit')}"
+        return query
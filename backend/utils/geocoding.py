@@ -1,12 +1,16 @@
 """
 Utilitaire de géocodage pour convertir les adresses en coordonnées GPS
 Utilise l'API Nominatim d'OpenStreetMap (gratuite, pas de clé API requise)
+Les réponses passent par le cache de géocodage partagé (geocoding_cache) ;
+si Nominatim est indisponible, repli sur le centroïde du code postal (postcode_gazetteer)
 """
 
 import requests
-import time
 from typing import Dict, Optional, Tuple
 
+from .geocoding_cache import country_code, geocoding_cache, structured_address_key
+from .postcode_gazetteer import postcode_gazetteer
+
 class GeocodingService:
     """Service de géocodage utilisant Nominatim (OpenStreetMap)"""
     
@@ -70,17 +74,19 @@ class GeocodingService:
             'countrycodes': country.lower()
         }
         
-        try:
-            # Respect de la politique d'utilisation de Nominatim (max 1 requête/seconde)
-            time.sleep(1)
-            
+        def fetch():
             response = self.session.get(self.BASE_URL, params=params, timeout=10)
             response.raise_for_status()
-            
             results = response.json()
+            return results[0] if results else None
+        
+        try:
+            # Cache partagé ; la politique Nominatim (max 1 requête/seconde) n'est appliquée qu'aux appels réseau
+            result = geocoding_cache.geocode(
+                structured_address_key(street, number, postal_code, city, country), fetch
+            )
             
-            if results and len(results) > 0:
-                result = results[0]
+            if result:
                 lat = float(result['lat'])
                 lon = float(result['lon'])
                 return (lat, lon)
@@ -89,6 +95,11 @@ class GeocodingService:
         
         except requests.exceptions.RequestException as e:
             print(f"Erreur lors du géocodage: {e}")
+            # Repli hors ligne : centroïde du code postal
+            centroid = postcode_gazetteer.lookup(country_code(country).upper(), postal_code)
+            if centroid:
+                print(f"📮 Centroïde du code postal {postal_code} utilisé")
+                return (centroid[0], centroid[1])
             return None
         except (KeyError, ValueError, IndexError) as e:
             print(f"Erreur lors du parsing de la réponse: {e}")
@@ -156,14 +167,14 @@ class GeocodingService:
             'addressdetails': 1
         }
         
-        try:
-            # Respect de la politique d'utilisation de Nominatim
-            time.sleep(1)
-            
+        def fetch():
             response = self.session.get(url, params=params, timeout=10)
             response.raise_for_status()
-            
             result = response.json()
+            return result if result and 'address' in result else None
+        
+        try:
+            result = geocoding_cache.reverse(latitude, longitude, fetch)
             
             if result and 'address' in result:
                 address = result['address']
@@ -0,0 +1,168 @@
+"""
+Cache de géocodage partagé par tous les géocodeurs Nominatim
+- Clé : adresse normalisée (géocodage direct) ou coordonnées arrondies (inverse)
+- LRU en mémoire devant la table geocode_cache (partagée entre workers et scripts)
+- Les adresses introuvables sont aussi mises en cache (NOT_FOUND_TTL)
+- Un seul appel réseau par NOMINATIM_MIN_INTERVAL, tous géocodeurs confondus
+"""
+import re
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+from sqlalchemy import delete, insert, select
+from sqlalchemy.exc import IntegrityError
+
+from models import db, GeocodeCacheEntry
+from .text_index import normalize_text
+
+REVERSE_PRECISION = 4  # ~11 m : même bâtiment
+NOT_FOUND_TTL = timedelta(days=7)
+NOMINATIM_MIN_INTERVAL = 1.1  # Politique Nominatim : 1 requête/seconde max
+MAX_MEMORY_ENTRIES = 4096
+MAX_KEY_LENGTH = 500
+
+_SEPARATORS = re.compile(r"[^\w]+")
+
+_COUNTRY_CODES = {
+    'switzerland': 'ch', 'suisse': 'ch', 'schweiz': 'ch', 'svizzera': 'ch',
+    'france': 'fr',
+    'belgium': 'be', 'belgique': 'be', 'belgie': 'be',
+    'luxembourg': 'lu',
+}
+
+
+def _normalize(value):
+    return ' '.join(_SEPARATORS.sub(' ', normalize_text(str(value) if value else '')).split())
+
+
+def country_code(country):
+    """Code ISO (minuscules) à partir d'un code ou d'un nom de pays"""
+    country = _normalize(country)
+    if len(country) == 2:
+        return country
+    return _COUNTRY_CODES.get(country, country)
+
+
+def address_key(query, country=None):
+    """Clé d'une adresse en texte libre (casse, accents et ponctuation ignorés)"""
+    key = _normalize(query)
+    if country:
+        key = f"{country_code(country)}|{key}"
+    return key[:MAX_KEY_LENGTH]
+
+
+def structured_address_key(street, number, postal_code, city, country='CH'):
+    """Clé d'une adresse structurée, identique quel que soit le géocodeur appelant"""
+    parts = ' '.join(_normalize(part) for part in (number, street, postal_code, city) if part)
+    return f"{country_code(country or 'CH')}|{parts}"[:MAX_KEY_LENGTH]
+
+
+def coordinates_key(latitude, longitude):
+    """Clé d'un géocodage inverse (coordonnées arrondies à REVERSE_PRECISION décimales)"""
+    return f"{float(latitude):.{REVERSE_PRECISION}f},{float(longitude):.{REVERSE_PRECISION}f}"
+
+
+class NominatimThrottle:
+    """Espace les appels réseau d'au moins `interval` secondes (par processus)"""
+
+    def __init__(self, interval=NOMINATIM_MIN_INTERVAL):
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._last_call = 0.0
+
+    def wait(self):
+        with self._lock:
+            delay = self._last_call + self.interval - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            self._last_call = time.monotonic()
+
+
+class GeocodingCache:
+    """
+    Les résultats sont les réponses brutes de Nominatim (dict avec lat, lon,
+    display_name et address), quel que soit le client utilisé (requests ou geopy).
+
+    Lectures et écritures en base passent par une connexion dédiée : elles ne
+    touchent pas à la transaction en cours de l'appelant (ex: inscription partenaire).
+    """
+
+    def __init__(self, max_entries=MAX_MEMORY_ENTRIES):
+        self.max_entries = max_entries
+        self.throttle = NominatimThrottle()
+        self._lock = threading.Lock()
+        self._memory = OrderedDict()
+
+    def _remember(self, cache_key, place):
+        with self._lock:
+            self._memory[cache_key] = place
+            self._memory.move_to_end(cache_key)
+            if len(self._memory) > self.max_entries:
+                self._memory.popitem(last=False)
+
+    def _lookup(self, kind, key):
+        """(trouvé, résultat) depuis la mémoire puis la base"""
+        cache_key = (kind, key)
+        with self._lock:
+            if cache_key in self._memory:
+                self._memory.move_to_end(cache_key)
+                return True, self._memory[cache_key]
+
+        table = GeocodeCacheEntry.__table__
+        try:
+            with db.engine.connect() as connection:
+                row = connection.execute(
+                    select(table.c.place, table.c.created_at)
+                    .where(table.c.kind == kind, table.c.query_key == key)
+                ).first()
+        except Exception as e:
+            print(f"⚠️ Cache de géocodage indisponible: {e}")
+            return False, None
+
+        if row is None:
+            return False, None
+        if row.place is None and row.created_at < datetime.utcnow() - NOT_FOUND_TTL:
+            return False, None  # "Introuvable" expiré : on retente
+        self._remember(cache_key, row.place)
+        return True, row.place
+
+    def _store(self, kind, key, place):
+        self._remember((kind, key), place)
+        table = GeocodeCacheEntry.__table__
+        try:
+            with db.engine.begin() as connection:
+                connection.execute(delete(table).where(table.c.kind == kind, table.c.query_key == key))
+                connection.execute(insert(table).values(
+                    kind=kind, query_key=key, place=place, created_at=datetime.utcnow()
+                ))
+        except IntegrityError:
+            pass  # Écrit en parallèle par un autre processus
+        except Exception as e:
+            print(f"⚠️ Écriture du cache de géocodage impossible: {e}")
+
+    def _resolve(self, kind, key, fetch):
+        found, place = self._lookup(kind, key)
+        if found:
+            return place
+        self.throttle.wait()
+        # Les exceptions de fetch (timeout, service indisponible) ne sont pas mises en cache
+        place = fetch()
+        self._store(kind, key, place)
+        return place
+
+    def geocode(self, key, fetch):
+        """
+        Résultat Nominatim pour une adresse (None si introuvable).
+        `key` vient de address_key() ou structured_address_key(),
+        `fetch()` interroge Nominatim et retourne le résultat brut ou None.
+        """
+        return self._resolve('forward', key, fetch)
+
+    def reverse(self, latitude, longitude, fetch):
+        """Résultat Nominatim pour des coordonnées (None si introuvable)"""
+        return self._resolve('reverse', coordinates_key(latitude, longitude), fetch)
+
+
+geocoding_cache = GeocodingCache()
@@ -0,0 +1,199 @@
+"""
+Gazetteer hors ligne des codes postaux (CH, FR, BE) : code postal -> centroïde + localité
+Fichier binaire compact (data/postcode_gazetteer.bin, généré par build_postcode_gazetteer.py
+à partir des exports GeoNames), lu en mémoire partagée (mmap) : aucun appel réseau.
+
+Format du fichier :
+    MAGIC (8 octets) | longueur de l'en-tête (uint32) | en-tête JSON | blocs alignés sur 8 octets
+    Par pays : codes (uint32, triés), lats / lngs (float32), début / longueur du nom (uint32 / uint16)
+    Noms des localités : un seul bloc UTF-8
+"""
+
+import json
+import os
+import struct
+import threading
+from typing import Dict, Iterable, Optional, Tuple
+
+import numpy as np
+
+from .spatial_index import haversine_km_array
+
+MAGIC = b'PEPSGZ01'
+DEFAULT_PATH = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'data', 'postcode_gazetteer.bin')
+COUNTRIES = ('CH', 'FR', 'BE')
+
+_COLUMNS = (
+    ('codes', np.uint32),
+    ('lats', np.float32),
+    ('lngs', np.float32),
+    ('name_starts', np.uint32),
+    ('name_lengths', np.uint16),
+)
+
+
+def _postcode_number(postcode) -> Optional[int]:
+    """Code postal numérique ('01000' -> 1000), None si non numérique"""
+    value = str(postcode or '').strip().replace(' ', '')
+    return int(value) if value.isdigit() else None
+
+
+def write_gazetteer(path: str, entries: Dict[str, Iterable[Tuple[str, float, float, str]]], source: str = '') -> Dict[str, int]:
+    """
+    Écrit le fichier binaire.
+    entries : {pays: [(code postal, lat, lng, localité)]} (un centroïde par code postal)
+    Retourne le nombre de codes écrits par pays.
+    """
+    names = bytearray()
+    countries = {}
+    for country, rows in entries.items():
+        rows = sorted(
+            ((_postcode_number(code), lat, lng, city) for code, lat, lng, city in rows),
+            key=lambda row: row[0]
+        )
+        columns = {name: [] for name, _dtype in _COLUMNS}
+        for code, lat, lng, city in rows:
+            encoded = (city or '').encode('utf-8')[:65535]
+            columns['codes'].append(code)
+            columns['lats'].append(lat)
+            columns['lngs'].append(lng)
+            columns['name_starts'].append(len(names))
+            columns['name_lengths'].append(len(encoded))
+            names.extend(encoded)
+        countries[country] = {name: np.asarray(columns[name], dtype=dtype) for name, dtype in _COLUMNS}
+
+    # Offsets relatifs au début des données
+    blocks = []
+    offset = 0
+    header = {'source': source, 'countries': {}, 'names': None}
+
+    def add_block(data: bytes) -> int:
+        nonlocal offset
+        start = offset
+        padding = (-len(data)) % 8
+        blocks.append(data + b'\0' * padding)
+        offset += len(data) + padding
+        return start
+
+    for country, arrays in countries.items():
+        header['countries'][country] = {'count': int(arrays['codes'].size)}
+        for name, _dtype in _COLUMNS:
+            header['countries'][country][name] = add_block(arrays[name].tobytes())
+    header['names'] = {'offset': add_block(bytes(names)), 'length': len(names)}
+
+    header_bytes = json.dumps(header).encode('utf-8')
+    header_bytes += b' ' * ((-(len(MAGIC) + 4 + len(header_bytes))) % 8)
+    with open(path, 'wb') as f:
+        f.write(MAGIC)
+        f.write(struct.pack('<I', len(header_bytes)))
+        f.write(header_bytes)
+        for block in blocks:
+            f.write(block)
+    return {country: header['countries'][country]['count'] for country in countries}
+
+
+class PostcodeGazetteer:
+    """
+    Lecture du gazetteer (chargé au premier appel, partagé en mmap entre les processus).
+    Si le fichier est absent, toutes les recherches retournent None.
+    """
+
+    def __init__(self, path: str = DEFAULT_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._loaded = False
+        self._countries = {}
+        self._names = None
+        # Tous pays confondus, pour la recherche du code postal le plus proche
+        self._all_lats = self._all_lngs = None
+        self._all_index = []
+
+    def _load(self):
+        with self._lock:
+            if self._loaded:
+                return
+            self._loaded = True
+            if not os.path.exists(self.path):
+                print(f"ℹ️ Gazetteer des codes postaux absent ({self.path})")
+                return
+            try:
+                data = np.memmap(self.path, dtype=np.uint8, mode='r')
+                if bytes(data[:len(MAGIC)]) != MAGIC:
+                    raise ValueError("format de fichier inconnu")
+                header_length = struct.unpack('<I', bytes(data[len(MAGIC):len(MAGIC) + 4]))[0]
+                start = len(MAGIC) + 4
+                header = json.loads(bytes(data[start:start + header_length]).decode('utf-8'))
+                base = start + header_length
+
+                countries = {}
+                for country, info in header['countries'].items():
+                    countries[country] = {
+                        name: np.frombuffer(data, dtype=dtype, count=info['count'], offset=base + info[name])
+                        for name, dtype in _COLUMNS
+                    }
+                names = header['names']
+                self._names = data[base + names['offset']:base + names['offset'] + names['length']]
+                self._countries = countries
+                self._all_lats = np.concatenate([c['lats'] for c in countries.values()]).astype(np.float64)
+                self._all_lngs = np.concatenate([c['lngs'] for c in countries.values()]).astype(np.float64)
+                self._all_index = [(country, c['codes'].size) for country, c in countries.items()]
+                total = sum(c['codes'].size for c in countries.values())
+                print(f"📮 Gazetteer chargé : {total} codes postaux ({', '.join(countries)})")
+            except Exception as e:
+                self._countries = {}
+                print(f"⚠️ Gazetteer des codes postaux illisible: {e}")
+
+    @property
+    def available(self) -> bool:
+        self._load()
+        return bool(self._countries)
+
+    def _name(self, arrays, i) -> str:
+        start = int(arrays['name_starts'][i])
+        return bytes(self._names[start:start + int(arrays['name_lengths'][i])]).decode('utf-8')
+
+    def _find(self, country, postcode):
+        self._load()
+        arrays = self._countries.get((country or '').upper())
+        code = _postcode_number(postcode)
+        if arrays is None or code is None:
+            return None, None
+        i = int(np.searchsorted(arrays['codes'], code))
+        if i < arrays['codes'].size and arrays['codes'][i] == code:
+            return arrays, i
+        return arrays, None
+
+    def lookup(self, country: str, postcode) -> Optional[Tuple[float, float, str]]:
+        """(lat, lng, localité) du centroïde d'un code postal, None si inconnu"""
+        arrays, i = self._find(country, postcode)
+        if i is None:
+            return None
+        # float32 : 6 décimales suffisent (~10 cm)
+        return round(float(arrays['lats'][i]), 6), round(float(arrays['lngs'][i]), 6), self._name(arrays, i)
+
+    def has_postcode(self, country: str, postcode) -> Optional[bool]:
+        """True/False si le pays est couvert, None si le gazetteer ne peut pas répondre"""
+        arrays, i = self._find(country, postcode)
+        if arrays is None:
+            return None
+        return i is not None
+
+    def nearest(self, lat: float, lng: float) -> Optional[Tuple[str, str, str, float]]:
+        """(pays, code postal, localité, distance_km) du centroïde le plus proche"""
+        self._load()
+        if not self._countries:
+            return None
+        distances = haversine_km_array(lat, lng, self._all_lats, self._all_lngs)
+        best = int(np.argmin(distances))
+        position = best  # Position dans le bloc du pays
+        for country, count in self._all_index:
+            if position < count:
+                arrays = self._countries[country]
+                width = 5 if country == 'FR' else 4
+                postcode = str(int(arrays['codes'][position])).zfill(width)
+                return country, postcode, self._name(arrays, position), float(distances[best])
+            position -= count
+        return None
+
+
+postcode_gazetteer = PostcodeGazetteer()
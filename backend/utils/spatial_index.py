@@ -0,0 +1,125 @@
+"""
+Index spatial en mémoire (grille uniforme latitude/longitude)
+Permet de répondre aux recherches par rayon en ne parcourant que les cellules voisines
+"""
+
+from math import radians, cos, sin, asin, sqrt, floor
+from typing import Dict, Hashable, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+EARTH_RADIUS_KM = 6371.0
+KM_PER_DEGREE_LAT = 111.32
+
+
+def haversine_km(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    """Distance en km entre deux points GPS (formule Haversine)"""
+    lat1, lon1, lat2, lon2 = map(radians, [lat1, lon1, lat2, lon2])
+    dlat = lat2 - lat1
+    dlon = lon2 - lon1
+    a = sin(dlat / 2) ** 2 + cos(lat1) * cos(lat2) * sin(dlon / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * asin(sqrt(min(1.0, a)))
+
+
+def haversine_km_array(lat: float, lon: float, lats: np.ndarray, lons: np.ndarray) -> np.ndarray:
+    """Distances en km entre un point et des tableaux de points (calcul vectorisé)"""
+    lat1, lon1 = radians(lat), radians(lon)
+    lat2 = np.radians(lats)
+    dlat = lat2 - lat1
+    dlon = np.radians(lons) - lon1
+    a = np.sin(dlat / 2) ** 2 + cos(lat1) * np.cos(lat2) * np.sin(dlon / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.minimum(1.0, a)))
+
+
+def nearest_indices(distances: np.ndarray, limit: int) -> np.ndarray:
+    """Indices des `limit` plus petites distances, triés (argpartition puis tri partiel)"""
+    if limit <= 0 or distances.size == 0:
+        return np.empty(0, dtype=np.intp)
+    if limit < distances.size:
+        candidates = np.argpartition(distances, limit - 1)[:limit]
+    else:
+        candidates = np.arange(distances.size)
+    return candidates[np.argsort(distances[candidates], kind='stable')]
+
+
+def bounding_box(lat: float, lng: float, radius_km: float) -> Tuple[float, float, float, float]:
+    """
+    Rectangle (min_lat, max_lat, min_lng, max_lng) qui contient le cercle du rayon donné
+    """
+    delta_lat = radius_km / KM_PER_DEGREE_LAT
+    cos_lat = cos(radians(lat))
+    if cos_lat < 1e-6 or abs(lat) + delta_lat >= 90:
+        # Proche des pôles : toute la bande de longitudes
+        return max(-90.0, lat - delta_lat), min(90.0, lat + delta_lat), -180.0, 180.0
+    delta_lng = min(180.0, radius_km / (KM_PER_DEGREE_LAT * cos_lat))
+    return lat - delta_lat, lat + delta_lat, lng - delta_lng, lng + delta_lng
+
+
+class SpatialGrid:
+    """
+    Grille uniforme de cellules de `cell_size_deg` degrés.
+    Chaque point est identifié par une clé (ex: id du partenaire).
+    """
+
+    def __init__(self, cell_size_deg: float = 0.1):
+        self.cell_size_deg = cell_size_deg
+        self._cells: Dict[Tuple[int, int], Dict[Hashable, Tuple[float, float]]] = {}
+        self._positions: Dict[Hashable, Tuple[int, int]] = {}
+
+    def __len__(self) -> int:
+        return len(self._positions)
+
+    def _cell(self, lat: float, lng: float) -> Tuple[int, int]:
+        return floor(lat / self.cell_size_deg), floor(lng / self.cell_size_deg)
+
+    def insert(self, key: Hashable, lat: float, lng: float) -> None:
+        """Ajoute ou déplace un point"""
+        self.remove(key)
+        cell = self._cell(lat, lng)
+        self._cells.setdefault(cell, {})[key] = (lat, lng)
+        self._positions[key] = cell
+
+    def remove(self, key: Hashable) -> None:
+        """Retire un point (sans erreur s'il est absent)"""
+        cell = self._positions.pop(key, None)
+        if cell is None:
+            return
+        points = self._cells.get(cell)
+        if points is not None:
+            points.pop(key, None)
+            if not points:
+                del self._cells[cell]
+
+    def iter_box(self, min_lat: float, max_lat: float, min_lng: float, max_lng: float) -> Iterator[Tuple[Hashable, float, float]]:
+        """Parcourt les points des cellules qui recouvrent le rectangle donné"""
+        lat_start, lng_start = self._cell(min_lat, min_lng)
+        lat_end, lng_end = self._cell(max_lat, max_lng)
+        if (lat_end - lat_start + 1) * (lng_end - lng_start + 1) > len(self._cells):
+            # Rectangle plus grand que la grille occupée : parcours direct des cellules
+            for (cell_lat, cell_lng), points in self._cells.items():
+                if lat_start <= cell_lat <= lat_end and lng_start <= cell_lng <= lng_end:
+                    for key, (lat, lng) in points.items():
+                        yield key, lat, lng
+            return
+        for cell_lat in range(lat_start, lat_end + 1):
+            for cell_lng in range(lng_start, lng_end + 1):
+                points = self._cells.get((cell_lat, cell_lng))
+                if points:
+                    for key, (lat, lng) in points.items():
+                        yield key, lat, lng
+
+    def query_radius(self, lat: float, lng: float, radius_km: float, limit: Optional[int] = None) -> List[Tuple[float, Hashable]]:
+        """
+        Points à moins de `radius_km` de (lat, lng), triés par distance croissante.
+        Retourne une liste de (distance_km, clé).
+        """
+        min_lat, max_lat, min_lng, max_lng = bounding_box(lat, lng, radius_km)
+        results = []
+        for key, point_lat, point_lng in self.iter_box(min_lat, max_lat, min_lng, max_lng):
+            distance = haversine_km(lat, lng, point_lat, point_lng)
+            if distance <= radius_km:
+                results.append((distance, key))
+        results.sort(key=lambda item: item[0])
+        if limit is not None:
+            results = results[:limit]
+        return results
@@ -0,0 +1,128 @@
+"""
+Index textuel en mémoire (n-grammes + préfixes de mots)
+Sert de recherche "contient" et d'autocomplétion quand pg_trgm n'est pas disponible
+"""
+
+import bisect
+import unicodedata
+from typing import Dict, Hashable, Iterable, List, Optional, Set, Tuple
+
+NGRAM_SIZE = 3
+
+
+def normalize_text(value: Optional[str]) -> str:
+    """Minuscules, sans accents, espaces normalisés"""
+    if not value:
+        return ""
+    decomposed = unicodedata.normalize('NFKD', value.casefold())
+    stripped = ''.join(c for c in decomposed if not unicodedata.combining(c))
+    return ' '.join(stripped.split())
+
+
+def ngrams(value: str, size: int = NGRAM_SIZE) -> Set[str]:
+    """N-grammes d'un texte déjà normalisé"""
+    if len(value) < size:
+        return {value} if value else set()
+    return {value[i:i + size] for i in range(len(value) - size + 1)}
+
+
+class NgramIndex:
+    """
+    Index inversé n-gramme -> documents, pour plusieurs champs texte par document.
+    Les champs sont classés par importance (le premier compte le plus pour l'autocomplétion).
+    """
+
+    def __init__(self, fields: Tuple[str, ...]):
+        self.fields = fields
+        self._docs: Dict[Hashable, Dict[str, str]] = {}
+        self._postings: Dict[str, Set[Hashable]] = {}
+        # Par champ, listes triées (texte complet, clé) et (mot, clé) pour la recherche par préfixe
+        self._full: List[List[Tuple[str, Hashable]]] = [[] for _ in fields]
+        self._words: List[List[Tuple[str, Hashable]]] = [[] for _ in fields]
+
+    def __len__(self) -> int:
+        return len(self._docs)
+
+    def _prefix_entries(self, key: Hashable, doc: Dict[str, str]):
+        """(liste triée, entrée) à maintenir pour un document"""
+        for rank, field in enumerate(self.fields):
+            text = doc[field]
+            if not text:
+                continue
+            yield self._full[rank], (text, key)
+            # Le premier mot est déjà couvert par le texte complet
+            for word in set(text.split(' ')[1:]):
+                yield self._words[rank], (word, key)
+
+    def add(self, key: Hashable, values: Dict[str, Optional[str]]) -> None:
+        """Ajoute ou remplace un document"""
+        self.remove(key)
+        doc = {field: normalize_text(values.get(field)) for field in self.fields}
+        self._docs[key] = doc
+        for field in self.fields:
+            for gram in ngrams(doc[field]):
+                self._postings.setdefault(gram, set()).add(key)
+        for entries, entry in self._prefix_entries(key, doc):
+            bisect.insort(entries, entry)
+
+    def remove(self, key: Hashable) -> None:
+        """Retire un document (sans erreur s'il est absent)"""
+        doc = self._docs.pop(key, None)
+        if doc is None:
+            return
+        for field in self.fields:
+            for gram in ngrams(doc[field]):
+                keys = self._postings.get(gram)
+                if keys is not None:
+                    keys.discard(key)
+                    if not keys:
+                        del self._postings[gram]
+        for entries, entry in self._prefix_entries(key, doc):
+            position = bisect.bisect_left(entries, entry)
+            if position < len(entries) and entries[position] == entry:
+                del entries[position]
+
+    def search(self, query: str, fields: Optional[Iterable[str]] = None) -> Set[Hashable]:
+        """Documents dont un des champs contient la requête (sous-chaîne)"""
+        query = normalize_text(query)
+        fields = tuple(fields or self.fields)
+        if not query:
+            return set(self._docs)
+        grams = ngrams(query)
+        if len(query) >= NGRAM_SIZE:
+            postings = sorted((self._postings.get(gram, set()) for gram in grams), key=len)
+            candidates = set(postings[0]).intersection(*postings[1:]) if postings else set()
+        else:
+            candidates = self._docs.keys()
+        return {key for key in candidates if any(query in self._docs[key][field] for field in fields)}
+
+    def prefix(self, query: str, limit: int = 10) -> List[Hashable]:
+        """
+        Documents dont un mot commence par la requête, classés par :
+        champ le plus important, texte complet avant mot isolé, puis ordre alphabétique.
+        Les paliers déjà triés (texte complet) s'arrêtent dès que `limit` est atteint.
+        """
+        query = normalize_text(query)
+        if not query or limit <= 0:
+            return []
+        results: List[Hashable] = []
+        seen: Set[Hashable] = set()
+        for rank, field in enumerate(self.fields):
+            for entries, presorted in ((self._full[rank], True), (self._words[rank], False)):
+                tier = []
+                position = bisect.bisect_left(entries, (query,))
+                while position < len(entries) and entries[position][0].startswith(query):
+                    key = entries[position][1]
+                    position += 1
+                    if key in seen:
+                        continue
+                    seen.add(key)
+                    tier.append(key)
+                    if presorted and len(results) + len(tier) >= limit:
+                        break
+                if not presorted:
+                    tier.sort(key=lambda key: (self._docs[key][field], self._docs[key][self.fields[0]]))
+                results.extend(tier)
+                if len(results) >= limit:
+                    return results[:limit]
+        return results
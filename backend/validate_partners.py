@@ -4,15 +4,22 @@ Système de Validation et Audit des Partenaires PEP's - VERSION MULTI-PAYS
 - Détecte les coordonnées GPS incohérentes avec le pays déclaré
 - Valide les codes postaux par pays
 - Identifie les doublons
+- Contrôles hors ligne via le gazetteer des codes postaux (aucun appel réseau pendant l'audit)
 - Génère des rapports d'audit détaillés
 """
 
 from sqlalchemy import text, func
 from models import db, Partner
+from utils.postcode_gazetteer import postcode_gazetteer
 import re
 from datetime import datetime
 import json
 
+# Au-delà, le centroïde de code postal le plus proche n'indique plus le pays
+GAZETTEER_COUNTRY_MAX_KM = 25
+# Distance maximale tolérée entre le GPS et le centroïde du code postal déclaré
+GPS_POSTCODE_MAX_KM = 30
+
 class PartnerValidator:
     def __init__(self):
         # Limites géographiques par pays
@@ -94,6 +101,11 @@ class PartnerValidator:
         if not lat or not lng:
             return None, 'GPS manquant'
         
+        # Code postal le plus proche (les rectangles CH/FR/BE se chevauchent près des frontières)
+        nearest = postcode_gazetteer.nearest(lat, lng)
+        if nearest and nearest[3] <= GAZETTEER_COUNTRY_MAX_KM:
+            return nearest[0], self.COUNTRY_BOUNDS[nearest[0]]['name']
+        
         for country_code, bounds in self.COUNTRY_BOUNDS.items():
             if (bounds['lat_min'] <= lat <= bounds['lat_max'] and
                 bounds['lng_min'] <= lng <= bounds['lng_max']):
@@ -273,6 +285,34 @@ class PartnerValidator:
             })
             if severity_level in ['valid', 'warning']:
                 severity_level = 'error'
+        else:
+            # Existence du code postal et cohérence avec le GPS (gazetteer hors ligne)
+            normalized_country = self.normalize_country_code(partner.address_country)
+            known = postcode_gazetteer.has_postcode(normalized_country, partner.address_postal_code)
+            if known is False:
+                partner_issues.append({
+                    'type': 'unknown_postcode',
+                    'severity': 'warning',
+                    'message': f'Code postal inconnu en {normalized_country}: {partner.address_postal_code}',
+                    'field': 'address_postal_code'
+                })
+                if severity_level == 'valid':
+                    severity_level = 'warning'
+            elif known and partner.latitude and partner.longitude:
+                centroid_lat, centroid_lng, centroid_city = postcode_gazetteer.lookup(
+                    normalized_country, partner.address_postal_code
+                )
+                distance = self.calculate_distance(partner.latitude, partner.longitude, centroid_lat, centroid_lng)
+                if distance > GPS_POSTCODE_MAX_KM:
+                    partner_issues.append({
+                        'type': 'gps_postcode_mismatch',
+                        'severity': 'warning',
+                        'message': f'GPS à {distance:.0f} km du code postal {partner.address_postal_code} ({centroid_city})',
+                        'field': 'latitude, longitude, address_postal_code',
+                        'suggestion': 'Vérifier l\'adresse ou relancer le géocodage'
+                    })
+                    if severity_level == 'valid':
+                        severity_level = 'warning'
         
         # Rue manquante
         if not partner.address_street:
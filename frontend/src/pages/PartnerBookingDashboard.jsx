@@ -1,13 +1,26 @@
 import React, { useState, useEffect } from 'react';
-import { Calendar, Clock, Settings, Users, CheckCircle, XCircle, Plus, Edit, Trash2 } from 'lucide-react';
+import { Calendar, Clock, Settings, Users, CheckCircle, XCircle, Plus, Edit, Trash2, ChevronLeft, ChevronRight } from 'lucide-react';
 
 const API_URL = import.meta.env.VITE_API_URL || 'http://localhost:5000';
 
+// Dates locales AAAA-MM-JJ (pas toISOString : décalage UTC)
+const toDayString = (date) =>
+  `${date.getFullYear()}-${String(date.getMonth() + 1).padStart(2, '0')}-${String(date.getDate()).padStart(2, '0')}`;
+
+const daysOfMonth = (month) => {
+  const [year, monthIndex] = month.split('-').map(Number);
+  const count = new Date(year, monthIndex, 0).getDate();
+  return Array.from({ length: count }, (_, i) => toDayString(new Date(year, monthIndex - 1, i + 1)));
+};
+
 export default function PartnerBookingDashboard({ partnerId }) {
   const [activeTab, setActiveTab] = useState('bookings'); // bookings, services, config
   const [config, setConfig] = useState(null);
   const [services, setServices] = useState([]);
-  const [bookings, setBookings] = useState([]);
+  const [bookings, setBookings] = useState([]); // Réservations du jour affiché
+  const [nextCursor, setNextCursor] = useState(null);
+  const [selectedDay, setSelectedDay] = useState(() => toDayString(new Date()));
+  const [monthSummary, setMonthSummary] = useState({ days: [], total_bookings: 0 });
   const [loading, setLoading] = useState(true);
   const [showServiceModal, setShowServiceModal] = useState(false);
   const [showBookingModal, setShowBookingModal] = useState(false);
@@ -21,17 +34,26 @@ export default function PartnerBookingDashboard({ partnerId }) {
     notes: ''
   });
 
+  const month = selectedDay.slice(0, 7);
+
   useEffect(() => {
     loadData();
   }, [partnerId]);
 
+  useEffect(() => {
+    loadMonth();
+  }, [partnerId, month]);
+
+  useEffect(() => {
+    loadBookings();
+  }, [partnerId, selectedDay]);
+
   const loadData = async () => {
     setLoading(true);
     try {
       await Promise.all([
         loadConfig(),
-        loadServices(),
-        loadBookings()
+        loadServices()
       ]);
     } catch (error) {
       console.error('Erreur chargement:', error);
@@ -52,10 +74,36 @@ export default function PartnerBookingDashboard({ partnerId }) {
     if (data.success) setServices(data.services);
   };
 
-  const loadBookings = async () => {
-    const res = await fetch(`${API_URL}/api/partner/${partnerId}/bookings`);
+  // Résumé du mois (agrégat SQL par jour) : pas de lignes de réservation
+  const loadMonth = async () => {
+    const res = await fetch(`${API_URL}/api/partner/${partnerId}/bookings/calendar?month=${month}`);
+    const data = await res.json();
+    if (data.success) setMonthSummary(data);
+  };
+
+  // Lignes du jour affiché uniquement, page par page (next_cursor)
+  const loadBookings = async (cursor = null) => {
+    const start = new Date(`${selectedDay}T00:00:00`);
+    const nextDay = new Date(start);
+    nextDay.setDate(nextDay.getDate() + 1);
+    const end = new Date(nextDay.getTime() - 1); // end_date inclusif
+    const params = new URLSearchParams({ start_date: start.toISOString(), end_date: end.toISOString() });
+    if (cursor) params.set('cursor', cursor);
+    const res = await fetch(`${API_URL}/api/partner/${partnerId}/bookings?${params}`);
     const data = await res.json();
-    if (data.success) setBookings(data.bookings);
+    if (!data.success) return;
+    setBookings(previous => (cursor ? [...previous, ...data.bookings] : data.bookings));
+    setNextCursor(data.next_cursor);
+  };
+
+  const refreshBookings = () => {
+    loadMonth();
+    loadBookings();
+  };
+
+  const shiftMonth = (delta) => {
+    const [year, monthIndex] = month.split('-').map(Number);
+    setSelectedDay(toDayString(new Date(year, monthIndex - 1 + delta, 1)));
   };
 
   const toggleBookingSystem = async () => {
@@ -96,7 +144,7 @@ export default function PartnerBookingDashboard({ partnerId }) {
     const data = await res.json();
     if (data.success) {
       alert('✅ Réservation annulée');
-      loadBookings();
+      refreshBookings();
     }
   };
 
@@ -152,7 +200,7 @@ export default function PartnerBookingDashboard({ partnerId }) {
                 }`}
               >
                 <Users className="inline mr-2" size={18} />
-                Réservations ({bookings.length})
+                Réservations ({monthSummary.total_bookings})
               </button>
               <button
                 onClick={() => setActiveTab('services')}
@@ -184,7 +232,7 @@ export default function PartnerBookingDashboard({ partnerId }) {
             {activeTab === 'bookings' && (
               <div>
                 <div className="flex items-center justify-between mb-4">
-                  <h2 className="text-xl font-bold">Réservations à venir</h2>
+                  <h2 className="text-xl font-bold">Agenda</h2>
                   <button
                     onClick={() => setShowBookingModal(true)}
                     className="flex items-center gap-2 bg-blue-600 hover:bg-blue-700 text-white px-4 py-2 rounded-lg font-semibold transition-colors"
@@ -193,10 +241,46 @@ export default function PartnerBookingDashboard({ partnerId }) {
                     Créer un rendez-vous
                   </button>
                 </div>
+                {/* Mois : nombre de réservations par jour (agrégat) */}
+                <div className="mb-6">
+                  <div className="flex items-center justify-between mb-3">
+                    <button onClick={() => shiftMonth(-1)} className="p-2 rounded-lg hover:bg-gray-100">
+                      <ChevronLeft size={20} />
+                    </button>
+                    <span className="font-semibold capitalize">
+                      {new Date(`${month}-01T00:00:00`).toLocaleDateString('fr-FR', { month: 'long', year: 'numeric' })}
+                    </span>
+                    <button onClick={() => shiftMonth(1)} className="p-2 rounded-lg hover:bg-gray-100">
+                      <ChevronRight size={20} />
+                    </button>
+                  </div>
+                  <div className="grid grid-cols-7 gap-2">
+                    {daysOfMonth(month).map((day) => {
+                      const summary = monthSummary.days.find(d => d.date === day);
+                      return (
+                        <button
+                          key={day}
+                          onClick={() => setSelectedDay(day)}
+                          className={`p-2 rounded-lg text-sm border transition-colors ${
+                            day === selectedDay
+                              ? 'border-blue-600 bg-blue-50 text-blue-700'
+                              : 'border-gray-200 hover:bg-gray-50'
+                          }`}
+                        >
+                          <div className="font-semibold">{Number(day.slice(8))}</div>
+                          <div className="text-xs text-gray-500">{summary?.bookings ? `${summary.bookings} rés.` : '–'}</div>
+                        </button>
+                      );
+                    })}
+                  </div>
+                </div>
+                <h3 className="text-lg font-semibold mb-3">
+                  {new Date(`${selectedDay}T00:00:00`).toLocaleDateString('fr-FR', { weekday: 'long', day: 'numeric', month: 'long' })}
+                </h3>
                 {bookings.length === 0 ? (
                   <div className="text-center py-12 text-gray-500">
                     <Calendar size={48} className="mx-auto mb-4 opacity-50" />
-                    <p>Aucune réservation pour le moment</p>
+                    <p>Aucune réservation ce jour</p>
                   </div>
                 ) : (
                   <div className="space-y-4">
@@ -261,6 +345,14 @@ export default function PartnerBookingDashboard({ partnerId }) {
                         </div>
                       </div>
                     ))}
+                    {nextCursor && (
+                      <button
+                        onClick={() => loadBookings(nextCursor)}
+                        className="w-full py-2 text-blue-600 hover:bg-blue-50 rounded-lg font-semibold transition-colors"
+                      >
+                        Afficher plus
+                      </button>
+                    )}
                   </div>
                 )}
               </div>
@@ -422,7 +514,7 @@ export default function PartnerBookingDashboard({ partnerId }) {
             const data = await res.json();
             if (data.success) {
               alert('✅ Rendez-vous créé avec succès !');
-              loadBookings();
+              refreshBookings();
             } else {
               throw new Error(data.error || 'Erreur création');
             }